@@ -0,0 +1,145 @@
+""" An HTTP/2 version of the local Rave stub, for benchmarking Http2Transport. It needs the h2 package (part of the http2 extra).
+
+It speaks HTTP/2 over plain TCP without negotiation, so clients must use prior knowledge
+(Http2Transport(priorKnowledge=True)). Every stream is answered on its own thread, so slow responses do not hold
+up the others on the same connection. Responses are the same canned ones as stub_server.
+"""
+import socket, threading, time
+from urllib.parse import urlparse, parse_qsl
+from h2.config import H2Configuration
+from h2.connection import H2Connection
+from h2.events import RequestReceived, DataReceived, StreamEnded, StreamReset, ConnectionTerminated
+from stub_server import _transfers, _respond, _encodeBody, _decodeBody
+
+
+class _Connection(object):
+    def __init__(self, server, sock):
+        self.server = server
+        self.sock = sock
+        self.conn = H2Connection(config=H2Configuration(client_side=False, header_encoding="utf-8"))
+        # Guards conn and the socket, which are shared by the threads answering streams
+        self.lock = threading.Condition()
+        self.streams = {}
+        self.closed = False
+
+    def flush(self):
+        data = self.conn.data_to_send()
+        if data:
+            self.sock.sendall(data)
+
+    def serve(self):
+        with self.lock:
+            self.conn.initiate_connection()
+            self.flush()
+        try:
+            while True:
+                data = self.sock.recv(65536)
+                if not data:
+                    break
+                with self.lock:
+                    events = self.conn.receive_data(data)
+                    for event in events:
+                        self.handle(event)
+                    self.flush()
+                    self.lock.notify_all()
+                if any(isinstance(event, ConnectionTerminated) for event in events):
+                    break
+        except (OSError, ValueError):
+            pass
+        finally:
+            with self.lock:
+                self.closed = True
+                self.lock.notify_all()
+            self.sock.close()
+
+    def handle(self, event):
+        if isinstance(event, RequestReceived):
+            self.streams[event.stream_id] = {"headers": dict(event.headers), "body": []}
+        elif isinstance(event, DataReceived):
+            self.streams[event.stream_id]["body"].append(event.data)
+            self.conn.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+        elif isinstance(event, StreamEnded):
+            request = self.streams.pop(event.stream_id)
+            thread = threading.Thread(target=self.answer, args=(event.stream_id, request))
+            thread.daemon = True
+            thread.start()
+        elif isinstance(event, StreamReset):
+            self.streams.pop(event.stream_id, None)
+
+    def answer(self, streamId, request):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        headers = request["headers"]
+        url = urlparse(headers[":path"])
+        if headers[":method"] == "GET" and url.path.rstrip("/").endswith("transfers"):
+            page = dict(parse_qsl(url.query)).get("page", "None")
+            payload = _transfers(int(page) if page.isdigit() else 1)
+        elif headers[":method"] == "GET":
+            payload = _respond(url.path, dict(parse_qsl(url.query)))
+        else:
+            payload = _respond(url.path, _decodeBody(b"".join(request["body"]), headers.get("content-encoding", None)))
+
+        if headers[":method"] == "HEAD":
+            raw, encoding = b"", None
+        else:
+            raw, encoding = _encodeBody(payload, headers.get("accept-encoding", None))
+        responseHeaders = [(":status", "200"), ("content-type", "application/json"), ("content-length", str(len(raw)))]
+        if encoding:
+            responseHeaders.append(("content-encoding", encoding))
+
+        with self.lock:
+            if self.closed:
+                return
+            self.conn.send_headers(streamId, responseHeaders, end_stream=not raw)
+            self.flush()
+            while raw:
+                # Bodies larger than the flow control window wait for the client to open it again
+                size = min(len(raw), self.conn.local_flow_control_window(streamId), self.conn.max_outbound_frame_size)
+                if size <= 0:
+                    self.lock.wait()
+                    if self.closed:
+                        return
+                    continue
+                self.conn.send_data(streamId, raw[:size], end_stream=size == len(raw))
+                raw = raw[size:]
+                self.flush()
+
+
+class Http2StubServer(object):
+    """ This is the stub server. It counts the connections it accepts in .connections """
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.connections = 0
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind(("127.0.0.1", 0))
+        self._sock.listen(128)
+        self.server_address = self._sock.getsockname()
+
+    def serve_forever(self):
+        while True:
+            try:
+                sock, _ = self._sock.accept()
+            except OSError:
+                return
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.connections += 1
+            thread = threading.Thread(target=_Connection(self, sock).serve)
+            thread.daemon = True
+            thread.start()
+
+    def shutdown(self):
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._sock.close()
+
+
+def startHttp2StubServer(latency=0.0):
+    """ This starts the HTTP/2 stub server on a free local port in a daemon thread. Returns the server and its base url """
+    server = Http2StubServer(latency)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, "http://127.0.0.1:{}/".format(server.server_address[1])
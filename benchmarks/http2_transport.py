@@ -0,0 +1,134 @@
+""" HTTP/1.1 RaveTransport against HTTP/2 Http2Transport, each against its local stub server. Needs the http2 extra.
+
+Every run sends the same mix from many threads through one shared Rave object: card charges and verifies,
+Transfer.bulk calls with large bulk_data lists and Transfer.fetch pages. A counting proxy in front of each
+stub measures the connections opened and the bytes sent each way.
+
+    python benchmarks/http2_transport.py --threads 32 --calls 400 --bulk 20 --rows 500 --latency 0.02
+"""
+import argparse, os, socket, sys, threading, time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from python_rave import Rave, RaveTransport, Http2Transport
+from stub_server import startStubServer, useStub
+from http2_stub import startHttp2StubServer
+from stress_threads import PAYLOAD
+
+
+class CountingProxy(object):
+    """ This is a TCP proxy that counts the connections through it and the bytes in each direction """
+    def __init__(self, target):
+        self._target = target
+        self._lock = threading.Lock()
+        self.connections = 0
+        self.sent = 0
+        self.received = 0
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.bind(("127.0.0.1", 0))
+        self._sock.listen(128)
+        thread = threading.Thread(target=self._accept)
+        thread.daemon = True
+        thread.start()
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{}/".format(self._sock.getsockname()[1])
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self._sock.accept()
+            except OSError:
+                return
+            upstream = socket.create_connection(self._target)
+            for sock in (client, upstream):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            with self._lock:
+                self.connections += 1
+            for source, destination, counter in ((client, upstream, "sent"), (upstream, client, "received")):
+                thread = threading.Thread(target=self._pump, args=(source, destination, counter))
+                thread.daemon = True
+                thread.start()
+
+    def _pump(self, source, destination, counter):
+        try:
+            while True:
+                data = source.recv(65536)
+                if not data:
+                    break
+                destination.sendall(data)
+                with self._lock:
+                    setattr(self, counter, getattr(self, counter) + len(data))
+        except OSError:
+            pass
+        finally:
+            for sock in (source, destination):
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    def close(self):
+        self._sock.close()
+
+
+def bulkPayload(index, rows):
+    return {"title": "payroll-{}".format(index), "bulk_data": [{"Bank": "044", "Account Number": "0690000032", "Amount": 500, "Currency": "NGN", "Narration": "salary", "reference": "payroll-{}-{}".format(index, row)} for row in range(rows)]}
+
+
+def work(rave, index, bulkEvery, rows):
+    res = rave.Card.charge(dict(PAYLOAD, txRef="http2-{}".format(index)))
+    rave.Card.verify(res["txRef"])
+    requests = 2
+    if bulkEvery and index % bulkEvery == 0:
+        rave.Transfer.bulk(bulkPayload(index, rows))
+        for page in (1, 2, 3):
+            for transfer in rave.Transfer.fetch(page=page, stream=True):
+                pass
+        requests += 4
+    return requests
+
+
+def runOnce(name, transport, target, threads, calls, bulk, rows):
+    proxy = CountingProxy(target)
+    rave = Rave("FLWPUBK-http2", "FLWSECK-e6db11d1f8a6208de8cb2f94e293450e-X", usingEnv=False, transport=transport)
+    useStub(rave, proxy.url)
+    bulkEvery = max(1, calls // bulk) if bulk else 0
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        requests = sum(executor.map(lambda index: work(rave, index, bulkEvery, rows), range(calls)))
+    elapsed = time.time() - start
+    transport.close()
+    time.sleep(0.1)
+    proxy.close()
+    print("{:<22} {:>11} {:>10} {:>12} {:>12} {:>9.2f} {:>10.1f}".format(name, proxy.connections, requests, proxy.sent, proxy.received, elapsed, requests / elapsed))
+
+
+def run(threads, calls, bulk, rows, latency, maxConnections):
+    http1, http1Url = startStubServer(latency)
+    http2, http2Url = startHttp2StubServer(latency)
+    http1Target, http2Target = http1.server_address, http2.server_address
+
+    print("{:<22} {:>11} {:>10} {:>12} {:>12} {:>9} {:>10}".format("transport", "connections", "requests", "bytes sent", "bytes recv", "seconds", "req/sec"))
+    try:
+        runOnce("HTTP/1.1", RaveTransport(poolSize=threads), http1Target, threads, calls, bulk, rows)
+        runOnce("HTTP/1.1 gzip bodies", RaveTransport(poolSize=threads, compressAbove=1024), http1Target, threads, calls, bulk, rows)
+        runOnce("HTTP/2", Http2Transport(maxConnections=maxConnections, priorKnowledge=True), http2Target, threads, calls, bulk, rows)
+        runOnce("HTTP/2 gzip bodies", Http2Transport(maxConnections=maxConnections, priorKnowledge=True, compressAbove=1024), http2Target, threads, calls, bulk, rows)
+    finally:
+        http1.shutdown()
+        http2.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--calls", type=int, default=400, help="charge and verify pairs per transport")
+    parser.add_argument("--bulk", type=int, default=20, help="Transfer.bulk calls (each followed by three fetches) per transport")
+    parser.add_argument("--rows", type=int, default=500, help="rows in each bulk_data list")
+    parser.add_argument("--latency", type=float, default=0.02, help="simulated server latency in seconds")
+    parser.add_argument("--max-connections", type=int, default=2, help="HTTP/2 connections the transport may open")
+    args = parser.parse_args()
+    run(args.threads, args.calls, args.bulk, args.rows, args.latency, args.max_connections)
@@ -0,0 +1,197 @@
+""" Micro-benchmarks of the CPU-bound paths of the package, with stored baselines.
+
+Nothing here touches the network: charges go through an in-memory transport that answers with the stub
+server's canned responses. Each benchmark reports the fastest time per call over several repeats.
+
+    python benchmarks/micro.py run                                   # print timings
+    python benchmarks/micro.py save                                  # store them as the baseline
+    python benchmarks/micro.py compare --threshold 0.15              # exits with 1 if anything is still slower when timed again
+    python benchmarks/micro.py compare --only encrypt --repeat 9
+
+Baselines depend on the machine, so compare against one saved on the same machine (and python version).
+"""
+import argparse, json, os, platform, sys, timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import requests
+from requests.structures import CaseInsensitiveDict
+from python_rave import Rave, RaveTransport
+from python_rave.rave_misc import checkIfParametersAreComplete, updatePayload, generateTransactionReference
+from python_rave.rave_payment import Payment
+from stub_server import _respond
+from stress_threads import PAYLOAD
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "micro.json")
+SECRET_KEY = "FLWSECK-e6db11d1f8a6208de8cb2f94e293450e-X"
+CARD_PARAMETERS = ["cardno", "cvv", "expirymonth", "expiryyear", "amount", "email", "phonenumber", "firstname", "lastname", "IP"]
+
+
+def _response(payload, status=200):
+    response = requests.models.Response()
+    response.status_code = status
+    response.headers = CaseInsensitiveDict({"Content-Type": "application/json"})
+    response._content = json.dumps(payload).encode("utf-8")
+    response._content_consumed = True
+    response.encoding = "utf-8"
+    return response
+
+
+class CannedTransport(RaveTransport):
+    """ This is a transport that answers every request with the stub server's canned response, without any network """
+    def __init__(self):
+        super(CannedTransport, self).__init__(poolSize=1)
+
+    def request(self, method, url, headers=None, data=None, timeout=None, stream=False):
+        body = json.loads(data) if data else {}
+        return _response(_respond(url, body if isinstance(body, dict) else {}))
+
+
+def _bulkPayload(rows):
+    """ This is a Transfer.bulk sized payload, for encrypting something larger than one card """
+    return {"title": "payroll", "bulk_data": [{"Bank": "044", "Account Number": "0690000032", "Amount": 500, "Currency": "NGN", "Narration": "salary", "reference": "payroll-{}".format(index)} for index in range(rows)]}
+
+
+def benchmarks():
+    """ This returns (name, callable) for every benchmark. Everything a benchmark needs is set up here, outside the timing """
+    transport = CannedTransport()
+    rave = Rave("FLWPUBK-micro", SECRET_KEY, usingEnv=False, transport=transport)
+    card = rave.Card
+    payload = dict(PAYLOAD, txRef="micro-1")
+    cardText = json.dumps(dict(payload, PBFPubKey="FLWPUBK-micro"))
+    bulkText = json.dumps(_bulkPayload(100))
+
+    chargeResponse = _response(_respond("charge", {}))
+    completeChargeResponse = _response({"status": "success", "data": {"txRef": "micro-1", "flwRef": "FLW-STUB", "chargeResponseCode": "00", "authurl": "N/A"}})
+    verifyResponse = _response(_respond("verify", {"txref": "micro-1"}))
+    ussdRequest = {"accountbank": "058"}
+
+    return [
+        ("encrypt.card", lambda: card._encrypt(cardText)),
+        ("encrypt.bulk100", lambda: card._encrypt(bulkText)),
+        ("encryptionKey", card._RaveBase__getEncryptionKey),
+        ("checkIfParametersAreComplete", lambda: checkIfParametersAreComplete(CARD_PARAMETERS, payload)),
+        ("updatePayload.pin", lambda: updatePayload("PIN", payload, inPlace=False, pin="3310")),
+        ("updatePayload.address", lambda: updatePayload("AVS_VBVSECURECODE", payload, inPlace=False, address={"billingzip": "07205", "billingcity": "Hillside", "billingaddress": "470 Mundet PI", "billingstate": "NJ", "billingcountry": "US"})),
+        ("generateTransactionReference", generateTransactionReference),
+        # Payment.charge prepares, encrypts and posts the payload. The transport answers from memory, so this is all client side work
+        ("Payment.charge", lambda: Payment.charge(card, payload, CARD_PARAMETERS, "charge")),
+        ("Card.charge", lambda: card.charge(payload)),
+        ("Payment._handleChargeResponse", lambda: Payment._handleChargeResponse(rave.Mpesa, chargeResponse, "micro-1")),
+        ("Card._handleChargeResponse", lambda: card._handleChargeResponse(chargeResponse, "micro-1")),
+        ("Card._handleChargeResponse.complete", lambda: card._handleChargeResponse(completeChargeResponse, "micro-1")),
+        ("Account._handleChargeResponse", lambda: rave.Account._handleChargeResponse(chargeResponse, "micro-1")),
+        ("Ussd._handleChargeResponse", lambda: rave.Ussd._handleChargeResponse(chargeResponse, "micro-1", ussdRequest)),
+        ("Payment._handleVerifyResponse", lambda: Payment._handleVerifyResponse(rave.Mpesa, verifyResponse, "micro-1")),
+        ("Card._handleVerifyResponse", lambda: card._handleVerifyResponse(verifyResponse, "micro-1")),
+        ("Rave", lambda: Rave("FLWPUBK-micro", SECRET_KEY, usingEnv=False, transport=transport)),
+        ("Rave.ownTransport", lambda: Rave("FLWPUBK-micro", SECRET_KEY, usingEnv=False)),
+    ]
+
+
+def measure(only=None, repeat=5, minTime=0.2, exact=False):
+    """ This runs the benchmarks and returns {name: {"seconds": fastest seconds per call, "loops": loops per repeat}}.\n
+         Parameters include:\n
+        only (list) -- (optional) Only benchmarks whose name contains one of these are run\n
+        exact (bool) -- (optional) If True, only benchmarks named in only are run\n
+        repeat (int) -- (optional) This is how many times each benchmark is timed. The fastest is kept\n
+        minTime (Number) -- (optional) Each repeat runs enough loops to take at least this many seconds
+    """
+    results = {}
+    for name, func in benchmarks():
+        if only and not (name in only if exact else any(part in name for part in only)):
+            continue
+        timer = timeit.Timer(func)
+        loops = 1
+        while timer.timeit(loops) < minTime:
+            loops *= 2
+        best = min(timer.repeat(repeat, loops)) / loops
+        results[name] = {"seconds": best, "loops": loops}
+    return results
+
+
+def environment():
+    return {"python": platform.python_version(), "implementation": platform.python_implementation(), "machine": platform.machine(), "system": platform.system()}
+
+
+def formatTime(seconds):
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return "{:.2f}{}".format(seconds / scale, unit)
+    return "{:.0f}ns".format(seconds / 1e-9)
+
+
+def compare(results, baseline, threshold):
+    """ This prints results against baseline and returns the names of benchmarks more than threshold (a fraction) slower """
+    regressions = []
+    print("{:<40} {:>10} {:>10} {:>8}".format("benchmark", "baseline", "now", "change"))
+    for name, result in results.items():
+        if name not in baseline:
+            print("{:<40} {:>10} {:>10} {:>8}".format(name, "-", formatTime(result["seconds"]), "new"))
+            continue
+        before = baseline[name]["seconds"]
+        change = result["seconds"] / before - 1
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        elif change < -threshold:
+            flag = "  faster"
+        print("{:<40} {:>10} {:>10} {:>+7.1%}{}".format(name, formatTime(before), formatTime(result["seconds"]), change, flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("command", choices=["run", "save", "compare"])
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline file to save to or compare against")
+    parser.add_argument("--threshold", type=float, default=0.15, help="slowdown (as a fraction) flagged as a regression")
+    parser.add_argument("--only", nargs="+", help="run only benchmarks whose name contains one of these")
+    parser.add_argument("--repeat", type=int, default=5, help="timings per benchmark, the fastest is kept")
+    parser.add_argument("--confirm", type=int, default=2, help="times a regression is timed again before it is reported")
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds each timing runs for at least")
+    args = parser.parse_args(argv)
+
+    results = measure(args.only, args.repeat, args.min_time)
+
+    if args.command == "compare":
+        with open(args.baseline) as fh:
+            stored = json.load(fh)
+        if stored["environment"] != environment():
+            print("Warning: the baseline was saved on {} but this is {}".format(stored["environment"], environment()))
+        regressions = compare(results, stored["results"], args.threshold)
+        for attempt in range(args.confirm):
+            if not regressions:
+                break
+            # A slow timing is often a noisy neighbour, so only what stays slow on a rerun is reported
+            print("Timing {} again to confirm".format(", ".join(regressions)))
+            rerun = measure(regressions, args.repeat, args.min_time, exact=True)
+            for name, result in rerun.items():
+                if result["seconds"] < results[name]["seconds"]:
+                    results[name] = result
+            regressions = compare(dict((name, results[name]) for name in regressions), stored["results"], args.threshold)
+        if regressions:
+            print("{} benchmark(s) are more than {:.0%} slower: {}".format(len(regressions), args.threshold, ", ".join(regressions)))
+            return 1
+        return 0
+
+    for name, result in results.items():
+        print("{:<40} {:>10}".format(name, formatTime(result["seconds"])))
+    if args.command == "save":
+        directory = os.path.dirname(os.path.abspath(args.baseline))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        stored = {"environment": environment(), "results": results}
+        if args.only and os.path.exists(args.baseline):
+            # A partial run only replaces the benchmarks it ran
+            with open(args.baseline) as fh:
+                previous = json.load(fh)
+            previous["results"].update(results)
+            stored = dict(previous, environment=environment())
+        with open(args.baseline, "w") as fh:
+            json.dump(stored, fh, indent=2, sort_keys=True)
+        print("Saved {} results to {}".format(len(results), args.baseline))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,69 @@
+""" Throughput of the SQLite job queue against the local stub server, per number of worker processes.
+
+Every run enqueues the same number of Card.charge jobs into a fresh queue and drains it with runWorkers,
+then checks that every job finished exactly once.
+
+    python benchmarks/queue_workers.py --processes 1 2 4 8 --jobs 2000 --latency 0.02
+"""
+import argparse, functools, os, shutil, sys, tempfile, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from python_rave import Rave
+from python_rave.rave_queue import JobQueue, runWorkers, DONE
+from stub_server import startStubServer, useStub
+from stress_threads import PAYLOAD
+
+
+# Card details are not stored in the queue, so the workers add them back from here
+CARD = dict((field, PAYLOAD[field]) for field in ("cardno", "cvv", "expirymonth", "expiryyear"))
+CHARGE = dict((field, value) for field, value in PAYLOAD.items() if field not in CARD)
+
+
+def cardDetails(payload):
+    return CARD
+
+
+def makeRave(url):
+    rave = Rave("FLWPUBK-queue", "FLWSECK-e6db11d1f8a6208de8cb2f94e293450e-X", usingEnv=False)
+    useStub(rave, url)
+    return rave
+
+
+def run(processCounts, jobs, latency, concurrency, batchSize):
+    server, url = startStubServer(latency)
+    directory = tempfile.mkdtemp()
+
+    print("{:>9} {:>10} {:>10} {:>8}".format("processes", "seconds", "jobs/sec", "speedup"))
+    baseline = None
+    try:
+        for processes in processCounts:
+            path = os.path.join(directory, "queue-{}.sqlite".format(processes))
+            queue = JobQueue(path)
+            queue.enqueueMany(("Card.charge", dict(CHARGE, txRef="queue-{}".format(index))) for index in range(jobs))
+
+            start = time.time()
+            counts = runWorkers(path, functools.partial(makeRave, url), processes=processes, batchSize=batchSize, concurrency=concurrency, cardDetails=cardDetails)
+            elapsed = time.time() - start
+
+            done = queue.counts().get(DONE, 0)
+            if done != jobs or counts.get(DONE, 0) != jobs:
+                raise AssertionError("Expected {} finished jobs but the queue has {} and the workers reported {}".format(jobs, done, counts))
+            queue.close()
+
+            throughput = jobs / elapsed
+            baseline = baseline or throughput
+            print("{:>9} {:>10.2f} {:>10.1f} {:>7.1f}x".format(processes, elapsed, throughput, throughput / baseline))
+    finally:
+        server.shutdown()
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--jobs", type=int, default=2000, help="charge jobs per process count")
+    parser.add_argument("--latency", type=float, default=0.02, help="simulated server latency in seconds")
+    parser.add_argument("--concurrency", type=int, default=1, help="jobs run at once within each worker process")
+    parser.add_argument("--batch-size", type=int, default=10, help="jobs leased at a time")
+    args = parser.parse_args()
+    run(args.processes, args.jobs, args.latency, args.concurrency, args.batch_size)
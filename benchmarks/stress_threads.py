@@ -0,0 +1,70 @@
+""" Multi-threaded stress test of one shared Rave object against the local stub server.
+
+Every thread charges and verifies cards through the same Rave instance. The run fails if any caller payload
+is modified or if any result comes back with another thread's txRef, and prints throughput per thread count.
+
+    python benchmarks/stress_threads.py --threads 1 2 4 8 16 32 --calls 400 --latency 0.02
+"""
+import argparse, copy, os, sys, time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from python_rave import Rave, RaveTransport
+from stub_server import startStubServer, useStub
+
+PAYLOAD = {
+    "cardno": "5438898014560229",
+    "cvv": "890",
+    "expirymonth": "09",
+    "expiryyear": "99",
+    "amount": "10",
+    "email": "user@example.com",
+    "phonenumber": "0902620185",
+    "firstname": "temi",
+    "lastname": "desola",
+    "IP": "355426087298442",
+}
+
+
+def chargeAndVerify(rave, index):
+    payload = dict(PAYLOAD, txRef="stress-{}".format(index))
+    original = copy.deepcopy(payload)
+
+    res = rave.Card.charge(payload)
+    if payload != original:
+        raise AssertionError("Card.charge modified the caller's payload: {}".format(payload))
+    if res["txRef"] != original["txRef"]:
+        raise AssertionError("Expected txRef {} but got {}".format(original["txRef"], res["txRef"]))
+
+    res = rave.Card.verify(res["txRef"])
+    if res["txRef"] != original["txRef"]:
+        raise AssertionError("Verify returned txRef {} for {}".format(res["txRef"], original["txRef"]))
+
+
+def run(threadCounts, calls, latency):
+    server, url = startStubServer(latency)
+    rave = Rave("FLWPUBK-stress", "FLWSECK-e6db11d1f8a6208de8cb2f94e293450e-X", usingEnv=False, transport=RaveTransport(poolSize=max(threadCounts)))
+    useStub(rave, url)
+
+    print("{:>8} {:>10} {:>12} {:>8}".format("threads", "seconds", "calls/sec", "speedup"))
+    baseline = None
+    for threads in threadCounts:
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            # list() re-raises the first failure from any thread
+            list(pool.map(lambda index: chargeAndVerify(rave, index), range(calls)))
+        elapsed = time.time() - start
+        throughput = calls / elapsed
+        baseline = baseline or throughput
+        print("{:>8} {:>10.2f} {:>12.1f} {:>7.1f}x".format(threads, elapsed, throughput, throughput / baseline))
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--calls", type=int, default=400, help="charge + verify pairs per thread count")
+    parser.add_argument("--latency", type=float, default=0.02, help="simulated server latency in seconds")
+    args = parser.parse_args()
+    run(args.threads, args.calls, args.latency)
@@ -0,0 +1,119 @@
+""" A local stub of the Rave API used by the benchmarks. It answers every endpoint in RaveBase._endpointMap with a canned success response """
+import gzip, json, sys, threading, time
+try:
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+    from urllib.parse import urlparse, parse_qsl
+except ImportError:
+    raise ImportError("The benchmark stub server requires python 3.7 or later")
+
+
+def _transfers(page, perPage=10, totalPages=3):
+    transfers = [{"id": i, "reference": "ref-{}".format(i), "amount": 100, "currency": "NGN", "status": "SUCCESSFUL"} for i in range((page - 1) * perPage, page * perPage)]
+    return {"status": "success", "data": {"page_info": {"total": perPage * totalPages, "current_page": page, "total_pages": totalPages}, "transfers": transfers}}
+
+
+def _encodeBody(payload, acceptEncoding):
+    """ This returns the json body of a response and its content encoding. Bodies over 1kB are gzipped for clients that accept it """
+    raw = json.dumps(payload).encode("utf-8")
+    if len(raw) > 1024 and "gzip" in (acceptEncoding or ""):
+        return gzip.compress(raw, 6), "gzip"
+    return raw, None
+
+
+def _decodeBody(raw, contentEncoding):
+    """ This returns the json of a request body, or {} """
+    if contentEncoding == "gzip":
+        raw = gzip.decompress(raw)
+    try:
+        body = json.loads(raw.decode("utf-8"))
+    except ValueError:
+        return {}
+    return body if isinstance(body, dict) else {}
+
+
+def _respond(path, body):
+    """ This returns the canned json response for a request path """
+    if "resolve_account" in path:
+        return {"status": "success", "data": {"data": {"responsecode": "00", "accountnumber": body.get("recipientaccount"), "accountname": "STUB ACCOUNT"}, "status": "success"}}
+    if "verify" in path:
+        return {"status": "success", "data": {"txRef": body.get("txref"), "flwRef": "FLW-STUB", "chargecode": "00", "amount": 10, "currency": "NGN", "card": {"card_tokens": [{"embedtoken": "flw-t0-stub"}]}}}
+    if "validate" in path:
+        return {"status": "success", "data": {"txRef": "MC-STUB", "flwRef": "FLW-STUB", "chargeResponseCode": "00"}}
+    if "capture" in path or "refundorvoid" in path:
+        return {"status": "success", "data": {"flwRef": body.get("flwRef"), "txRef": "MC-STUB", "chargeResponseCode": "00", "status": "successful"}}
+    if "create_bulk" in path:
+        return {"status": "success", "data": {"id": 1, "date_created": "2018-07-09T10:06:54.000Z", "approver": "N/A"}}
+    if "transfers/create" in path:
+        return {"status": "success", "data": {"id": 1, "reference": body.get("reference"), "status": "NEW"}}
+    if "transfers/fee" in path or "balance" in path:
+        return {"status": "success", "data": [{"fee": 45, "currency": "NGN"}]}
+    if "charge" in path:
+        return {"status": "success", "data": {"txRef": "MC-STUB", "flwRef": "FLW-STUB", "chargeResponseCode": "02", "suggested_auth": "PIN", "authurl": "N/A"}}
+    return {"status": "success", "data": {}}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, so Nagle would add a delayed-ack stall to every response
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, payload):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        raw, encoding = _encodeBody(payload, self.headers.get("Accept-Encoding", None))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        self.send_header("Content-Length", str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = dict(parse_qsl(url.query))
+        if url.path.rstrip("/").endswith("transfers"):
+            page = query.get("page", "None")
+            return self._send(_transfers(int(page) if page.isdigit() else 1))
+        self._send(_respond(url.path, query))
+
+    def do_POST(self):
+        raw = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self._send(_respond(self.path, _decodeBody(raw, self.headers.get("Content-Encoding", None))))
+
+
+class _Server(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        # Clients that gave up (e.g. when a deadline ran out) are expected, anything else is reported
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            ThreadingHTTPServer.handle_error(self, request, client_address)
+
+
+def startStubServer(latency=0.0):
+    """ This starts the stub server on a free local port in a daemon thread.\n
+         Parameters include:\n
+        latency (Number) -- (optional) This is the number of seconds each response is delayed by, to imitate network latency\n
+        \n
+        Returns the server and its base url. Assign the url to a component's _baseUrl to use it
+    """
+    server = _Server(("127.0.0.1", 0), _Handler)
+    server.daemon_threads = True
+    server.latency = latency
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, "http://127.0.0.1:{}/".format(server.server_address[1])
+
+
+def useStub(rave, url):
+    """ This points every component of a Rave object at the stub server """
+    for component in (rave.Card, rave.Preauth, rave.Account, rave.Ussd, rave.GhMobile, rave.Mpesa, rave.Transfer):
+        component._baseUrl = url
@@ -7,4 +7,17 @@ __copyright__ = 'Copyright 2018. Tofunmi Kupoluyi'
 
 from python_rave.rave import Rave
 import python_rave.rave_misc as Misc
-import python_rave.rave_exceptions as RaveExceptions
\ No newline at end of file
+import python_rave.rave_exceptions as RaveExceptions
+import python_rave.rave_reconcile as Reconcile
+from python_rave.rave_cache import AccountCache
+import python_rave.rave_validation as Validation
+from python_rave.rave_transport import RaveTransport
+from python_rave.rave_cassette import RecordingTransport, ReplayTransport
+from python_rave.rave_batch import AdaptiveLimiter
+from python_rave.rave_profile import Profiler
+from python_rave.rave_queue import JobQueue, QueueWorker, runWorkers
+from python_rave.rave_checkout import Checkout
+from python_rave.rave_idempotency import IdempotencyGuard
+from python_rave.rave_deadline import Deadline
+from python_rave.rave_watcher import BatchWatcher
+from python_rave.rave_http2 import Http2Transport
@@ -6,10 +6,11 @@ from python_rave.rave_ghmobile import GhMobile
 from python_rave.rave_mpesa import Mpesa
 from python_rave.rave_preauth import Preauth
 from python_rave.rave_transfer import Transfer
+from python_rave.rave_transport import RaveTransport
 
 class Rave:
     
-    def __init__(self, publicKey, secretKey, production=False, usingEnv=True):
+    def __init__(self, publicKey, secretKey, production=False, usingEnv=True, transport=None, baseUrls=None):
         """ This is main organizing object. It contains the following:\n
             rave.Card -- For card transactions\n
             rave.Preauth -- For preauthorized transactions\n
@@ -17,16 +18,33 @@ class Rave:
             rave.Ussd -- For ussd transactions\n
             rave.GhMobile -- For Ghana mobile money transactions\n
             rave.Mpesa -- For mpesa transactions\n
+            \n
+            A Rave object is thread-safe: charge calls never modify the dicts passed to them and all components share one pooled transport. You can pass your own RaveTransport e.g. to size the connection pool for your thread pool\n
+            \n
+            baseUrls is an optional list of base urls for this environment in order of preference. Requests fail over to the next one when a base url cannot be reached
         """
-        
+        if transport is not None and baseUrls:
+            raise ValueError("Pass baseUrls to your RaveTransport instead of to Rave")
+        # All the components share one transport (and so one connection pool)
+        self.transport = transport or RaveTransport(baseUrls={("production" if production else "sandbox"): baseUrls} if baseUrls else None)
+
         # Creating member objects already initiated with the publicKey and secretKey
-        self.Card = Card(publicKey, secretKey, production, usingEnv)
-        self.Preauth = Preauth(publicKey, secretKey, production, usingEnv)
+        self.Card = Card(publicKey, secretKey, production, usingEnv, self.transport)
+        self.Preauth = Preauth(publicKey, secretKey, production, usingEnv, self.transport)
         # These all use the account endpoint till further changes, the enpoint maps are defined in rave_base
-        self.Account = Account(publicKey, secretKey, production, usingEnv)
-        self.Ussd = Ussd(publicKey, secretKey, production, usingEnv)
-        self.GhMobile = GhMobile(publicKey, secretKey, production, usingEnv)
-        self.Mpesa = Mpesa(publicKey, secretKey, production, usingEnv)
+        self.Account = Account(publicKey, secretKey, production, usingEnv, self.transport)
+        self.Ussd = Ussd(publicKey, secretKey, production, usingEnv, self.transport)
+        self.GhMobile = GhMobile(publicKey, secretKey, production, usingEnv, self.transport)
+        self.Mpesa = Mpesa(publicKey, secretKey, production, usingEnv, self.transport)
         # Transfer endpoint
-        self.Transfer = Transfer(publicKey, secretKey, production, usingEnv)
+        self.Transfer = Transfer(publicKey, secretKey, production, usingEnv, self.transport)
         
+
+    def warmup(self, connections=None):
+        """ This resolves the base urls and opens pooled connections ahead of the first call. Call it once at process start.\n
+             Parameters include:\n
+            connections (int) -- (optional) This is the number of connections to open per base url. It defaults to the pool size\n
+            \n
+            Returns the transport's warmup report
+        """
+        return self.transport.warmup(connections)
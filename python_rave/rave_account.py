@@ -2,7 +2,9 @@ from python_rave.rave_exceptions import RaveError, IncompletePaymentDetailsError
 
 from python_rave.rave_payment import Payment
 from python_rave.rave_misc import generateTransactionReference
-import json
+from python_rave.rave_validation import validateAccountDetails
+from python_rave.rave_deadline import acceptsDeadline
+import json, copy
 
 class Account(Payment):
     """ This is the rave object for account transactions. It contains the following public functions:\n
@@ -10,8 +12,8 @@ class Account(Payment):
         .validate -- This is called if further action is required i.e. OTP validation\n
         .verify -- This checks the status of your transaction\n
     """
-    def __init__(self, publicKey, secretKey, production, usingEnv):
-            super(Account, self).__init__(publicKey, secretKey, production, usingEnv)
+    def __init__(self, publicKey, secretKey, production, usingEnv, transport=None):
+            super(Account, self).__init__(publicKey, secretKey, production, usingEnv, transport)
 
 
     def _handleChargeResponse(self, response, txRef, request=None):
@@ -38,16 +40,20 @@ class Account(Payment):
 
 
     # Charge account function
-    def charge(self, accountDetails, hasFailed=False):
-        """ This is the ghMobile charge call.\n
+    @acceptsDeadline
+    def charge(self, accountDetails, hasFailed=False, preflight=True):
+        """ This is the account charge call.\n
              Parameters include:\n
             accountDetails (dict) -- These are the parameters passed to the function for processing\n
             hasFailed (boolean) -- This is a flag to determine if the attempt had previously failed due to a timeout\n
+            preflight (boolean) -- (optional) If True, the bank code and account number are checked locally before the request is sent\n
         """
 
         # setting the endpoint
         endpoint = self._baseUrl + self._endpointMap["account"]["charge"]
 
+        # Working on a copy so the caller's dict is never modified
+        accountDetails = copy.copy(accountDetails)
         # It is faster to just update rather than check if it is already present
         accountDetails.update({"payment_type": "account"})
         # Here we check because txRef could be set by user
@@ -55,6 +61,8 @@ class Account(Payment):
             accountDetails.update({"txRef": generateTransactionReference()})
         # Checking for required account components
         requiredParameters = ["accountbank", "accountnumber", "amount", "email", "phonenumber", "IP"]
+        if preflight:
+            validateAccountDetails(accountDetails)
         return super(Account, self).charge(accountDetails, requiredParameters, endpoint)
 
 
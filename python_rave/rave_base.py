@@ -1,10 +1,11 @@
 import os, hashlib, warnings, requests, json
 from python_rave.rave_exceptions import ServerError, RefundError
+from python_rave.rave_transport import RaveTransport
 import base64
 from Crypto.Cipher import DES3
 class RaveBase(object):
     """ This is the core of the implementation. It contains the encryption and initialization functions. It also contains all direct rave functions that require publicKey or secretKey (refund) """
-    def __init__(self, publicKey=None, secretKey=None, production=False, usingEnv=True):
+    def __init__(self, publicKey=None, secretKey=None, production=False, usingEnv=True, transport=None):
 
         # config variables (protected)
         self._baseUrlMap = ["https://ravesandboxapi.flutterwave.com/", "https://api.ravepay.co/"]
@@ -61,11 +62,15 @@ class RaveBase(object):
         # 
         # production/non-production variables (protected)
         self._isProduction = production 
-        self._baseUrl = self._baseUrlMap[production]
 
         # encryption key (protected)
         self._encryptionKey = self.__getEncryptionKey()
 
+        # http transport (protected). Components created by Rave share one so they share a connection pool
+        self._transport = transport or RaveTransport()
+        # The transport holds the base urls configured for each environment and fails over between them
+        self._baseUrl = self._transport.baseUrl(production, self._baseUrlMap[production])
+
     
 
     # This generates the encryption key (private)
@@ -95,11 +100,13 @@ class RaveBase(object):
             plainText (string) -- This is the text you wish to encrypt
         """
         blockSize = 8
-        padDiff = blockSize - (len(plainText) % blockSize)
-        key = self.__getEncryptionKey()
-        cipher = DES3.new(key, DES3.MODE_ECB)
-        plainText = "{}{}".format(plainText, "".join(chr(padDiff) * padDiff))
-        encrypted = base64.b64encode(cipher.encrypt(plainText)).decode("utf-8")
+        # Padding is computed on the encoded bytes so non-ascii payloads stay block aligned
+        plainBytes = plainText.encode("utf-8")
+        padDiff = blockSize - (len(plainBytes) % blockSize)
+        # The key is derived once at initialization. A new cipher is created per call so that calls from different threads never share cipher state
+        cipher = DES3.new(self._encryptionKey, DES3.MODE_ECB)
+        plainBytes = plainBytes + bytearray([padDiff] * padDiff)
+        encrypted = base64.b64encode(cipher.encrypt(bytes(plainBytes))).decode("utf-8")
         return encrypted
         
 
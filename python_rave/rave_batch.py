@@ -0,0 +1,196 @@
+""" Helpers for running many rave calls with bounded concurrency """
+import contextvars, threading, time
+import requests
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from python_rave.rave_exceptions import ServerError
+
+
+class BatchStats(object):
+    """ This keeps aggregate counts and throughput for a batch run. It contains the following public functions:\n
+        .record -- This counts one finished item under a status\n
+        .summary -- This returns the counts, elapsed seconds and items per second so far\n
+        \n
+        It is safe to update from many threads
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {}
+        self.startedAt = None
+        self.finishedAt = None
+
+    def start(self):
+        self.startedAt = time.time()
+        self.finishedAt = None
+
+    def finish(self):
+        self.finishedAt = time.time()
+
+    def record(self, status):
+        with self._lock:
+            self.counts[status] = self.counts.get(status, 0) + 1
+
+    def summary(self):
+        with self._lock:
+            counts = dict(self.counts)
+        total = sum(counts.values())
+        seconds = ((self.finishedAt or time.time()) - self.startedAt) if self.startedAt else 0.0
+        return {"counts": counts, "total": total, "seconds": seconds, "perSecond": (total / seconds) if seconds else 0.0}
+
+
+def isOverloadError(err):
+    """ This tells whether an exception means Rave (or the network to it) is struggling, as opposed to e.g. a declined card """
+    return isinstance(err, (ServerError, requests.exceptions.RequestException))
+
+
+class AdaptiveLimiter(object):
+    """ This is an AIMD concurrency limit for batch calls. It contains the following public functions:\n
+        .record -- This reports how long one call took and whether it failed\n
+        .metrics -- This returns the current limit, latency and decision counts\n
+        \n
+        The limit grows by increase after every limit successful calls (about once per round of calls) while latency stays within latencyTolerance times the usual latency. It is multiplied by decrease when a call fails with an overload error or latency spikes.\n
+        Pass a limiter anywhere a batch function takes concurrency, e.g. rave.Transfer.resolveAccounts(accounts, concurrency=AdaptiveLimiter()). It is safe to share between threads and between batches
+    """
+    def __init__(self, initial=4, minimum=1, maximum=64, increase=1, decrease=0.5, latencyTolerance=2.0, isError=isOverloadError, onDecision=None):
+        """ Parameters include:\n
+            initial (int) -- (optional) This is the starting limit\n
+            minimum (int) -- (optional) This is the lowest the limit can go\n
+            maximum (int) -- (optional) This is the highest the limit can go. Batches that create their own thread pool create this many workers\n
+            increase (int) -- (optional) This is added to the limit after each healthy round of calls\n
+            decrease (float) -- (optional) This is what the limit is multiplied by on an error or latency spike\n
+            latencyTolerance (float) -- (optional) Recent latency above this multiple of the usual latency counts as a spike\n
+            isError (callable) -- (optional) This is called with a call's exception and returns True if the limit should be cut\n
+            onDecision (callable) -- (optional) This is called with each decision dict, e.g. to export it as a metric
+        """
+        if not 1 <= minimum <= initial <= maximum:
+            raise ValueError("limits must satisfy 1 <= minimum <= initial <= maximum")
+        if not 0 < decrease < 1:
+            raise ValueError("decrease must be between 0 and 1")
+        self.minimum = minimum
+        self.maximum = maximum
+        self._increase = increase
+        self._decrease = decrease
+        self._tolerance = latencyTolerance
+        self._isError = isError
+        self._onDecision = onDecision
+        self._lock = threading.Lock()
+        self._limit = initial
+        self._successes = 0
+        # Calls started before a cut finish under the old limit, so their results must not cut again
+        self._generation = 0
+        # Recent latency reacts within a few calls, the usual latency over a few hundred
+        self._recentLatency = None
+        self._usualLatency = None
+        self.counts = {"calls": 0, "errors": 0, "increases": 0, "decreases": 0}
+        self.decisions = deque(maxlen=100)
+
+    @property
+    def limit(self):
+        return self._limit
+
+    @property
+    def generation(self):
+        return self._generation
+
+    def record(self, seconds, err=None, generation=None):
+        """ This reports one finished call.\n
+             Parameters include:\n
+            seconds (Number) -- This is how long the call took\n
+            err (Exception) -- (optional) This is the exception the call raised, if any\n
+            generation (int) -- (optional) This is .generation when the call was started
+        """
+        failed = err is not None and self._isError(err)
+        decision = None
+        with self._lock:
+            self.counts["calls"] += 1
+            stale = generation is not None and generation != self._generation
+            if failed:
+                self.counts["errors"] += 1
+                if not stale:
+                    decision = self._cut("error", "{}: {}".format(type(err).__name__, err))
+            elif err is None:
+                self._recentLatency = seconds if self._recentLatency is None else 0.7 * self._recentLatency + 0.3 * seconds
+                if self._usualLatency is None:
+                    self._usualLatency = seconds
+                if not stale and self._recentLatency > self._tolerance * self._usualLatency:
+                    decision = self._cut("latency", "recent latency {:.3f}s against usual {:.3f}s".format(self._recentLatency, self._usualLatency))
+                else:
+                    # Spikes are kept out of the usual latency so a slow period cannot become the new normal
+                    self._usualLatency = 0.99 * self._usualLatency + 0.01 * seconds
+                    self._successes += 1
+                    if self._successes >= self._limit and self._limit < self.maximum:
+                        decision = self._change(min(self.maximum, self._limit + self._increase), "increase", "healthy round of {} calls".format(self._successes))
+        if decision and self._onDecision:
+            self._onDecision(decision)
+        return decision
+
+    def _cut(self, cause, reason):
+        self._recentLatency = self._usualLatency
+        return self._change(max(self.minimum, int(self._limit * self._decrease)), "decrease", reason, cause)
+
+    def _change(self, limit, action, reason, cause=None):
+        """ This sets the limit and logs the decision. It is called with the lock held """
+        decision = {"time": time.time(), "action": action, "cause": cause or action, "from": self._limit, "to": limit, "reason": reason}
+        self.counts[action + "s"] += 1
+        self._limit = limit
+        self._successes = 0
+        if action == "decrease":
+            self._generation += 1
+        self.decisions.append(decision)
+        return decision
+
+    def metrics(self):
+        """ This returns {"limit", "recentLatency", "usualLatency", "calls", "errors", "increases", "decreases"} """
+        with self._lock:
+            metrics = dict(self.counts)
+            metrics.update({"limit": self._limit, "recentLatency": self._recentLatency, "usualLatency": self._usualLatency})
+        return metrics
+
+
+def imapBounded(func, items, concurrency=8, executor=None):
+    """ This lazily applies func to every item while keeping at most concurrency calls in flight.\n
+         Parameters include:\n
+        func (callable) -- This is called with a single item, e.g. a txRef to verify\n
+        items (iterable) -- This can be any iterable (including a generator). It is consumed lazily so memory stays bounded\n
+        concurrency (int or AdaptiveLimiter) -- (optional) This is the maximum number of calls in flight at once. An AdaptiveLimiter adjusts it as calls finish\n
+        executor (Executor) -- (optional) This is a shared executor to run the calls on. If not provided, one is created for the duration of the call\n
+        \n
+        Yields (item, result, exception) tuples in the same order as items. Exactly one of result and exception is set
+    """
+    limiter = concurrency if isinstance(concurrency, AdaptiveLimiter) else None
+    if limiter is None and concurrency < 1:
+        raise ValueError("concurrency must be at least 1")
+
+    ownsExecutor = executor is None
+    if ownsExecutor:
+        executor = ThreadPoolExecutor(max_workers=limiter.maximum if limiter else concurrency)
+
+    def call(item):
+        try:
+            return item, func(item), None
+        except Exception as e:
+            return item, None, e
+
+    def timedCall(item):
+        generation = limiter.generation
+        startedAt = time.time()
+        item, result, err = call(item)
+        limiter.record(time.time() - startedAt, err, generation)
+        return item, result, err
+
+    inFlight = deque()
+    try:
+        for item in items:
+            # Each call runs in a copy of the caller's context, so an active Deadline applies to it
+            inFlight.append(executor.submit(contextvars.copy_context().run, timedCall if limiter else call, item))
+            # Only hold a window of results so that huge inputs do not pile up in memory
+            while len(inFlight) >= (limiter.limit if limiter else concurrency):
+                yield inFlight.popleft().result()
+        while inFlight:
+            yield inFlight.popleft().result()
+    finally:
+        # If the consumer stops early, we do not start anything that has not already begun
+        for future in inFlight:
+            future.cancel()
+        if ownsExecutor:
+            executor.shutdown(wait=True)
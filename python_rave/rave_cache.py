@@ -0,0 +1,46 @@
+""" Persistent caches used to avoid repeated network calls """
+import os, sqlite3, threading, time, json
+
+class AccountCache(object):
+    """ This is an on-disk cache of resolved accounts keyed by (bank code, account number). It contains the following public functions:\n
+        .get -- This returns a cached resolution or None if it is missing or expired\n
+        .set -- This stores a resolution\n
+        .purge -- This deletes expired entries\n
+        \n
+        It is backed by SQLite so it persists between runs and can be shared by threads
+    """
+    def __init__(self, path=None, ttl=7 * 24 * 60 * 60):
+        """ Parameters include:\n
+            path (string) -- (optional) This is the cache file. Defaults to ~/.python_rave/accounts.sqlite\n
+            ttl (Number) -- (optional) This is how long (in seconds) a resolution stays valid. Defaults to a week
+        """
+        if not path:
+            path = os.path.join(os.path.expanduser("~"), ".python_rave", "accounts.sqlite")
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("CREATE TABLE IF NOT EXISTS accounts (bankCode TEXT, accountNumber TEXT, data TEXT, expiresAt REAL, PRIMARY KEY (bankCode, accountNumber))")
+
+    def get(self, bankCode, accountNumber):
+        with self._lock:
+            row = self._connection.execute("SELECT data, expiresAt FROM accounts WHERE bankCode = ? AND accountNumber = ?", (str(bankCode), str(accountNumber))).fetchone()
+        if not row or row[1] < time.time():
+            return None
+        return json.loads(row[0])
+
+    def set(self, bankCode, accountNumber, data):
+        with self._lock, self._connection:
+            self._connection.execute("INSERT OR REPLACE INTO accounts VALUES (?, ?, ?, ?)", (str(bankCode), str(accountNumber), json.dumps(data), time.time() + self._ttl))
+
+    def purge(self):
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM accounts WHERE expiresAt < ?", (time.time(),))
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -1,6 +1,9 @@
+import copy
 from python_rave.rave_exceptions import RaveError, IncompletePaymentDetailsError, CardChargeError, TransactionVerificationError, ServerError
 from python_rave.rave_payment import Payment
 from python_rave.rave_misc import generateTransactionReference
+from python_rave.rave_validation import validateCardDetails
+from python_rave.rave_deadline import acceptsDeadline
 
 class Card(Payment):
     """ This is the rave object for card transactions. It contains the following public functions:\n
@@ -8,8 +11,8 @@ class Card(Payment):
         .validate -- This is called if further action is required i.e. OTP validation\n
         .verify -- This checks the status of your transaction\n
     """
-    def __init__(self, publicKey, secretKey, production, usingEnv):
-        super(Card, self).__init__(publicKey, secretKey, production, usingEnv)
+    def __init__(self, publicKey, secretKey, production, usingEnv, transport=None):
+        super(Card, self).__init__(publicKey, secretKey, production, usingEnv, transport)
 
 
     # returns true if further action is required, false if it isn't    
@@ -55,22 +58,32 @@ class Card(Payment):
             errMsg = responseJson["data"].get("message", "Your call failed with no response")
             raise TransactionVerificationError({"error": True, "txRef": txRef, "flwRef": flwRef, "errMsg": errMsg})
         
+        amount = responseJson["data"].get("amount", None)
+        currency = responseJson["data"].get("currency", None)
+        # Rave's own status, e.g. "successful", "pending" or "failed", tells a declined charge from one still in progress
+        status = responseJson["data"].get("status", None)
+
         # if the chargecode is not 00
-        elif not (responseJson["data"].get("chargecode", None) == "00"):
-            return {"error": False, "transactionComplete": False, "txRef": txRef, "flwRef":flwRef, "cardToken": responseJson["data"]["card"]["card_tokens"][0]["embedtoken"]}
+        if not (responseJson["data"].get("chargecode", None) == "00"):
+            return {"error": False, "transactionComplete": False, "txRef": txRef, "flwRef":flwRef, "amount": amount, "currency": currency, "status": status, "cardToken": responseJson["data"]["card"]["card_tokens"][0]["embedtoken"]}
         
         else:
-            return {"error":False, "transactionComplete": True, "txRef": txRef, "flwRef": flwRef, "cardToken": responseJson["data"]["card"]["card_tokens"][0]["embedtoken"]}
+            return {"error":False, "transactionComplete": True, "txRef": txRef, "flwRef": flwRef, "amount": amount, "currency": currency, "status": status, "cardToken": responseJson["data"]["card"]["card_tokens"][0]["embedtoken"]}
 
     
     # Charge card function
-    def charge(self, cardDetails, hasFailed=False, chargeWithToken=False):
+    @acceptsDeadline
+    def charge(self, cardDetails, hasFailed=False, chargeWithToken=False, preflight=True):
         """ This is called to initiate the charge process.\n
              Parameters include:\n
             cardDetails (dict) -- This is a dictionary comprising payload parameters.\n
-            hasFailed (bool) -- This indicates whether the request had previously failed for timeout handling
+            hasFailed (bool) -- This indicates whether the request had previously failed for timeout handling\n
+            preflight (bool) -- (optional) If True, the card number, cvv and expiry are checked locally before the request is sent
         """
 
+        # Working on a copy so the caller's dict is never modified (this makes charge safe to call from many threads)
+        cardDetails = copy.copy(cardDetails)
+
         # Checking for required card components
         requiredParameters = ["cardno", "cvv", "expirymonth", "expiryyear", "amount", "email", "phonenumber", "firstname", "lastname", "IP"]
 
@@ -85,14 +98,19 @@ class Card(Payment):
         if not ("txRef" in cardDetails):
             cardDetails.update({"txRef":generateTransactionReference()})
 
+        # Rejecting bad card details here saves an encryption and a round trip
+        if preflight:
+            validateCardDetails(cardDetails)
         
         return super(Card, self).charge(cardDetails, requiredParameters, endpoint)
     
 
+    @acceptsDeadline
     def validate(self, flwRef, otp):
         endpoint = self._baseUrl + self._endpointMap["card"]["validate"]
         return super(Card, self).validate(flwRef, otp, endpoint)
 
+    @acceptsDeadline
     def verify(self, txRef):
         endpoint = self._baseUrl + self._endpointMap["card"]["verify"]
         return super(Card, self).verify(txRef, endpoint)
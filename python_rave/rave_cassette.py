@@ -0,0 +1,211 @@
+""" Record/replay transports for deterministic offline tests and benchmarks.
+
+RecordingTransport sends requests normally and appends every request/response pair to a cassette file with
+secrets and customer details redacted, at any depth of the request and response bodies. Each pair is written and flushed as a gzip member of its own, so a process that dies while recording
+leaves every earlier pair readable. ReplayTransport loads a cassette into memory and answers requests from it without any network,
+optionally sleeping to imitate latency. Pass either as the transport of a Rave object.
+"""
+import gzip, json, os, threading, time, zlib
+import requests
+from requests.structures import CaseInsensitiveDict
+from python_rave.rave_transport import RaveTransport
+from python_rave.rave_exceptions import CassetteMissError
+
+try:
+    from urllib.parse import urlsplit, parse_qsl, urlencode
+except ImportError:
+    from urlparse import urlsplit, parse_qsl
+    from urllib import urlencode
+
+REDACTED = "[REDACTED]"
+# The values of these fields are never written to a cassette, wherever they appear in a body or query string. Matched
+# case-insensitively: the secret key, the encrypted payload (which contains card details), card details, card tokens and
+# the customer's contact details
+REDACTED_FIELDS = ("seckey", "client", "cardno", "cvv", "pin", "otp", "embedtoken", "embed_token", "user_token", "chargetoken", "cardtoken",
+                   "token", "shortcode", "email", "custemail", "phone", "phonenumber", "custphone", "bvn")
+# Only these response headers are kept, everything else is noise for replay. Content-Encoding is not one of them
+# because bodies are stored decoded
+_keptHeaders = ("Content-Type",)
+
+
+def _redact(value, fields):
+    if isinstance(value, dict):
+        return dict((key, REDACTED if key.lower() in fields else _redact(item, fields)) for key, item in value.items())
+    if isinstance(value, list):
+        return [_redact(item, fields) for item in value]
+    return value
+
+
+def _redactBody(data, fields):
+    if data is None:
+        return None
+    if isinstance(data, bytes):
+        data = data.decode("utf-8", "replace")
+    try:
+        body = json.loads(data)
+    except ValueError:
+        return data
+    return json.dumps(_redact(body, fields), sort_keys=True)
+
+
+def _redactUrl(url, fields):
+    """ This returns the path and query of url with secrets redacted. The host is dropped so cassettes work against any base url """
+    parts = urlsplit(url)
+    query = [(key, REDACTED if key.lower() in fields else value) for key, value in parse_qsl(parts.query, keep_blank_values=True)]
+    return parts.path + ("?" + urlencode(query) if query else "")
+
+
+def _redactedFields(redact):
+    return frozenset(field.lower() for field in redact)
+
+
+def _matchKey(method, url, data, matchBody, fields):
+    if matchBody:
+        return "{} {} {}".format(method, _redactUrl(url, fields), _redactBody(data, fields))
+    return "{} {}".format(method, urlsplit(url).path)
+
+
+def _members(data):
+    """ This yields (text, end offset) for each gzip member of a cassette. A member cut short by a crash ends it, with only its complete lines """
+    offset = 0
+    while offset < len(data):
+        decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        try:
+            text = decompressor.decompress(data[offset:])
+        except zlib.error:
+            return
+        if not decompressor.eof:
+            # Cassettes written in one gzip stream are read up to their last complete line too
+            text = text[:text.rfind(b"\n") + 1]
+            if text:
+                yield text, None
+            return
+        offset = len(data) - len(decompressor.unused_data)
+        yield text, offset
+
+
+def _readCassette(path):
+    """ This yields the interactions recorded in a cassette """
+    with open(path, "rb") as fh:
+        data = fh.read()
+    for text, _ in _members(data):
+        for line in text.splitlines():
+            if line.strip():
+                yield json.loads(line.decode("utf-8"))
+
+
+def _dropBrokenTail(path):
+    """ This cuts off a member left incomplete by a crash, so that new recordings are not appended after it. Its complete lines are written back as a member of their own """
+    if not os.path.exists(path):
+        return
+    with open(path, "rb") as fh:
+        data = fh.read()
+    end = 0
+    salvaged = b""
+    for text, offset in _members(data):
+        if offset is None:
+            salvaged = text
+            break
+        end = offset
+    if end < len(data):
+        with open(path, "r+b") as fh:
+            fh.truncate(end)
+            fh.seek(end)
+            if salvaged:
+                fh.write(gzip.compress(salvaged))
+
+
+class RecordingTransport(RaveTransport):
+    """ This is a transport that records every request/response pair to a gzipped JSON lines cassette """
+    def __init__(self, path, redact=REDACTED_FIELDS, **kwargs):
+        """ Parameters include:\n
+            path (string) -- This is the cassette file. New recordings are appended to it\n
+            redact (list) -- (optional) These are the fields whose values are replaced with [REDACTED] in request and response bodies and query strings. Defaults to REDACTED_FIELDS\n
+            Any other RaveTransport parameters (poolSize, timeout, session) are passed through
+        """
+        super(RecordingTransport, self).__init__(**kwargs)
+        self._fields = _redactedFields(redact)
+        self._lock = threading.Lock()
+        _dropBrokenTail(path)
+        self._file = open(path, "ab")
+
+    def request(self, method, url, headers=None, data=None, timeout=None, stream=False):
+        # Recording reads the whole body, so streamed responses are buffered here and replayed from memory
+        response = super(RecordingTransport, self).request(method, url, headers=headers, data=data, timeout=timeout, stream=stream)
+        interaction = {
+            "method": method,
+            "url": _redactUrl(url, self._fields),
+            "body": _redactBody(data, self._fields),
+            "status": response.status_code,
+            "headers": dict((name, response.headers[name]) for name in _keptHeaders if name in response.headers),
+            "response": _redactBody(response.content, self._fields),
+        }
+        member = gzip.compress((json.dumps(interaction) + "\n").encode("utf-8"))
+        with self._lock:
+            self._file.write(member)
+            self._file.flush()
+        return response
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+        super(RecordingTransport, self).close()
+
+
+class ReplayTransport(RaveTransport):
+    """ This is a transport that answers requests from a cassette held in memory. It never touches the network.\n
+        Requests are matched on method, path and redacted body. If the same request was recorded more than once, the recorded responses are returned in turn\n
+        Deadlines and timeouts apply as with RaveTransport: a simulated latency longer than the time left raises a DeadlineExceededError
+    """
+    def __init__(self, path, latency=0.0, matchBody=True, redact=REDACTED_FIELDS):
+        """ Parameters include:\n
+            path (string) -- This is a cassette written by RecordingTransport\n
+            latency (Number or callable) -- (optional) This is the simulated latency in seconds. A callable is called per request and should return seconds\n
+            matchBody (bool) -- (optional) If False, requests are matched on method and path only, so e.g. any txRef can be verified\n
+            redact (list) -- (optional) These are the fields redacted when the cassette was recorded. Requests are redacted the same way before being matched
+        """
+        super(ReplayTransport, self).__init__(poolSize=1)
+        self._latency = latency
+        self._matchBody = matchBody
+        self._fields = _redactedFields(redact)
+        self._lock = threading.Lock()
+        self._index = {}
+        self._positions = {}
+
+        for interaction in _readCassette(path):
+            key = _matchKey(interaction["method"], interaction["url"], interaction["body"], matchBody, self._fields)
+            self._index.setdefault(key, []).append(interaction)
+
+    def __len__(self):
+        return sum(len(interactions) for interactions in self._index.values())
+
+    def _exchange(self, method, url, headers, data, timeout, stream):
+        # Only the exchange is replaced, so deadlines are applied to replayed requests as they are to real ones
+        key = _matchKey(method, url, data, self._matchBody, self._fields)
+        interactions = self._index.get(key, None)
+        if not interactions:
+            raise CassetteMissError({"error": True, "errMsg": "No recorded response for " + key})
+
+        with self._lock:
+            position = self._positions.get(key, 0)
+            self._positions[key] = position + 1
+        interaction = interactions[position % len(interactions)]
+
+        latency = self._latency() if callable(self._latency) else self._latency
+        if latency and timeout is not None and latency > timeout:
+            # A real server this slow would have timed out
+            time.sleep(timeout)
+            raise requests.exceptions.ReadTimeout("Replayed response took {}s, longer than the timeout of {}s".format(latency, timeout))
+        if latency:
+            time.sleep(latency)
+
+        response = requests.models.Response()
+        response.status_code = interaction["status"]
+        # Older cassettes may list a Content-Encoding that no longer applies to the decoded body
+        response.headers = CaseInsensitiveDict((name, value) for name, value in interaction["headers"].items() if name in _keptHeaders)
+        response._content = interaction["response"].encode("utf-8")
+        # Marks the body as already read so iter_content serves it from memory
+        response._content_consumed = True
+        response.encoding = "utf-8"
+        response.url = url
+        return response
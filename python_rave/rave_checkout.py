@@ -0,0 +1,220 @@
+""" A resumable card checkout.
+
+A card checkout takes several calls with user input in between: charge, then a pin or billing address if Rave
+suggests one, then an OTP or a redirect to authUrl, then verify. A Checkout runs one step per call and records
+where it got to, so nothing waits for the user. Between steps it can be saved with toJson() and picked up by any
+worker with Checkout.fromJson(rave.Card, data). Card details and the card token are never saved, so a checkout resumed before its
+card has been charged with the pin or address (STARTED or AUTH_REQUIRED) needs them passed in again.
+
+    checkout = Checkout(rave.Card, payload)
+    checkout.start()                      # checkout.state == AUTH_REQUIRED, checkout.suggestedAuth == "PIN"
+    saved = checkout.toJson()
+    ...
+    checkout = Checkout.fromJson(rave.Card, saved, cardDetails={"cardno": ..., "cvv": ..., "expirymonth": ..., "expiryyear": ...})
+    checkout.submitAuth(pin="3310")       # checkout.state == OTP_REQUIRED
+    checkout.submitOtp("12345")           # checkout.state == COMPLETED
+"""
+import json, time
+from python_rave.rave_exceptions import RaveError, ServerError, DeadlineExceededError, CheckoutStateError, TransactionValidationError
+from python_rave.rave_misc import updatePayload, generateTransactionReference
+
+# Checkout states
+STARTED = "started"
+AUTH_REQUIRED = "authRequired"
+OTP_REQUIRED = "otpRequired"
+REDIRECT_REQUIRED = "redirectRequired"
+VERIFY_REQUIRED = "verifyRequired"
+COMPLETED = "completed"
+FAILED = "failed"
+
+# States waiting for something from the customer
+INPUT_STATES = [AUTH_REQUIRED, OTP_REQUIRED, REDIRECT_REQUIRED]
+FINAL_STATES = [COMPLETED, FAILED]
+
+# Errors that leave the checkout as it was, so the step can be called again
+_retryable = (ServerError, DeadlineExceededError)
+
+# Fields saved by toDict. The payload is saved separately, without the card details
+_fields = ["state", "txRef", "flwRef", "suggestedAuth", "authUrl", "result", "error", "otpAttempts", "history"]
+
+# Payload fields that are only ever held in memory
+_cardFields = ["cardno", "cvv", "expirymonth", "expiryyear", "pin"]
+
+# Result fields that are only ever held in memory. The card token charges the card again without the customer
+_resultSecretFields = ["cardToken"]
+
+
+class Checkout(object):
+    """ This is a card checkout that moves one step per call. It contains the following public functions:\n
+        .start -- This sends the first charge\n
+        .submitAuth -- This sends the charge again with the pin or address Rave asked for\n
+        .submitOtp -- This validates the charge with the customer's OTP\n
+        .verify -- This checks the result, e.g. after the customer returns from authUrl\n
+        .advance -- This runs whichever of the above the current state needs\n
+        .toDict/.toJson -- This saves the checkout. Card details (number, cvv, expiry and pin) and the cardToken of .result are left out\n
+        \n
+        A step that fails because of a server or network error, or a Deadline running out, raises and leaves the state unchanged, so the step can be called again. A step that Rave rejects moves the checkout to FAILED, with the reason in .error
+    """
+    def __init__(self, card, payload, maxOtpAttempts=3):
+        """ Parameters include:\n
+            card (Card) -- This is the component the checkout runs on, e.g. rave.Card or rave.Preauth\n
+            payload (dict) -- This is the card charge payload. A txRef is generated if it has none\n
+            maxOtpAttempts (int) -- (optional) This is how many wrong OTPs are allowed before the checkout fails
+        """
+        self._card = card
+        self._payload = dict(payload)
+        self._payload.setdefault("txRef", generateTransactionReference())
+        self._maxOtpAttempts = maxOtpAttempts
+        self.state = STARTED
+        self.txRef = self._payload["txRef"]
+        self.flwRef = None
+        self.suggestedAuth = None
+        self.authUrl = None
+        self.result = None
+        self.error = None
+        self.otpAttempts = 0
+        self.history = [[STARTED, time.time()]]
+
+    @property
+    def needsInput(self):
+        return self.state in INPUT_STATES
+
+    @property
+    def finished(self):
+        return self.state in FINAL_STATES
+
+    def _require(self, states, action):
+        if self.state not in states:
+            raise CheckoutStateError({"error": True, "state": self.state, "txRef": self.txRef, "errMsg": action})
+
+    def _moveTo(self, state):
+        self.state = state
+        self.history.append([state, time.time()])
+        if state in FINAL_STATES:
+            # Card details are not needed any more, so they are not kept or saved
+            self._payload = None
+        return self
+
+    def _fail(self, err):
+        self.error = err.err if hasattr(err, "err") else {"error": True, "errMsg": str(err)}
+        return self._moveTo(FAILED)
+
+    def _charge(self, payload):
+        if any(field not in payload for field in _cardFields if field != "pin"):
+            raise CheckoutStateError({"error": True, "state": self.state, "txRef": self.txRef, "errMsg": "charge without the card details, which are not saved. Pass cardDetails to fromDict/fromJson"})
+        try:
+            res = self._card.charge(payload)
+        except _retryable:
+            raise
+        except RaveError as e:
+            return self._fail(e)
+
+        self.flwRef = res["flwRef"]
+        self.error = None
+        self.suggestedAuth = None
+        # The payload that was accepted is kept, so a later charge does not lose the pin or address
+        self._payload = payload
+        if not res["validationRequired"]:
+            return self._moveTo(VERIFY_REQUIRED)
+        if res.get("suggestedAuth", None):
+            self.suggestedAuth = res["suggestedAuth"]
+            return self._moveTo(AUTH_REQUIRED)
+        if res.get("authUrl", None):
+            self.authUrl = res["authUrl"]
+            return self._moveTo(REDIRECT_REQUIRED)
+        return self._moveTo(OTP_REQUIRED)
+
+    def start(self):
+        """ This sends the first charge. Returns the checkout """
+        self._require([STARTED], "start")
+        return self._charge(self._payload)
+
+    def submitAuth(self, **kwargs):
+        """ This charges again with what Rave suggested, e.g. submitAuth(pin="3310") or submitAuth(address={"billingzip": ...}). Returns the checkout """
+        self._require([AUTH_REQUIRED], "take a pin or address")
+        payload = updatePayload(self.suggestedAuth, self._payload, inPlace=False, **kwargs)
+        return self._charge(payload)
+
+    def submitOtp(self, otp):
+        """ This validates the charge with the customer's OTP and verifies it. Returns the checkout """
+        self._require([OTP_REQUIRED], "take an OTP")
+        try:
+            self._card.validate(self.flwRef, otp)
+        except _retryable:
+            raise
+        except TransactionValidationError as e:
+            self.otpAttempts += 1
+            if self.otpAttempts >= self._maxOtpAttempts:
+                return self._fail(e)
+            # A mistyped OTP can be entered again
+            self.error = e.err
+            return self
+        self.error = None
+        self._moveTo(VERIFY_REQUIRED)
+        return self.verify()
+
+    def verify(self):
+        """ This checks the transaction and completes or fails the checkout. Returns the checkout """
+        self._require([REDIRECT_REQUIRED, VERIFY_REQUIRED], "be verified")
+        try:
+            res = self._card.verify(self.txRef)
+        except _retryable:
+            raise
+        except RaveError as e:
+            return self._fail(e)
+        self.result = res
+        if res.get("transactionComplete", False):
+            return self._moveTo(COMPLETED)
+        if self.state == REDIRECT_REQUIRED:
+            # The customer may not have finished on the redirect page yet
+            return self
+        self.error = {"error": True, "txRef": self.txRef, "flwRef": self.flwRef, "errMsg": "Transaction was not completed"}
+        return self._moveTo(FAILED)
+
+    def advance(self, **kwargs):
+        """ This runs the step the current state needs. OTP_REQUIRED takes otp=..., AUTH_REQUIRED takes the submitAuth arguments. Returns the checkout """
+        if self.state == STARTED:
+            return self.start()
+        if self.state == AUTH_REQUIRED:
+            return self.submitAuth(**kwargs)
+        if self.state == OTP_REQUIRED:
+            return self.submitOtp(kwargs.get("otp", None))
+        if self.state in (REDIRECT_REQUIRED, VERIFY_REQUIRED):
+            return self.verify()
+        self._require([], "advance")
+
+    def toDict(self):
+        """ This returns the checkout as a json serializable dict. It holds no card details, and .result is saved without its cardToken """
+        data = dict((field, getattr(self, field)) for field in _fields)
+        if self.result:
+            data["result"] = dict((key, value) for key, value in self.result.items() if key not in _resultSecretFields)
+        data["payload"] = dict((key, value) for key, value in self._payload.items() if key not in _cardFields) if self._payload else None
+        data["maxOtpAttempts"] = self._maxOtpAttempts
+        return data
+
+    def toJson(self):
+        return json.dumps(self.toDict())
+
+    @classmethod
+    def fromDict(cls, card, data, cardDetails=None):
+        """ This restores a checkout saved with toDict.\n
+             Parameters include:\n
+            card (Card) -- This is the component the checkout runs on, e.g. rave.Card\n
+            data (dict) -- This is what toDict returned\n
+            cardDetails (dict) -- (optional) These are "cardno", "cvv", "expirymonth" and "expiryyear", needed to resume a checkout in STARTED or AUTH_REQUIRED (and "pin" if the pin was already taken)
+        """
+        checkout = cls.__new__(cls)
+        checkout._card = card
+        payload = data["payload"]
+        if payload is not None:
+            payload = dict(payload)
+            payload.update(cardDetails or {})
+        checkout._payload = payload
+        checkout._maxOtpAttempts = data["maxOtpAttempts"]
+        for field in _fields:
+            setattr(checkout, field, data[field])
+        return checkout
+
+    @classmethod
+    def fromJson(cls, card, text, cardDetails=None):
+        return cls.fromDict(card, json.loads(text), cardDetails)
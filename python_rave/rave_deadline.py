@@ -0,0 +1,105 @@
+""" Deadlines shared by every request made while they are active.
+
+A Deadline is a time budget. While it is active (in a with block, or passed as deadline= to a component method) every
+request sent by the transport gets the remaining budget as its timeout, no request is sent once it has run out, and
+running out raises a DeadlineExceededError. Compound flows share one budget by running under one deadline:
+
+    with Deadline(3.0):
+        res = rave.Card.charge(payload)
+        rave.Card.verify(res["txRef"])
+
+Deadlines are held in a contextvar, so they follow asyncio tasks and are passed on to the threads of batch calls.
+"""
+import contextvars, functools, inspect, time
+from python_rave.rave_exceptions import DeadlineExceededError
+
+_current = contextvars.ContextVar("raveDeadline", default=None)
+# The tokens of the with blocks entered in this context, innermost last
+_scopes = contextvars.ContextVar("raveDeadlineScopes", default=())
+
+
+def currentDeadline():
+    """ This returns the deadline in force for the current thread or task, or None """
+    return _current.get()
+
+
+class Deadline(object):
+    """ This is a time budget. It contains the following public functions:\n
+        .remaining -- This returns the seconds left (0 once it has run out)\n
+        .expired -- This returns True once it has run out\n
+        .check -- This raises a DeadlineExceededError if it (or an earlier deadline it is running inside) has run out\n
+        .timeout -- This returns the timeout to use for one request\n
+        \n
+        Entering a deadline inside another one never extends the outer budget: the earlier of the two is used. One Deadline can be used by many threads and tasks at once
+    """
+    def __init__(self, seconds):
+        """ Parameters include:\n
+            seconds (Number) -- This is the budget in seconds, counted from now
+        """
+        self.seconds = seconds
+        self._expiresAt = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self._expiresAt - time.monotonic())
+
+    def expired(self):
+        return self._expiresAt <= time.monotonic()
+
+    def _effective(self):
+        """ This returns the deadline that applies where it is called: this one, or an earlier one active in the current context """
+        current = _current.get()
+        return current if current is not None and current._expiresAt < self._expiresAt else self
+
+    def check(self, action="continue"):
+        """ This raises a DeadlineExceededError if this deadline, or an earlier one it is running inside, has run out """
+        deadline = self._effective()
+        if deadline.expired():
+            raise DeadlineExceededError({"error": True, "budget": deadline.seconds, "errMsg": "Deadline of {}s ran out before we could {}".format(deadline.seconds, action)})
+
+    def timeout(self, default=None, action="send a request"):
+        """ This returns the remaining budget (of the earliest deadline in force), or default if that is shorter. Raises a DeadlineExceededError if nothing is left """
+        deadline = self._effective()
+        deadline.check(action)
+        remaining = deadline.remaining()
+        return remaining if default is None else min(default, remaining)
+
+    def __enter__(self):
+        outer = _current.get()
+        effective = self if outer is None or self._expiresAt <= outer._expiresAt else outer
+        _scopes.set(_scopes.get() + (_current.set(effective),))
+        return effective
+
+    def __exit__(self, excType, exc, traceback):
+        scopes = _scopes.get()
+        _current.reset(scopes[-1])
+        _scopes.set(scopes[:-1])
+
+
+def _resumeWithin(deadline, generator):
+    """ This runs each step of a generator under deadline, since the with block of the call that created it has already ended """
+    while True:
+        with deadline:
+            try:
+                item = next(generator)
+            except StopIteration:
+                return
+        yield item
+
+
+def acceptsDeadline(method):
+    """ This lets a component method take deadline= (a Deadline or a number of seconds) and run under it """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        deadline = kwargs.pop("deadline", None)
+        if deadline is None:
+            return method(self, *args, **kwargs)
+        if not isinstance(deadline, Deadline):
+            deadline = Deadline(deadline)
+        with deadline as effective:
+            effective.check("start " + method.__name__)
+            result = method(self, *args, **kwargs)
+        # Lazy results (e.g. resolveAccounts or fetch(stream=True)) do their requests while being iterated
+        if inspect.isgenerator(result):
+            return _resumeWithin(deadline, result)
+        return result
+    return wrapper
@@ -110,4 +110,52 @@ class TransferFetchError(RaveError):
         self.err = err
     
     def __str__(self):
-        return "Transfer fetch failed with error: " + self.err["errMsg"]
\ No newline at end of file
+        return "Transfer fetch failed with error: " + self.err["errMsg"]
+
+class AccountResolveError(RaveError):
+    """ Raised when an account number could not be resolved to an account name """
+    def __init__(self, err):
+        self.err = err
+    
+    def __str__(self):
+        return "Account resolution failed with error: " + str(self.err["errMsg"])
+
+class InvalidPaymentDetailsError(RaveError):
+    """ Raised when payment details fail local validation before being sent to Rave """
+    def __init__(self, err):
+        self.err = err
+    
+    def __str__(self):
+        return "Invalid \"" + self.err["field"] + "\": " + self.err["errMsg"]
+
+class CassetteMissError(RaveError):
+    """ Raised when a replay transport has no recorded response for a request """
+    def __init__(self, err):
+        self.err = err
+    
+    def __str__(self):
+        return self.err["errMsg"]
+
+class CheckoutStateError(RaveError):
+    """ Raised when a checkout step is called in a state that does not allow it """
+    def __init__(self, err):
+        self.err = err
+    
+    def __str__(self):
+        return "Checkout in state \"" + self.err["state"] + "\" cannot " + self.err["errMsg"]
+
+class IdempotencyConflictError(RaveError):
+    """ Raised when a txRef or reference is reused for a request with different details """
+    def __init__(self, err):
+        self.err = err
+    
+    def __str__(self):
+        return "Idempotency conflict for \"" + self.err["key"] + "\": " + self.err["errMsg"]
+
+class DeadlineExceededError(RaveError):
+    """ Raised when the time budget of a Deadline runs out """
+    def __init__(self, err):
+        self.err = err
+    
+    def __str__(self):
+        return self.err["errMsg"]
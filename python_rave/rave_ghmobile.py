@@ -1,14 +1,16 @@
 from python_rave.rave_payment import Payment
 from python_rave.rave_misc import generateTransactionReference
-import json
+from python_rave.rave_deadline import acceptsDeadline
+import json, copy
 
 class GhMobile(Payment):
     
-    def __init__(self, publicKey, secretKey, production, usingEnv):
-        super(GhMobile, self).__init__(publicKey, secretKey, production, usingEnv)
+    def __init__(self, publicKey, secretKey, production, usingEnv, transport=None):
+        super(GhMobile, self).__init__(publicKey, secretKey, production, usingEnv, transport)
 
 
     # Charge mobile money function
+    @acceptsDeadline
     def charge(self, accountDetails, hasFailed=False):
         """ This is the ghMobile charge call.
              Parameters include:\n
@@ -18,6 +20,8 @@ class GhMobile(Payment):
 
         endpoint = self._baseUrl + self._endpointMap["account"]["charge"]
         
+        # Working on a copy so the caller's dict is never modified
+        accountDetails = copy.copy(accountDetails)
         # It is faster to add boilerplate than to check if each one is present
         accountDetails.update({"payment_type": "mobilemoneygh", "country":"GH", "is_mobile_money_gh":"1", "currency":"GHS"})
         
@@ -0,0 +1,130 @@
+""" An HTTP/2 transport. It needs the http2 extra: pip install python_rave[http2]
+
+Requests from every thread sharing an Http2Transport are multiplexed over a few HTTP/2 connections instead of each
+taking a connection of its own, and responses are asked for compressed. It is a drop-in replacement for
+RaveTransport, including fallback base urls and deadlines:
+
+    rave = Rave("YOUR_PUBLIC_KEY", transport=Http2Transport(compressAbove=1024))
+"""
+import asyncio, threading
+import requests
+from requests.structures import CaseInsensitiveDict
+from urllib3.exceptions import MaxRetryError, NewConnectionError, ConnectTimeoutError
+from python_rave.rave_transport import RaveTransport
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+
+class _StreamedBody(object):
+    """ This lets requests read a streamed httpx response, so response.iter_content works as usual. Each chunk is read on the transport's event loop """
+    def __init__(self, response, transport):
+        self._response = response
+        self._transport = transport
+
+    def stream(self, chunkSize, decode_content=True):
+        chunks = self._response.aiter_bytes(chunkSize)
+        while True:
+            try:
+                yield self._transport._run(chunks.__anext__())
+            except StopAsyncIteration:
+                return
+            except httpx.TransportError as e:
+                raise _translate(e, str(self._response.url))
+
+    def read(self, amount=None):
+        return self._transport._run(self._response.aread())
+
+    def close(self):
+        self._transport._run(self._response.aclose())
+
+
+def _translate(err, url):
+    """ This returns the requests exception matching an httpx one, so callers and failover handle both clients alike """
+    if isinstance(err, httpx.ConnectTimeout):
+        return requests.exceptions.ConnectTimeout(MaxRetryError(None, url, ConnectTimeoutError(None, str(err))))
+    if isinstance(err, httpx.ConnectError):
+        # Nothing was sent, so like requests this is a connection error that is safe to retry elsewhere
+        return requests.exceptions.ConnectionError(MaxRetryError(None, url, NewConnectionError(None, str(err))))
+    if isinstance(err, httpx.ReadTimeout):
+        return requests.exceptions.ReadTimeout(str(err))
+    if isinstance(err, httpx.TimeoutException):
+        return requests.exceptions.Timeout(str(err))
+    if isinstance(err, httpx.DecodingError):
+        return requests.exceptions.ContentDecodingError(str(err))
+    return requests.exceptions.ConnectionError(str(err))
+
+
+def _toResponse(response, stream, transport):
+    """ This returns an httpx response as a requests.Response, which is what the rave components read """
+    converted = requests.models.Response()
+    converted.status_code = response.status_code
+    converted.reason = response.reason_phrase
+    converted.url = str(response.url)
+    converted.encoding = response.charset_encoding
+    converted.headers = CaseInsensitiveDict(response.headers.items())
+    # httpx has already decompressed the body, so these no longer describe it
+    converted.headers.pop("Content-Encoding", None)
+    converted.headers.pop("Content-Length", None)
+    if stream:
+        converted.raw = _StreamedBody(response, transport)
+    else:
+        converted._content = response.content
+        converted._content_consumed = True
+    return converted
+
+
+class Http2Transport(RaveTransport):
+    """ This is a transport that multiplexes requests over HTTP/2 connections. It contains the same public functions as RaveTransport\n
+        \n
+        Over https, HTTP/2 is negotiated with the server and HTTP/1.1 is used if the server does not offer it. Its few connections stay open, so hosts are looked up as usual rather than through a DnsCache. Responses are asked for with gzip and deflate (and brotli or zstd if installed) and decompressed as they arrive
+    """
+    def __init__(self, maxConnections=4, timeout=None, baseUrls=None, failurePenaltyHalfLife=30, compressAbove=None, priorKnowledge=False, client=None):
+        """ Parameters include:\n
+            maxConnections (int) -- (optional) This is the most connections opened per host. Each carries many requests at once, so a few serve many threads\n
+            timeout (Number) -- (optional) This is the default timeout in seconds for every request\n
+            baseUrls (dict) -- (optional) These are the base urls to use per environment, as for RaveTransport\n
+            failurePenaltyHalfLife (Number) -- (optional) This is how fast in seconds a failed base url recovers its health score\n
+            compressAbove (int) -- (optional) Request bodies larger than this many bytes (e.g. Transfer.bulk payloads) are sent gzip compressed. Off by default. A host that answers 415, or any other 4xx saying it could not decode the body, gets uncompressed bodies from then on\n
+            priorKnowledge (bool) -- (optional) If True, HTTP/2 is spoken straight away without negotiating. Use this for plain http servers known to speak HTTP/2, e.g. a local stub\n
+            client (httpx.AsyncClient) -- (optional) This is a preconfigured client to use instead of creating one
+        """
+        if httpx is None:
+            raise ImportError("Http2Transport requires httpx with HTTP/2 support. Install it with: pip install python_rave[http2]")
+        super(Http2Transport, self).__init__(poolSize=maxConnections, timeout=timeout, baseUrls=baseUrls, dnsTtl=None, failurePenaltyHalfLife=failurePenaltyHalfLife, compressAbove=compressAbove)
+        if client is None:
+            limits = httpx.Limits(max_connections=maxConnections, max_keepalive_connections=maxConnections)
+            client = httpx.AsyncClient(http2=True, http1=not priorKnowledge, limits=limits, timeout=None)
+        self._client = client
+        # The blocking httpx client is not safe to share between threads over HTTP/2 (two threads can put their streams
+        # on the wire out of order, which the server treats as a protocol error). So one event loop thread drives an
+        # async client and the calling threads wait for their own request on it
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="rave-http2")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _newSession(self, poolSize):
+        # Requests go through the httpx client, so no requests session is created
+        return None
+
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def _exchange(self, method, url, headers, data, timeout, stream):
+        request = self._client.build_request(method, url, headers=headers, content=data, timeout=httpx.Timeout(timeout))
+        try:
+            response = self._run(self._client.send(request, stream=stream))
+        except httpx.TransportError as e:
+            raise _translate(e, url)
+        return _toResponse(response, stream, self)
+
+    def close(self):
+        if not self._loop.is_closed():
+            self._run(self._client.aclose())
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+        super(Http2Transport, self).close()
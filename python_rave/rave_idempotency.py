@@ -0,0 +1,225 @@
+""" Collapsing of duplicate charges and transfers within one process.
+
+An IdempotencyGuard lets one call per txRef/reference go to Rave. Calls with the same key that arrive while it is in
+flight wait for it and get its result, and calls that arrive after it finished get the stored result until it
+expires. It works the same from threads and from asyncio, and both can share one guard.
+
+    guard = IdempotencyGuard().attach(rave)
+    rave.Card.charge(payload)                          # threads
+    await guard.acall(rave.Card.charge, payload)       # asyncio
+"""
+import asyncio, contextvars, copy, functools, hashlib, inspect, json, threading, time
+from collections import OrderedDict
+from concurrent.futures import Future
+from python_rave.rave_exceptions import IdempotencyConflictError
+
+# The methods attach guards, per component
+_guardedMethods = {"Card": "charge", "Preauth": "charge", "Account": "charge", "Ussd": "charge", "GhMobile": "charge", "Mpesa": "charge", "Transfer": "initiate"}
+
+
+# Fields updatePayload adds when Rave asks for a pin or an address. A charge sent again with them is the next step of
+# the same order, not a duplicate of the first charge
+_authFields = ("suggested_auth", "pin", "billingzip", "billingcity", "billingaddress", "billingstate", "billingcountry")
+
+
+def _authStage(payload):
+    """ This returns which auth details a charge payload carries, e.g. () for the first charge or ("pin",) after updatePayload """
+    if not isinstance(payload, dict):
+        return ()
+    return tuple(stage for stage, field in (("pin", "pin"), ("address", "billingzip")) if field in payload)
+
+
+def _referenceOf(payload):
+    if isinstance(payload, dict):
+        return payload.get("txRef", None) or payload.get("reference", None)
+    return None
+
+
+def _fingerprint(payload, kwargs):
+    """ This is a hash of the arguments, so a different request that reuses a reference is caught """
+    # A deadline is how long the caller will wait, not part of the request
+    kwargs = dict((name, value) for name, value in kwargs.items() if name != "deadline")
+    # Auth details are part of the key, so a pin typed again differently is a retry rather than a conflict
+    if isinstance(payload, dict):
+        payload = dict((name, value) for name, value in payload.items() if name not in _authFields)
+    text = json.dumps([payload, kwargs], sort_keys=True, default=str)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class IdempotencyGuard(object):
+    """ This lets one call per key through at a time. It contains the following public functions:\n
+        .call -- This runs a call, or waits for and returns the result of the same call already in flight or recently finished\n
+        .acall -- This is .call for asyncio. Blocking functions are run in an executor\n
+        .attach -- This guards the charge (and Transfer.initiate) methods of a Rave object\n
+        .detach -- This removes the guards\n
+        \n
+        Keys are the component, the public key, the txRef/reference of the payload and the auth details it carries, so the charge sent again with the pin or address Rave asked for is not taken for a duplicate. Calls without a txRef/reference are not guarded, since a new one is generated for every call.\n
+        A call that reuses a reference with different details raises an IdempotencyConflictError instead of returning another request's result.\n
+        Failed calls are shared with the callers waiting on them but not stored, so a later retry is sent again
+    """
+    def __init__(self, ttl=600, maxSize=10000, storeErrors=False):
+        """ Parameters include:\n
+            ttl (Number) -- (optional) This is how long in seconds a finished result is returned to late duplicates\n
+            maxSize (int) -- (optional) This is the most finished results kept. The oldest are dropped first\n
+            storeErrors (bool) -- (optional) If True, failures (e.g. a declined card) are stored and returned to late duplicates too
+        """
+        self._ttl = ttl
+        self._maxSize = maxSize
+        self._storeErrors = storeErrors
+        self._lock = threading.Lock()
+        # key -> (future, fingerprint)
+        self._inFlight = {}
+        # key -> (future, fingerprint, expiresAt), oldest first
+        self._finished = OrderedDict()
+        self._attached = []
+        self.counts = {"sent": 0, "joined": 0, "stored": 0, "conflicts": 0}
+
+    def _key(self, func, payload, key, component=None):
+        if key is not None:
+            return key
+        reference = _referenceOf(payload)
+        if reference is None:
+            return None
+        # Wrappers (e.g. from a Profiler) keep the bound method in __wrapped__
+        while component is None and func is not None:
+            component = getattr(func, "__self__", None)
+            func = func if component is not None else getattr(func, "__wrapped__", None)
+        # Including the public key keeps two merchants in one process apart, and the auth stage lets the charge sent
+        # again with a pin or address through after the first charge of the same txRef
+        owner = component._getPublicKey() if hasattr(component, "_getPublicKey") else None
+        return (type(component).__name__, getattr(func, "__name__", None), owner, str(reference), _authStage(payload))
+
+    def _begin(self, key, fingerprint):
+        """ This returns (future, True) for the call that should be sent, or (future, False) for a duplicate """
+        now = time.time()
+        with self._lock:
+            while self._finished:
+                oldest = next(iter(self._finished.values()))
+                if oldest[2] > now:
+                    break
+                self._finished.popitem(last=False)
+
+            entry = self._inFlight.get(key, None)
+            status = "joined"
+            if entry is None:
+                entry = self._finished.get(key, None)
+                status = "stored"
+            if entry is None:
+                future = Future()
+                self._inFlight[key] = (future, fingerprint)
+                self.counts["sent"] += 1
+                return future, True
+
+            if entry[1] != fingerprint:
+                self.counts["conflicts"] += 1
+                raise IdempotencyConflictError({"error": True, "key": str(key[3] if isinstance(key, tuple) else key), "errMsg": "This reference was already used for a request with different details"})
+            self.counts[status] += 1
+            return entry[0], False
+
+    def _finish(self, key, future, result=None, err=None):
+        with self._lock:
+            fingerprint = self._inFlight.pop(key)[1]
+            if err is None or self._storeErrors:
+                self._finished[key] = (future, fingerprint, time.time() + self._ttl)
+                while len(self._finished) > self._maxSize:
+                    self._finished.popitem(last=False)
+        # Waiters are woken after the result is stored, so a duplicate arriving now finds it one way or the other
+        if err is None:
+            future.set_result(result)
+        else:
+            future.set_exception(err)
+
+    def call(self, func, payload, key=None, **kwargs):
+        """ This calls func(payload, **kwargs) unless the same call is in flight or finished recently, in which case its result is returned.\n
+             Parameters include:\n
+            func (callable) -- This is e.g. rave.Card.charge\n
+            payload (dict) -- This is the payload. Its txRef/reference is the key\n
+            key (hashable) -- (optional) This is a key to use instead of the one built from the payload
+        """
+        func = getattr(func, "__wrapped__", func) if getattr(func, "_guard", None) is self else func
+        key = self._key(func, payload, key)
+        if key is None:
+            return func(payload, **kwargs)
+        future, isFirst = self._begin(key, _fingerprint(payload, kwargs))
+        if not isFirst:
+            # Every caller gets its own copy, nested data included, as callers of an unguarded call would
+            return copy.deepcopy(future.result())
+        try:
+            result = func(payload, **kwargs)
+        except BaseException as e:
+            self._finish(key, future, err=e)
+            raise
+        self._finish(key, future, result)
+        return result
+
+    async def acall(self, func, payload, key=None, executor=None, **kwargs):
+        """ This is .call for asyncio. Coroutine functions are awaited and blocking functions (like the rave components) are run in executor.\n
+             Parameters include:\n
+            executor (Executor) -- (optional) This is the executor blocking calls run on. Defaults to the event loop's default executor
+        """
+        # A method guarded by attach is unwrapped so it is not guarded twice
+        func = getattr(func, "__wrapped__", func) if getattr(func, "_guard", None) is self else func
+        key = self._key(func, payload, key)
+        loop = asyncio.get_running_loop()
+
+        def run():
+            if inspect.iscoroutinefunction(func):
+                return asyncio.ensure_future(func(payload, **kwargs))
+            # The executor thread gets a copy of this task's context, so an active Deadline applies to the call
+            return loop.run_in_executor(executor, functools.partial(contextvars.copy_context().run, func, payload, **kwargs))
+
+        if key is None:
+            return await run()
+        future, isFirst = self._begin(key, _fingerprint(payload, kwargs))
+        if not isFirst:
+            return copy.deepcopy(await asyncio.wrap_future(future))
+
+        def finished(work):
+            if work.cancelled():
+                self._finish(key, future, err=asyncio.CancelledError())
+            elif work.exception() is not None:
+                self._finish(key, future, err=work.exception())
+            else:
+                self._finish(key, future, work.result())
+
+        # The key is released when the call itself returns, not when this task stops waiting for it. Cancelling the
+        # caller cannot stop a charge already running in a thread, so a retry must not be let through until it is done
+        try:
+            work = run()
+        except BaseException as e:
+            self._finish(key, future, err=e)
+            raise
+        work.add_done_callback(finished)
+        return await asyncio.shield(work)
+
+    def attach(self, rave):
+        """ This guards Card/Preauth/Account/Ussd/GhMobile/Mpesa .charge and Transfer.initiate of a Rave object. Returns the guard """
+        for componentName, methodName in _guardedMethods.items():
+            component = getattr(rave, componentName, None)
+            if component is None:
+                continue
+            method = getattr(component, methodName)
+            # Anything already set on the instance (e.g. a profiler) is put back by detach
+            previous = component.__dict__.get(methodName, None)
+            setattr(component, methodName, self._wrap(component, method))
+            self._attached.append((component, methodName, previous))
+        return self
+
+    def _wrap(self, component, method):
+        @functools.wraps(method)
+        def wrapper(payload, *args, **kwargs):
+            if args:
+                # Positional options (e.g. hasFailed) are not part of the key, so these calls are not guarded
+                return method(payload, *args, **kwargs)
+            # The key is built from the component here, since method may itself be a wrapper
+            return self.call(method, payload, self._key(method, payload, None, component), **kwargs)
+        wrapper._guard = self
+        return wrapper
+
+    def detach(self):
+        for component, methodName, previous in reversed(self._attached):
+            if previous is None:
+                component.__dict__.pop(methodName, None)
+            else:
+                setattr(component, methodName, previous)
+        self._attached = []
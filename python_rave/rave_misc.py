@@ -1,5 +1,5 @@
 """ Miscallaneous helper functions """
-import time
+import time, copy, csv, json
 from python_rave.rave_exceptions import IncompletePaymentDetailsError, AuthMethodNotSupportedError
 # Helper function to generate unique transaction reference
 def generateTransactionReference(merchantId=None):
@@ -14,6 +14,23 @@ def generateTransactionReference(merchantId=None):
     else:
         return "MC-"+str(timestamp)
 
+# Streams dict records from a CSV or JSON lines file
+def readRecords(path, delimiter=","):
+    """ This streams rows from a file one at a time so that large files are never fully loaded.\n
+         Parameters include:\n
+        path (string) -- This is the path to a CSV file with a header row, or a JSON lines file ending in .jsonl\n
+        delimiter (string) -- (optional) This is the CSV delimiter
+    """
+    with open(path, "r") as fh:
+        if path.endswith(".jsonl"):
+            for line in fh:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+        else:
+            for row in csv.DictReader(fh, delimiter=delimiter):
+                yield row
+
 # If parameters are complete, returns true. If not returns false with parameter missing
 def checkIfParametersAreComplete(requiredParameters, paymentDetails):
     """ This returns true/false depending on if the paymentDetails match the required parameters """
@@ -39,13 +56,14 @@ def getTypeOfArgsRequired(suggestedAuth):
     return keywordMap[suggestedAuth]
 
 # Update payload
-def updatePayload(suggestedAuth, payload, **kwargs): 
+def updatePayload(suggestedAuth, payload, inPlace=True, **kwargs): 
     """ This is used to update the payload of your request upon a charge that requires more parameters. It maintains the transaction refs and all the original parameters of the request.\n
             Parameters include:\n
         suggestedAuth (dict) -- This is what is returned from the charge call\n
         payload (dict) -- This is the original payload\n
+        inPlace (bool) -- (optional) If False, payload is left untouched and an updated copy is returned. Use this when payloads are shared between threads\n
         \n
-        ## This updates payload directly
+        ## By default this updates payload directly. The updated payload is also returned
     """ 
 
     # Sets the keyword to check for in kwargs (it maps the suggestedAuth to keywords)
@@ -56,7 +74,7 @@ def updatePayload(suggestedAuth, payload, **kwargs):
     # 1) Checks if keyword is present in kwargs
     if not kwargs.get(keyword, None):
         # Had to split variable assignment and raising ValueError because of error message python displayed
-        errorMsg = "Please provide the appropriate argument for the auth method. For {}, we require a \"{}\" argument.".format(suggestedAuth["suggested_auth"], keyword)
+        errorMsg = "Please provide the appropriate argument for the auth method. For {}, we require a \"{}\" argument.".format(suggestedAuth, keyword)
         raise ValueError(errorMsg)
 
     # 2) If keyword is address, checks if all required address paramaters are present
@@ -65,6 +83,8 @@ def updatePayload(suggestedAuth, payload, **kwargs):
         checkIfParametersAreComplete(requiredAddressParameters, kwargs[keyword])
         
     # All checks passed
+    if not inPlace:
+        payload = copy.copy(payload)
 
     # Add items to payload
     # If the argument is a dictionary, we add the argument as is
@@ -75,5 +95,7 @@ def updatePayload(suggestedAuth, payload, **kwargs):
     else:
         payload.update({"suggested_auth": suggestedAuth})
         payload.update({keyword: kwargs[keyword]})
+
+    return payload
             
     
\ No newline at end of file
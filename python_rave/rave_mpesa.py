@@ -1,13 +1,15 @@
 from python_rave.rave_payment import Payment
 from python_rave.rave_misc import generateTransactionReference
-import json
+from python_rave.rave_deadline import acceptsDeadline
+import json, copy
 
 class Mpesa(Payment):
     
-    def __init__(self, publicKey, secretKey, production, usingEnv):
-        super(Mpesa, self).__init__(publicKey, secretKey, production, usingEnv)
+    def __init__(self, publicKey, secretKey, production, usingEnv, transport=None):
+        super(Mpesa, self).__init__(publicKey, secretKey, production, usingEnv, transport)
 
     # Charge mobile money function
+    @acceptsDeadline
     def charge(self, accountDetails, hasFailed=False):
         """ This is the mpesa charge call.\n
              Parameters include:\n
@@ -16,6 +18,8 @@ class Mpesa(Payment):
         """
         # Setting the endpoint
         endpoint = self._baseUrl + self._endpointMap["account"]["charge"]
+        # Working on a copy so the caller's dict is never modified
+        accountDetails = copy.copy(accountDetails)
         # Adding boilerplate mpesa requirements
         accountDetails.update({"payment_type": "mpesa", "country":"KE", "is_mpesa":"1", "currency":"KES"})
         # If transaction reference is not set 
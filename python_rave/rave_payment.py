@@ -2,13 +2,14 @@ import requests, json, copy
 from python_rave.rave_base import RaveBase
 from python_rave.rave_exceptions import RaveError, IncompletePaymentDetailsError, AuthMethodNotSupportedError, TransactionChargeError, TransactionVerificationError, TransactionValidationError, ServerError, RefundError
 from python_rave.rave_misc import checkIfParametersAreComplete
+from python_rave.rave_deadline import acceptsDeadline
 
 # All payment subclasses are encrypted classes
 class Payment(RaveBase):
     """ This is the base class for all the payments """
-    def __init__(self, publicKey, secretKey, production, usingEnv):
+    def __init__(self, publicKey, secretKey, production, usingEnv, transport=None):
         # Instantiating the base class
-        super(Payment, self).__init__(publicKey, secretKey, production, usingEnv)
+        super(Payment, self).__init__(publicKey, secretKey, production, usingEnv, transport)
 
 
     def _preliminaryResponseChecks(self, response, TypeOfErrorToRaise, txRef=None, flwRef=None):
@@ -64,12 +65,18 @@ class Payment(RaveBase):
         responseJson = res["json"]
         flwRef = res["flwRef"]
 
+        # Amount and currency are returned so callers can reconcile what was actually charged
+        amount = responseJson["data"].get("amount", None)
+        currency = responseJson["data"].get("currency", None)
+        # Rave's own status, e.g. "successful", "pending" or "failed", tells a declined charge from one still in progress
+        status = responseJson["data"].get("status", None)
+
         # Check if the chargecode is 00
         if not (responseJson["data"].get("chargecode", None) == "00"):
-            return {"error": False, "transactionComplete": False, "txRef": txRef, "flwRef":flwRef}
+            return {"error": False, "transactionComplete": False, "txRef": txRef, "flwRef":flwRef, "amount": amount, "currency": currency, "status": status}
         
         else:
-            return {"error": False, "transactionComplete": True, "txRef": txRef, "flwRef":flwRef}
+            return {"error": False, "transactionComplete": True, "txRef": txRef, "flwRef":flwRef, "amount": amount, "currency": currency, "status": status}
 
     
     # returns true if further action is required, false if it isn't    
@@ -93,6 +100,7 @@ class Payment(RaveBase):
 
 
     # Charge function (hasFailed is a flag that indicates there is a timeout), shouldReturnRequest indicates whether to send the request back to the _handleResponses function
+    @acceptsDeadline
     def charge(self, paymentDetails, requiredParameters, endpoint, shouldReturnRequest=False):
         """ This is the base charge call. It is usually overridden by implementing classes.\n
              Parameters include:\n
@@ -127,7 +135,7 @@ class Payment(RaveBase):
             "client": encryptedPaymentDetails,
             "alg": "3DES-24"
         }
-        response = requests.post(endpoint, headers=headers, data=json.dumps(payload))
+        response = self._transport.post(endpoint, headers=headers, data=json.dumps(payload))
         
         if shouldReturnRequest:
             return self._handleChargeResponse(response, paymentDetails["txRef"], paymentDetails)
@@ -135,6 +143,7 @@ class Payment(RaveBase):
             return self._handleChargeResponse(response, paymentDetails["txRef"])
        
 
+    @acceptsDeadline
     def validate(self, flwRef, otp, endpoint=None):
         """ This is the base validate call.\n
              Parameters include:\n
@@ -157,14 +166,15 @@ class Payment(RaveBase):
             "otp": otp
         }
         
-        response = requests.post(endpoint, headers = headers, data=json.dumps(payload))
+        response = self._transport.post(endpoint, headers = headers, data=json.dumps(payload))
         return self._handleValidateResponse(response, flwRef)
         
     # Verify charge
+    @acceptsDeadline
     def verify(self, txRef, endpoint=None):
         """ This is used to check the status of a transaction.\n
              Parameters include:\n
-            txRef (string) -- This is the transaction reference that you passed to your charge call. If you didn't define a reference, you can access the auto-generated one from payload["txRef"] or action["txRef"] from the charge call\n
+            txRef (string) -- This is the transaction reference that you passed to your charge call. If you didn't define a reference, you can access the auto-generated one from action["txRef"] returned from the charge call\n
         """
         if not endpoint:
             endpoint = self._baseUrl + self._endpointMap["verify"]
@@ -180,7 +190,7 @@ class Payment(RaveBase):
             "SECKEY": self._getSecretKey()
         }
 
-        response = requests.post(endpoint, headers=headers, data=json.dumps(payload))
+        response = self._transport.post(endpoint, headers=headers, data=json.dumps(payload))
         return self._handleVerifyResponse(response, txRef)
 
     # Refund call
@@ -198,7 +208,7 @@ class Payment(RaveBase):
     #     }
     #     endpoint = self._baseUrl+self._endpointMap["refund"]
 
-    #     response = requests.post(endpoint, headers = headers, data=json.dumps(payload))
+    #     response = self._transport.post(endpoint, headers = headers, data=json.dumps(payload))
 
     #     try:
     #         responseJson = response.json()
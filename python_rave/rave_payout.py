@@ -0,0 +1,259 @@
+""" Streaming bulk payout runner built on Transfer.initiate and Transfer.bulk.
+
+Rows are read one at a time from CSV/JSON lines, validated, submitted with bounded concurrency and written to a
+JSON lines results file in input order. Re-running with resume skips every row the previous results file
+records as submitted, so an interrupted run can be continued. Rows without a reference get a deterministic one
+(prefix-rowNumber), so a row that was in flight when a run was killed is rejected by Rave as a duplicate
+reference when resubmitted rather than paid twice.
+
+    python -m python_rave.rave_payout payroll.csv --results payroll.results.jsonl --concurrency 8 --resume
+"""
+import argparse, itertools, json, os, sys
+from decimal import Decimal, InvalidOperation
+from python_rave.rave_batch import imapBounded, AdaptiveLimiter
+from python_rave.rave_misc import readRecords, checkIfParametersAreComplete
+from python_rave.rave_exceptions import IncompletePaymentDetailsError
+
+# Result statuses written for every row
+SUBMITTED = "submitted"
+FAILED = "failed"
+INVALID = "invalid"
+
+# Maps transfer payload fields to the column names expected in bulk_data
+_bulkFieldMap = {"account_bank": "Bank", "account_number": "Account Number", "amount": "Amount", "currency": "Currency", "narration": "Narration", "reference": "reference"}
+
+
+class PayoutRunner(object):
+    """ This runs payouts from a stream of transfer rows. It contains the following public functions:\n
+        .run -- This submits every row and yields one result per row in input order\n
+        .runFile -- This reads rows from a file and writes the results to a results file\n
+        \n
+        Running totals are kept in .counts
+    """
+    requiredParameters = ["account_bank", "account_number", "amount", "currency"]
+
+    def __init__(self, transfer, concurrency=8, mode="auto", bulkSize=100, bulkThreshold=100, title="python_rave payout"):
+        """ Parameters include:\n
+            transfer (Transfer) -- This is the rave.Transfer object used for submission\n
+            concurrency (int or AdaptiveLimiter) -- (optional) This is the maximum number of transfer calls in flight\n
+            mode (string) -- (optional) This is "single" (one Transfer.initiate per row), "bulk" (Transfer.bulk per bulkSize rows) or "auto"\n
+            bulkSize (int) -- (optional) This is the number of rows sent per Transfer.bulk call\n
+            bulkThreshold (int) -- (optional) In auto mode, inputs with more rows than this are sent in bulk\n
+            title (string) -- (optional) This is the title given to bulk batches
+        """
+        if mode not in ("auto", "single", "bulk"):
+            raise ValueError("mode must be one of \"auto\", \"single\" or \"bulk\"")
+        self._transfer = transfer
+        self._concurrency = concurrency
+        self._mode = mode
+        self._bulkSize = bulkSize
+        self._bulkThreshold = bulkThreshold
+        self._title = title
+        self.counts = {}
+
+    def _result(self, rowNumber, reference, status, **kwargs):
+        result = {"row": rowNumber, "reference": reference, "status": status}
+        result.update(kwargs)
+        return result
+
+    def _validate(self, rowNumber, row, referencePrefix):
+        """ This returns (row, None) for a valid row or (None, result) describing why it is invalid """
+        row = dict((key, value) for key, value in row.items() if value not in (None, ""))
+        if "reference" not in row:
+            if not referencePrefix:
+                return None, self._result(rowNumber, None, INVALID, errMsg="Every row needs a reference (or pass referencePrefix) so that runs can be resumed safely")
+            # Deterministic references mean a resumed run can never create a second transfer for the same row
+            row["reference"] = "{}-{}".format(referencePrefix, rowNumber)
+
+        try:
+            checkIfParametersAreComplete(self.requiredParameters, row)
+            if Decimal(str(row["amount"])) <= 0:
+                return None, self._result(rowNumber, row["reference"], INVALID, errMsg="amount must be greater than zero")
+        except IncompletePaymentDetailsError as e:
+            return None, self._result(rowNumber, row["reference"], INVALID, errMsg=str(e).strip())
+        except InvalidOperation:
+            return None, self._result(rowNumber, row["reference"], INVALID, errMsg="amount \"{}\" is not a number".format(row["amount"]))
+        return row, None
+
+    def _prepare(self, rows, previousResults, referencePrefix):
+        """ This yields (rowNumber, row, result) entries. Rows that need submitting have result None """
+        previous = next(previousResults, None)
+        for rowNumber, row in enumerate(rows, 1):
+            # Previous results are in input order so they are walked in lockstep instead of being held in memory
+            carried = None
+            if previous and previous.get("row", None) == rowNumber:
+                carried = previous
+                previous = next(previousResults, None)
+
+            row, result = self._validate(rowNumber, row, referencePrefix)
+            if result:
+                yield rowNumber, None, result
+            elif carried and carried.get("status", None) == SUBMITTED and carried.get("reference", None) == row["reference"]:
+                yield rowNumber, None, carried
+            else:
+                yield rowNumber, row, None
+
+    def _failed(self, entries, mode, err):
+        """ This returns the results of a unit whose call raised. Errors are left to propagate out of the submit functions so that an AdaptiveLimiter sees them """
+        errMsg = err.err.get("errMsg", None) if hasattr(err, "err") else str(err)
+        return [result or self._result(rowNumber, row["reference"], FAILED, mode=mode, errMsg=errMsg) for rowNumber, row, result in entries]
+
+    def _submitSingle(self, entries):
+        results = []
+        for rowNumber, row, result in entries:
+            if result:
+                results.append(result)
+                continue
+            res = self._transfer.initiate(row)
+            results.append(self._result(rowNumber, row["reference"], SUBMITTED, mode="single", id=res["id"]))
+        return results
+
+    def _submitBulk(self, entries):
+        pending = [(rowNumber, row) for rowNumber, row, result in entries if not result]
+        outcome = {}
+        if pending:
+            bulkData = [dict((_bulkFieldMap.get(key, key), value) for key, value in row.items()) for _, row in pending]
+            res = self._transfer.bulk({"title": self._title, "bulk_data": bulkData})
+            for rowNumber, row in pending:
+                outcome[rowNumber] = self._result(rowNumber, row["reference"], SUBMITTED, mode="bulk", batchId=res["id"])
+        return [result or outcome[rowNumber] for rowNumber, row, result in entries]
+
+    def run(self, rows, previousResults=None, referencePrefix=None):
+        """ This submits payouts and yields one result dict per row, in input order.\n
+             Parameters include:\n
+            rows (iterable) -- These are transfer payloads e.g. {"account_bank": "044", "account_number": "0690000044", "amount": 500, "currency": "NGN", "reference": "pay-1"}\n
+            previousResults (iterable) -- (optional) These are the results of an earlier run. Rows recorded as submitted are not sent again\n
+            referencePrefix (string) -- (optional) This is used to build references ("prefix-rowNumber") for rows without one
+        """
+        entries = self._prepare(rows, iter(previousResults or []), referencePrefix)
+
+        mode = self._mode
+        if mode == "auto":
+            # Only the first bulkThreshold + 1 rows are looked at to decide, the rest are still streamed
+            head = list(itertools.islice(entries, self._bulkThreshold + 1))
+            mode = "bulk" if len(head) > self._bulkThreshold else "single"
+            entries = itertools.chain(head, entries)
+
+        if mode == "bulk":
+            units = _chunks(entries, self._bulkSize)
+            submit = self._submitBulk
+        else:
+            units = ([entry] for entry in entries)
+            submit = self._submitSingle
+
+        for unit, results, err in imapBounded(submit, units, self._concurrency):
+            if err is not None:
+                # As in Preauth.settle, a network error or anything else unexpected fails only the rows of this unit. Their
+                # references are kept, so a resumed run cannot pay them twice if the call did reach Rave
+                results = self._failed(unit, mode, err)
+            for result in results:
+                # Results are built on the worker threads, so they are only counted here on the consuming thread
+                self.counts[result["status"]] = self.counts.get(result["status"], 0) + 1
+                yield result
+
+    def runFile(self, path, resultsPath, resume=False, referencePrefix=None):
+        """ This streams rows from a CSV/JSON lines file and writes one JSON line per row to resultsPath.\n
+             Parameters include:\n
+            path (string) -- This is the payout file\n
+            resultsPath (string) -- This is the results file\n
+            resume (bool) -- (optional) If True and resultsPath exists, rows it records as submitted are skipped. A resultsPath.previous file left by a killed resume is merged back first (without resume it is refused)\n
+            referencePrefix (string) -- (optional) This is used to build references for rows without one. Defaults to the file name
+        """
+        referencePrefix = referencePrefix or os.path.splitext(os.path.basename(path))[0]
+        previousPath = resultsPath + ".previous"
+        if os.path.exists(previousPath):
+            if not resume:
+                raise ValueError("{} is left from an interrupted resume and records submitted rows. Resume the run to merge it, or move it away".format(previousPath))
+            # A resume was killed before it could merge, so what it recorded and what it had not reached yet are combined first
+            _mergePrevious(resultsPath, previousPath)
+        if resume and os.path.exists(resultsPath):
+            os.rename(resultsPath, previousPath)
+        else:
+            previousPath = None
+
+        try:
+            previousResults = _readResults(previousPath) if previousPath else None
+            with open(resultsPath, "w") as fh:
+                for result in self.run(readRecords(path), previousResults, referencePrefix):
+                    fh.write(json.dumps(result))
+                    fh.write("\n")
+                    fh.flush()
+        except BaseException:
+            # Keep what the earlier run recorded if this one stops before finishing
+            if previousPath:
+                _mergePrevious(resultsPath, previousPath)
+            raise
+
+        if previousPath:
+            os.remove(previousPath)
+        return self.counts
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _readResults(path):
+    with open(path, "r") as fh:
+        for line in fh:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # A run that crashed mid-write leaves a partial last line
+                return
+
+
+def _mergePrevious(resultsPath, previousPath):
+    """ This adds the earlier results not yet reached by an interrupted resume, so nothing submitted is forgotten.\n
+        The merged file is written beside resultsPath and moved over it, so a partial last line is dropped and a crash while merging loses nothing
+    """
+    mergedPath = resultsPath + ".merging"
+    lastRow = 0
+    with open(mergedPath, "w") as fh:
+        if os.path.exists(resultsPath):
+            for result in _readResults(resultsPath):
+                lastRow = result["row"]
+                fh.write(json.dumps(result))
+                fh.write("\n")
+        for result in _readResults(previousPath):
+            if result["row"] > lastRow:
+                fh.write(json.dumps(result))
+                fh.write("\n")
+    os.replace(mergedPath, resultsPath)
+    os.remove(previousPath)
+
+
+def main(argv=None):
+    from python_rave.rave import Rave
+
+    parser = argparse.ArgumentParser(description="Stream payouts from a CSV or JSON lines file through Rave transfers")
+    parser.add_argument("path", help="CSV (with a header row) or .jsonl file of transfer rows")
+    parser.add_argument("--results", help="JSON lines results file (default: <path>.results.jsonl)")
+    parser.add_argument("--concurrency", type=int, default=8, help="calls in flight, or the most allowed with --adaptive")
+    parser.add_argument("--adaptive", action="store_true", help="raise and lower concurrency with Rave's latency and error rate")
+    parser.add_argument("--mode", choices=["auto", "single", "bulk"], default="auto")
+    parser.add_argument("--bulk-size", type=int, default=100)
+    parser.add_argument("--bulk-threshold", type=int, default=100)
+    parser.add_argument("--reference-prefix", help="prefix for references generated for rows without one (default: the file name)")
+    parser.add_argument("--resume", action="store_true", help="skip rows the results file records as submitted")
+    parser.add_argument("--production", action="store_true")
+    args = parser.parse_args(argv)
+
+    # Keys are read from RAVE_PUBLIC_KEY and RAVE_SECRET_KEY
+    rave = Rave(os.getenv("RAVE_PUBLIC_KEY", None), None, production=args.production, usingEnv=True)
+    concurrency = AdaptiveLimiter(initial=min(4, args.concurrency), maximum=args.concurrency) if args.adaptive else args.concurrency
+    runner = PayoutRunner(rave.Transfer, concurrency=concurrency, mode=args.mode, bulkSize=args.bulk_size, bulkThreshold=args.bulk_threshold)
+    counts = runner.runFile(args.path, args.results or args.path + ".results.jsonl", resume=args.resume, referencePrefix=args.reference_prefix)
+    print(json.dumps(counts))
+    if args.adaptive:
+        print(json.dumps(concurrency.metrics()))
+    return 0 if not counts.get(FAILED, 0) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
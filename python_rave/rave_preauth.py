@@ -1,34 +1,53 @@
-import requests
-from python_rave.rave_exceptions import ServerError, TransactionVerificationError, PreauthCaptureError, PreauthRefundVoidError
+import requests, copy, json
+from python_rave.rave_exceptions import RaveError, ServerError, TransactionVerificationError, PreauthCaptureError, PreauthRefundVoidError
+from python_rave.rave_batch import imapBounded, BatchStats
 from python_rave.rave_card import Card
 from python_rave.rave_misc import generateTransactionReference
+from python_rave.rave_deadline import acceptsDeadline
 
 class Preauth(Card):
     """ This is the rave object for preauthorized transactions. It contains the following public functions:\n
-        .charge -- This is for making a ussd charge\n
+        .charge -- This is for making a preauth charge\n
         .validate -- This is called if further action is required i.e. OTP validation\n
         .verify -- This checks the status of your transaction\n
+        .capture, .void, .refund -- These settle a single held transaction\n
+        .settle -- This settles many held transactions concurrently\n
     """
 
-    def __init__(self, publicKey, secretKey, production, usingEnv):
-        super(Preauth, self).__init__(publicKey, secretKey, production, usingEnv)
+    def __init__(self, publicKey, secretKey, production, usingEnv, transport=None):
+        super(Preauth, self).__init__(publicKey, secretKey, production, usingEnv, transport)
 
     # Initiate preauth
-    def charge(self, cardDetails, chargeWithToken=False, hasFailed=False):
+    @acceptsDeadline
+    def charge(self, cardDetails, chargeWithToken=False, hasFailed=False, preflight=True):
         """ This is called to initiate the preauth process.\n
              Parameters include:\n
             cardDetails (dict) -- This is a dictionary comprising payload parameters.\n
-            hasFailed (bool) -- This indicates whether the request had previously failed for timeout handling
+            hasFailed (bool) -- This indicates whether the request had previously failed for timeout handling\n
+            preflight (bool) -- (optional) If True, the card details are checked locally before the request is sent
         """
 
-        # Add the charge_type
+        # Add the charge_type to a copy so the caller's dict is left untouched
+        cardDetails = copy.copy(cardDetails)
         cardDetails.update({"charge_type":"preauth"})
-        return super(Preauth, self).charge(cardDetails, chargeWithToken)
+        return super(Preauth, self).charge(cardDetails, hasFailed=hasFailed, chargeWithToken=chargeWithToken, preflight=preflight)
     
+    def _handleSettlementResponse(self, response, flwRef, TypeOfErrorToRaise):
+        """ This handles capture, void and refund responses """
+        res = self._preliminaryResponseChecks(response, TypeOfErrorToRaise, flwRef=flwRef)
+
+        responseJson = res["json"]
+        status = responseJson["data"].get("status", None)
+        if responseJson.get("status", None) != "success":
+            raise TypeOfErrorToRaise({"error": True, "txRef": res["txRef"], "flwRef": flwRef, "errMsg": responseJson.get("message", None)})
+
+        return {"error": False, "txRef": res["txRef"], "flwRef": flwRef, "status": status}
+
     # capture payment
+    @acceptsDeadline
     def capture(self, flwRef):
         """ This is called to complete the transaction.\n
-             Parameters include:
+             Parameters include:\n
             flwRef (string) -- This is the flutterwave reference you receive from action["flwRef"]
         """
         payload = {
@@ -38,11 +57,12 @@ class Preauth(Card):
         headers ={
             "Content-Type":"application/json"
         }
-        endpoint = self._baseUrl + self._endpointMap["capture"]
-        response = requests.post(endpoint, headers=headers, data=payload)
-        self._handleChargeResponse(response, flwRef)
+        endpoint = self._baseUrl + self._endpointMap["card"]["capture"]
+        response = self._transport.post(endpoint, headers=headers, data=json.dumps(payload))
+        return self._handleSettlementResponse(response, flwRef, PreauthCaptureError)
     
 
+    @acceptsDeadline
     def void(self, flwRef):
         """ This is called to void a transaction.\n 
              Parameters include:\n
@@ -50,17 +70,18 @@ class Preauth(Card):
         """
         payload = {
             "SECKEY": self._getSecretKey(),
-            "flwRef": flwRef,
+            "ref": flwRef,
             "action":"void"
         }
         headers ={
             "Content-Type":"application/json"
         }
-        endpoint = self._baseUrl + self._endpointMap["refundorvoid"]
-        response = requests.post(endpoint, headers=headers, data=payload)
-        self._handleChargeResponse(response, endpoint)
+        endpoint = self._baseUrl + self._endpointMap["card"]["refundorvoid"]
+        response = self._transport.post(endpoint, headers=headers, data=json.dumps(payload))
+        return self._handleSettlementResponse(response, flwRef, PreauthRefundVoidError)
     
     
+    @acceptsDeadline
     def refund(self, flwRef, amount=None):
         """ This is called to refund the transaction.\n
              Parameters include:\n
@@ -69,15 +90,58 @@ class Preauth(Card):
         """
         payload = {
             "SECKEY": self._getSecretKey(),
-            "flwRef": flwRef,
+            "ref": flwRef,
             "action":"refund"
         }
         if amount:
-            payload.update({"amount", amount})
+            payload.update({"amount": amount})
 
         headers ={
             "Content-Type":"application/json"
         }
-        endpoint = self._baseUrl + self._endpointMap["refundorvoid"]
-        response = requests.post(endpoint, headers=headers, data=payload)
-        self._handleChargeResponse(response, endpoint)
+        endpoint = self._baseUrl + self._endpointMap["card"]["refundorvoid"]
+        response = self._transport.post(endpoint, headers=headers, data=json.dumps(payload))
+        return self._handleSettlementResponse(response, flwRef, PreauthRefundVoidError)
+
+
+    @acceptsDeadline
+    def settle(self, items, concurrency=8, executor=None, stats=None):
+        """ This captures, voids or refunds many preauthorized transactions, yielding one result per item in order.\n
+             Parameters include:\n
+            items (iterable) -- These are (flwRef, action, amount) tuples or dicts with "flwRef", "action" and optionally "amount". action is "capture", "void" or "refund"\n
+            concurrency (int or AdaptiveLimiter) -- (optional) This is the maximum number of calls in flight\n
+            executor (Executor) -- (optional) This is a shared thread pool to run the calls on\n
+            stats (BatchStats) -- (optional) If passed, it is updated with counts per outcome and throughput\n
+            \n
+            Failures, including network errors and a deadline running out, are yielded as {"error": True, ...} results instead of being raised so one bad hold does not stop the run
+        """
+        actions = {"capture": lambda flwRef, amount: self.capture(flwRef), "void": lambda flwRef, amount: self.void(flwRef), "refund": self.refund}
+        stats = stats or BatchStats()
+        stats.start()
+
+        def normalize(item):
+            if isinstance(item, dict):
+                return item["flwRef"], item["action"], item.get("amount", None)
+            item = tuple(item)
+            return item[0], item[1], item[2] if len(item) > 2 else None
+
+        def execute(item):
+            flwRef, action, amount = item
+            if action not in actions:
+                raise ValueError("action must be one of \"capture\", \"void\" or \"refund\", not \"{}\"".format(action))
+            return actions[action](flwRef, amount)
+
+        try:
+            for (flwRef, action, amount), res, err in imapBounded(execute, (normalize(item) for item in items), concurrency, executor):
+                if err is None:
+                    result = {"error": False, "flwRef": flwRef, "action": action, "amount": amount, "txRef": res["txRef"], "status": res["status"], "errMsg": None}
+                elif isinstance(err, (RaveError, ValueError, requests.exceptions.RequestException)):
+                    # Server and network errors (and a DeadlineExceededError, which is a RaveError) fail this item only
+                    errMsg = err.err.get("errMsg", None) if hasattr(err, "err") else str(err)
+                    result = {"error": True, "flwRef": flwRef, "action": action, "amount": amount, "txRef": None, "status": None, "errMsg": errMsg}
+                else:
+                    raise err
+                stats.record(action + ("Failed" if result["error"] else "Succeeded"))
+                yield result
+        finally:
+            stats.finish()
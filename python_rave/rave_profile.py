@@ -0,0 +1,254 @@
+""" Opt-in sampling profiler for the public methods of the rave components.
+
+A Profiler wraps the public methods of the components it is attached to. While it is enabled, a fraction of the
+calls (sampleRate) run under cProfile and, optionally, tracemalloc. tracemalloc only runs during sampled calls, so
+the rest of the process is not slowed down by it. When a sampled method returns a generator (e.g. Preauth.settle,
+Transfer.resolveAccounts or Transfer.fetch with stream=True), iterating it is profiled too, step by step. Results are aggregated per method and can be
+read with report(), printed with format() or written as .prof files with dumpStats() at any time.
+
+    profiler = Profiler(sampleRate=0.05)
+    profiler.attach(rave)
+    ...
+    print(profiler.format())
+"""
+import contextlib, cProfile, functools, inspect, os, pstats, random, threading, time, tracemalloc
+
+# The components of a Rave object that are instrumented
+_components = ["Card", "Preauth", "Account", "Ussd", "GhMobile", "Mpesa", "Transfer"]
+
+
+class Profiler(object):
+    """ This samples calls into component methods. It contains the following public functions:\n
+        .attach -- This instruments a Rave object or a single component\n
+        .detach -- This removes the instrumentation\n
+        .enable -- This starts sampling\n
+        .disable -- This stops sampling. Attached methods then only count calls\n
+        .report -- This returns the aggregated stats per method\n
+        .format -- This returns the report as text\n
+        .dumpStats -- This writes one cProfile .prof file per method\n
+        .reset -- This drops everything collected so far\n
+        \n
+        Only one call is profiled at a time across all threads, since cProfile and tracemalloc are process wide. Calls that would be sampled while another is being profiled are counted but not profiled.\n
+        Allocation figures are taken from tracemalloc around the sampled call, so allocations by other threads running at the same time are included. tracemalloc is started for the sampled call and stopped after it, unless something else was already tracing\n
+        A sampled generator is measured from its creation until it is exhausted or closed. Each step is profiled, except steps taken while another call is being profiled, which are only timed
+    """
+    def __init__(self, sampleRate=0.01, allocations=True, enabled=True):
+        """ Parameters include:\n
+            sampleRate (float) -- (optional) This is the fraction of calls profiled, between 0 and 1. It can be changed at any time\n
+            allocations (bool) -- (optional) If True, sampled calls also run under tracemalloc and allocation stats are kept\n
+            enabled (bool) -- (optional) If False, nothing is sampled until .enable is called
+        """
+        self.sampleRate = sampleRate
+        self._allocations = allocations
+        self._enabled = False
+        self._lock = threading.Lock()
+        # Held by the one call being profiled
+        self._busy = threading.Lock()
+        self._methods = {}
+        self._attached = []
+        if enabled:
+            self.enable()
+
+    def enable(self):
+        self._enabled = True
+
+    def disable(self):
+        self._enabled = False
+        # Waits for a call being profiled to finish
+        with self._busy:
+            pass
+
+    @property
+    def enabled(self):
+        return self._enabled
+
+    def attach(self, target):
+        """ This instruments every public method of a Rave object's components, or of a single component e.g. rave.Card.\n
+            Methods already wrapped on the instance (e.g. by an IdempotencyGuard) are wrapped again, so the profile includes the other wrapper. Detach in the reverse order of attaching
+        """
+        components = [getattr(target, name) for name in _components if hasattr(target, name)] or [target]
+        for component in components:
+            prefix = type(component).__name__
+            for name in dir(component):
+                if name.startswith("_"):
+                    continue
+                method = getattr(component, name)
+                if not callable(method) or getattr(method, "_profiler", None) is self:
+                    continue
+                # Setting the wrapper on the instance leaves the class (and other Rave objects) untouched. Anything
+                # already set on the instance is put back by detach
+                previous = component.__dict__.get(name, None)
+                setattr(component, name, self._wrap(prefix + "." + name, method))
+                self._attached.append((component, name, previous))
+        return self
+
+    def detach(self):
+        for component, name, previous in reversed(self._attached):
+            if previous is None:
+                component.__dict__.pop(name, None)
+            else:
+                setattr(component, name, previous)
+        self._attached = []
+
+    def _stats(self, key):
+        with self._lock:
+            stats = self._methods.get(key, None)
+            if stats is None:
+                stats = self._methods[key] = {"calls": 0, "sampled": 0, "errors": 0, "seconds": 0.0, "allocatedBytes": 0, "peakBytes": 0, "profile": cProfile.Profile()}
+            return stats
+
+    def _wrap(self, key, method):
+        stats = self._stats(key)
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            with self._lock:
+                stats["calls"] += 1
+            if not (self._enabled and random.random() < self.sampleRate and self._busy.acquire(False)):
+                return method(*args, **kwargs)
+            try:
+                return self._profileCall(stats, method, args, kwargs)
+            finally:
+                self._busy.release()
+        wrapper._profiler = self
+        return wrapper
+
+    def _profileCall(self, stats, method, args, kwargs):
+        sample = {"seconds": 0.0, "allocatedBytes": 0, "peakBytes": 0}
+        failed = False
+        result = None
+        try:
+            with self._profiling(stats, sample):
+                result = method(*args, **kwargs)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            if not inspect.isgenerator(result):
+                self._record(stats, sample, failed)
+        if not inspect.isgenerator(result):
+            return result
+        # The work of a generator happens as it is iterated, so that is measured as part of the same sample
+        return self._profileIteration(stats, result, sample)
+
+    def _profileIteration(self, stats, generator, sample):
+        failed = False
+        try:
+            while True:
+                # _busy is not waited for, since the step may run inside another profiled call on this thread
+                profiled = self._busy.acquire(False)
+                startedAt = time.time()
+                try:
+                    if profiled:
+                        with self._profiling(stats, sample):
+                            item = next(generator)
+                    else:
+                        item = next(generator)
+                except StopIteration:
+                    return
+                finally:
+                    if profiled:
+                        self._busy.release()
+                    else:
+                        sample["seconds"] += time.time() - startedAt
+                yield item
+        except Exception:
+            failed = True
+            raise
+        finally:
+            generator.close()
+            self._record(stats, sample, failed)
+
+    @contextlib.contextmanager
+    def _profiling(self, stats, sample):
+        """ This runs a block under cProfile (and tracemalloc) and adds what it measured to sample. The caller holds _busy """
+        startedTracemalloc = False
+        if self._allocations:
+            if tracemalloc.is_tracing():
+                tracemalloc.reset_peak()
+            else:
+                tracemalloc.start()
+                startedTracemalloc = True
+            before = tracemalloc.get_traced_memory()[0]
+        startedAt = time.time()
+        stats["profile"].enable()
+        try:
+            yield
+        finally:
+            stats["profile"].disable()
+            sample["seconds"] += time.time() - startedAt
+            if self._allocations:
+                current, peak = tracemalloc.get_traced_memory()
+                # Only stop tracemalloc if we started it, someone else may be using it
+                if startedTracemalloc:
+                    tracemalloc.stop()
+                sample["allocatedBytes"] += current - before
+                sample["peakBytes"] = max(sample["peakBytes"], peak - before)
+
+    def _record(self, stats, sample, failed):
+        with self._lock:
+            stats["sampled"] += 1
+            stats["seconds"] += sample["seconds"]
+            stats["errors"] += failed
+            stats["allocatedBytes"] += sample["allocatedBytes"]
+            stats["peakBytes"] = max(stats["peakBytes"], sample["peakBytes"])
+
+    def report(self, top=10, sortBy="cumulative"):
+        """ This returns {"Card.charge": {"calls", "sampled", "errors", "meanSeconds", "meanAllocatedBytes", "peakBytes", "top": [...]}} for every method called so far.\n
+             Parameters include:\n
+            top (int) -- (optional) This is the number of functions listed under "top" per method\n
+            sortBy (string) -- (optional) This is the pstats sort key for "top", e.g. "cumulative" or "tottime"
+        """
+        report = {}
+        with self._busy:
+            with self._lock:
+                methods = [(key, dict(stats)) for key, stats in self._methods.items() if stats["calls"]]
+            for key, stats in methods:
+                sampled = stats["sampled"]
+                entry = {
+                    "calls": stats["calls"],
+                    "sampled": sampled,
+                    "errors": stats["errors"],
+                    "meanSeconds": stats["seconds"] / sampled if sampled else None,
+                    "meanAllocatedBytes": stats["allocatedBytes"] / sampled if sampled else None,
+                    "peakBytes": stats["peakBytes"],
+                    "top": [],
+                }
+                if sampled:
+                    profile = pstats.Stats(stats["profile"]).sort_stats(sortBy)
+                    for function in profile.fcn_list[:top]:
+                        callCount, primitiveCalls, totalTime, cumulativeTime, callers = profile.stats[function]
+                        entry["top"].append({"function": "{}:{}({})".format(os.path.basename(function[0]), function[1], function[2]), "calls": callCount, "totalTime": totalTime, "cumulativeTime": cumulativeTime})
+                report[key] = entry
+        return report
+
+    def format(self, top=10, sortBy="cumulative"):
+        """ This returns the report as text, slowest methods first """
+        report = self.report(top, sortBy)
+        lines = []
+        for key, entry in sorted(report.items(), key=lambda item: -(item[1]["meanSeconds"] or 0)):
+            lines.append("{}: {} calls, {} sampled, {} errors".format(key, entry["calls"], entry["sampled"], entry["errors"]))
+            if not entry["sampled"]:
+                continue
+            lines.append("  mean {:.6f}s, mean allocated {:.0f} bytes, peak {} bytes".format(entry["meanSeconds"], entry["meanAllocatedBytes"], entry["peakBytes"]))
+            for function in entry["top"]:
+                lines.append("  {:>8} {:>10.6f} {:>10.6f}  {}".format(function["calls"], function["totalTime"], function["cumulativeTime"], function["function"]))
+        return "\n".join(lines)
+
+    def dumpStats(self, directory):
+        """ This writes <method>.prof for every sampled method, e.g. for snakeviz or pstats. Returns the paths written """
+        paths = []
+        with self._busy:
+            with self._lock:
+                methods = [(key, stats["profile"]) for key, stats in self._methods.items() if stats["sampled"]]
+            for key, profile in methods:
+                path = os.path.join(directory, key + ".prof")
+                profile.dump_stats(path)
+                paths.append(path)
+        return paths
+
+    def reset(self):
+        with self._busy:
+            with self._lock:
+                for stats in self._methods.values():
+                    stats.update({"calls": 0, "sampled": 0, "errors": 0, "seconds": 0.0, "allocatedBytes": 0, "peakBytes": 0, "profile": cProfile.Profile()})
@@ -0,0 +1,356 @@
+""" A crash-safe job queue for charges, transfers and verifies, shared by many processes on one host.
+
+Jobs are kept in a local SQLite database in WAL mode. Producers enqueue jobs keyed by txRef/reference, workers
+lease a batch of jobs, run them through the rave components and record the result. A worker that dies leaves its
+jobs leased, and they are leased again once the lease expires. Jobs run at least once, so a job that was in flight
+when its worker died runs again with the same txRef/reference. Rave rejects a repeated transfer reference, and a
+repeated charge first verifies its txRef so that a charge that already went through is recorded instead of sent again.
+
+Card details (number, cvv, expiry and pin) are never written to the database. Charge jobs are queued without them and
+the workers look them up when the job runs, with the cardDetails function passed to runWorkers.
+
+    queue = JobQueue("jobs.sqlite")
+    queue.enqueue("Card.charge", paymentDetails)
+    queue.enqueue("Transfer.initiate", transferDetails)
+    runWorkers("jobs.sqlite", makeRave, processes=4, cardDetails=lookupCard)
+"""
+import json, multiprocessing, os, socket, sqlite3, threading, time, uuid
+from python_rave.rave_batch import imapBounded
+from python_rave.rave_exceptions import RaveError, ServerError, DeadlineExceededError
+
+# Job statuses
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+# The components jobs can run on
+_components = ["Card", "Preauth", "Account", "Ussd", "GhMobile", "Mpesa", "Transfer"]
+# Payments whose charge jobs are verified before being sent again
+_verifiable = ["Card", "Preauth", "Account", "Ussd", "GhMobile", "Mpesa"]
+# Payload fields that must not be stored in the database
+_cardFields = ["cardno", "cvv", "expirymonth", "expiryyear", "pin"]
+
+_schema = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    payload TEXT,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    availableAt REAL NOT NULL,
+    leaseId TEXT,
+    worker TEXT,
+    result TEXT,
+    error TEXT,
+    createdAt REAL NOT NULL,
+    finishedAt REAL,
+    UNIQUE (kind, key)
+);
+CREATE INDEX IF NOT EXISTS jobsReady ON jobs (status, availableAt);
+"""
+
+
+def jobKey(payload):
+    """ This returns the key of a job: the txRef or reference of a payload, or the payload itself for e.g. a txRef to verify """
+    if isinstance(payload, dict):
+        key = payload.get("txRef", None) or payload.get("reference", None)
+        if not key:
+            raise ValueError("Job payloads need a txRef or reference so that a job run twice cannot pay twice")
+        return str(key)
+    return str(payload)
+
+
+class JobQueue(object):
+    """ This is the queue. It contains the following public functions:\n
+        .enqueue -- This adds a job\n
+        .enqueueMany -- This adds many jobs in one transaction\n
+        .lease -- This hands a batch of jobs to a worker\n
+        .renew -- This restarts the lease of a job just before it runs\n
+        .complete -- This records the result of a leased job\n
+        .fail -- This records the failure of a leased job, to be retried or given up on\n
+        .counts -- This returns the number of jobs per status\n
+        .results -- This yields finished jobs\n
+        \n
+        Every process should open its own JobQueue on the same path. Within a process it can be shared by threads.\n
+        Payloads with card details are refused, so the database never holds them. The rest of a payload (e.g. the customer's email) is deleted as soon as its job finishes, with the freed pages overwritten
+    """
+    def __init__(self, path, leaseSeconds=60, maxAttempts=3, retryDelay=5, timeout=30):
+        """ Parameters include:\n
+            path (string) -- This is the database file\n
+            leaseSeconds (Number) -- (optional) This is how long a worker has to finish a job before it is given to another worker. The lease restarts when the job starts running, so it only needs to cover one call\n
+            maxAttempts (int) -- (optional) This is how many times a job is tried before it is marked failed\n
+            retryDelay (Number) -- (optional) This is how long in seconds a job that hit a server or network error waits before being retried\n
+            timeout (Number) -- (optional) This is how long in seconds to wait for another process's write to finish
+        """
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self._leaseSeconds = leaseSeconds
+        self._maxAttempts = maxAttempts
+        self._retryDelay = retryDelay
+        self._lock = threading.Lock()
+        # Transactions are managed explicitly so that leasing can take the write lock up front
+        self._connection = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        with self._lock:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            # Commits survive a process crash. Only a power loss can lose the last ones, which are then run again
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            # Deleted payloads are overwritten with zeros rather than left in free pages
+            self._connection.execute("PRAGMA secure_delete=ON")
+            self._connection.executescript(_schema)
+
+    def _transaction(self):
+        return _Transaction(self._connection, self._lock)
+
+    def enqueue(self, kind, payload, key=None):
+        """ This adds a job and returns True, or False if a job of this kind with this key was already queued.\n
+             Parameters include:\n
+            kind (string) -- This is the component method to run e.g. "Card.charge", "Card.verify" or "Transfer.initiate"\n
+            payload (dict or string) -- This is the argument passed to the method e.g. a charge payload or a txRef\n
+            key (string) -- (optional) This is the job key. Defaults to the txRef or reference of the payload\n
+            \n
+            Payloads holding card details raise a ValueError, and so do charge payloads without a txRef
+        """
+        return self.enqueueMany([(kind, payload, key)]) == 1
+
+    def enqueueMany(self, jobs):
+        """ This adds (kind, payload) or (kind, payload, key) jobs in one transaction and returns the number added """
+        now = time.time()
+        rows = []
+        for job in jobs:
+            kind, payload, key = (tuple(job) + (None,))[:3]
+            _checkKind(kind)
+            _checkPayload(kind, payload)
+            rows.append((kind, key or jobKey(payload), json.dumps(payload), PENDING, now, now))
+        with self._transaction() as connection:
+            before = connection.total_changes
+            connection.executemany("INSERT OR IGNORE INTO jobs (kind, key, payload, status, availableAt, createdAt) VALUES (?, ?, ?, ?, ?, ?)", rows)
+            return connection.total_changes - before
+
+    def lease(self, worker, limit=10):
+        """ This leases up to limit jobs that are pending, due for a retry, or whose lease expired. Returns a list of job dicts """
+        now = time.time()
+        leaseId = uuid.uuid4().hex
+        with self._transaction() as connection:
+            rows = connection.execute("SELECT id, attempts FROM jobs WHERE status IN (?, ?) AND availableAt <= ? LIMIT ?", (LEASED, PENDING, now, limit)).fetchall()
+            # A job whose lease keeps expiring is killing its workers, so it is given up on rather than leased forever
+            exhausted = [jobId for jobId, attempts in rows if attempts >= self._maxAttempts]
+            ready = [jobId for jobId, attempts in rows if attempts < self._maxAttempts]
+            if exhausted:
+                connection.executemany("UPDATE jobs SET status = ?, payload = NULL, error = ?, finishedAt = ? WHERE id = ?", [(FAILED, json.dumps({"error": True, "errMsg": "Gave up after {} attempts".format(self._maxAttempts)}), now, jobId) for jobId in exhausted])
+            if not ready:
+                return []
+            marks = ",".join("?" * len(ready))
+            connection.execute("UPDATE jobs SET status = ?, availableAt = ?, leaseId = ?, worker = ?, attempts = attempts + 1 WHERE id IN ({})".format(marks), [LEASED, now + self._leaseSeconds, leaseId, worker] + ready)
+            rows = connection.execute("SELECT id, kind, key, payload, attempts FROM jobs WHERE id IN ({}) ORDER BY id".format(marks), ready).fetchall()
+        return [{"id": jobId, "kind": kind, "key": key, "payload": json.loads(payload), "attempts": attempts, "leaseId": leaseId} for jobId, kind, key, payload, attempts in rows]
+
+    def renew(self, job):
+        """ This gives a leased job a full lease from now. Returns False if the job was leased again by another worker, in which case it must not be run """
+        with self._transaction() as connection:
+            return connection.execute("UPDATE jobs SET availableAt = ? WHERE id = ? AND leaseId = ? AND status = ?", (time.time() + self._leaseSeconds, job["id"], job["leaseId"], LEASED)).rowcount == 1
+
+    def complete(self, job, result):
+        """ This records the result of a job. Returns False if the lease had expired and the job was given to another worker """
+        return self._finish(job, "UPDATE jobs SET status = ?, payload = NULL, result = ?, finishedAt = ? WHERE id = ? AND leaseId = ? AND status = ?", (DONE, json.dumps(result, default=str), time.time(), job["id"], job["leaseId"], LEASED))
+
+    def fail(self, job, err, retry=False):
+        """ This records a failure. With retry, the job is tried again after retryDelay unless it has used up its attempts. Returns False if the lease had expired """
+        now = time.time()
+        if retry and job["attempts"] < self._maxAttempts:
+            return self._finish(job, "UPDATE jobs SET status = ?, availableAt = ?, error = ? WHERE id = ? AND leaseId = ? AND status = ?", (PENDING, now + self._retryDelay * job["attempts"], json.dumps(err), job["id"], job["leaseId"], LEASED))
+        return self._finish(job, "UPDATE jobs SET status = ?, payload = NULL, error = ?, finishedAt = ? WHERE id = ? AND leaseId = ? AND status = ?", (FAILED, json.dumps(err), now, job["id"], job["leaseId"], LEASED))
+
+    def _finish(self, job, statement, parameters):
+        with self._transaction() as connection:
+            return connection.execute(statement, parameters).rowcount == 1
+
+    def counts(self):
+        with self._lock:
+            return dict(self._connection.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+    def results(self, status=None):
+        """ This yields {"kind", "key", "status", "attempts", "result", "error"} for every finished job, or only those with status """
+        statuses = [status] if status else [DONE, FAILED]
+        with self._lock:
+            rows = self._connection.execute("SELECT kind, key, status, attempts, result, error FROM jobs WHERE status IN ({}) ORDER BY id".format(",".join("?" * len(statuses))), statuses).fetchall()
+        for kind, key, status, attempts, result, error in rows:
+            yield {"kind": kind, "key": key, "status": status, "attempts": attempts, "result": json.loads(result) if result else None, "error": json.loads(error) if error else None}
+
+    def close(self):
+        with self._lock:
+            try:
+                # Old versions of the pages (and the payloads on them) are kept in the WAL until it is checkpointed
+                self._connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            except sqlite3.Error:
+                pass
+            self._connection.close()
+
+
+class _Transaction(object):
+    """ This holds the write lock of the database (and the connection lock of this process) for a with block """
+    def __init__(self, connection, lock):
+        self._connection = connection
+        self._lock = lock
+
+    def __enter__(self):
+        self._lock.acquire()
+        try:
+            self._connection.execute("BEGIN IMMEDIATE")
+        except Exception:
+            self._lock.release()
+            raise
+        return self._connection
+
+    def __exit__(self, excType, exc, traceback):
+        try:
+            self._connection.execute("ROLLBACK" if excType else "COMMIT")
+        finally:
+            self._lock.release()
+
+
+def _checkKind(kind):
+    component, _, method = (kind or "").partition(".")
+    if component not in _components or not method or method.startswith("_"):
+        raise ValueError("Job kind must be a component method such as \"Card.charge\" or \"Transfer.initiate\", got {}".format(kind))
+
+
+def _isCharge(kind):
+    component, _, method = kind.partition(".")
+    return method == "charge" and component in _verifiable
+
+
+def _checkPayload(kind, payload):
+    if isinstance(payload, dict) and any(field in payload for field in _cardFields):
+        raise ValueError("Card details are not stored in the queue. Enqueue the charge without {} and pass cardDetails to the workers to look them up when it runs".format(", ".join(_cardFields)))
+    # A charge tried twice is verified by its txRef first, so it must have one whatever its job key is
+    if _isCharge(kind) and not (isinstance(payload, dict) and payload.get("txRef", None)):
+        raise ValueError("Charge jobs need a txRef so that a charge run twice can be verified instead of sent again")
+
+
+class _LeaseLost(Exception):
+    """ This is raised instead of running a job that another worker has leased since """
+
+
+def _errorOf(err):
+    if hasattr(err, "err") and isinstance(err.err, dict):
+        return dict((key, value if isinstance(value, (str, int, float, bool, type(None))) else str(value)) for key, value in err.err.items())
+    return {"error": True, "errMsg": "{}: {}".format(type(err).__name__, err)}
+
+
+class QueueWorker(object):
+    """ This runs jobs from a JobQueue through a Rave object. It contains the following public functions:\n
+        .run -- This leases and runs jobs until the queue is empty or stop is set\n
+        \n
+        Running totals are kept in .counts
+    """
+    def __init__(self, queue, rave, name=None, batchSize=10, concurrency=1, cardDetails=None):
+        """ Parameters include:\n
+            queue (JobQueue) -- This is the queue to work on\n
+            rave (Rave) -- This is used to run the jobs\n
+            cardDetails (callable) -- (optional) This is called with the payload of a charge job and returns its card details e.g. {"cardno", "cvv", "expirymonth", "expiryyear"}, from wherever you keep them. They are only held in memory\n
+            name (string) -- (optional) This is recorded against leased jobs. Defaults to host:pid\n
+            batchSize (int) -- (optional) This is the number of jobs leased at a time\n
+            concurrency (int or AdaptiveLimiter) -- (optional) This is the number of jobs run at once within this worker
+        """
+        self._queue = queue
+        self._rave = rave
+        self._name = name or "{}:{}".format(socket.gethostname(), os.getpid())
+        self._batchSize = batchSize
+        self._concurrency = concurrency
+        self._cardDetails = cardDetails
+        self.counts = {}
+
+    def _execute(self, job):
+        # Jobs wait here while earlier ones in the batch run, so their lease may have run out and been taken by
+        # another worker. Renewing checks that it is still ours and gives the call a full lease
+        if not self._queue.renew(job):
+            raise _LeaseLost()
+        componentName, _, methodName = job["kind"].partition(".")
+        component = getattr(self._rave, componentName)
+        payload = job["payload"]
+        if _isCharge(job["kind"]):
+            # A charge tried before may already have gone through, in which case it must not be sent again. The key
+            # may be a reference or one of your own, so the txRef of the payload is what is verified
+            if job["attempts"] > 1:
+                try:
+                    return dict(component.verify(payload["txRef"]), recovered=True)
+                except RaveError:
+                    pass
+            if self._cardDetails:
+                payload = dict(payload, **self._cardDetails(payload))
+        return getattr(component, methodName)(payload)
+
+    def _record(self, job, result, err):
+        if isinstance(err, _LeaseLost):
+            # The job belongs to another worker now, so nothing is written for it here
+            status = "expired"
+        elif err is None:
+            status = DONE if self._queue.complete(job, result) else "expired"
+        elif isinstance(err, (ServerError, DeadlineExceededError)) or not isinstance(err, RaveError):
+            # Server and network errors are worth retrying, declined cards and invalid payloads are not
+            status = "retried" if self._queue.fail(job, _errorOf(err), retry=True) else "expired"
+        else:
+            status = FAILED if self._queue.fail(job, _errorOf(err)) else "expired"
+        self.counts[status] = self.counts.get(status, 0) + 1
+
+    def run(self, stopWhenEmpty=True, stop=None, pollInterval=0.5):
+        """ This runs jobs and returns .counts.\n
+             Parameters include:\n
+            stopWhenEmpty (bool) -- (optional) If True, it returns once there are no jobs left to lease. Jobs waiting for a retry or leased by another worker are waited for\n
+            stop (threading.Event or multiprocessing.Event) -- (optional) If set, it returns after the current batch\n
+            pollInterval (Number) -- (optional) This is how long in seconds to wait when there is nothing to lease
+        """
+        while not (stop and stop.is_set()):
+            jobs = self._queue.lease(self._name, self._batchSize)
+            if not jobs:
+                if stopWhenEmpty and not _outstanding(self._queue.counts()):
+                    break
+                time.sleep(pollInterval)
+                continue
+            for job, result, err in imapBounded(self._execute, jobs, self._concurrency):
+                self._record(job, result, err)
+        return self.counts
+
+
+def _outstanding(counts):
+    return counts.get(PENDING, 0) + counts.get(LEASED, 0)
+
+
+def _workerMain(path, raveFactory, queueOptions, workerOptions):
+    # Each process opens its own database connection and Rave object, since neither can cross a fork
+    queue = JobQueue(path, **queueOptions)
+    try:
+        return QueueWorker(queue, raveFactory(), **workerOptions).run()
+    finally:
+        queue.close()
+
+
+def runWorkers(path, raveFactory, processes=4, batchSize=10, concurrency=1, cardDetails=None, **queueOptions):
+    """ This runs worker processes on a queue until it is empty and returns their combined counts.\n
+         Parameters include:\n
+        path (string) -- This is the database file\n
+        raveFactory (callable) -- This returns the Rave object used by a worker. It is called in each worker process so it must be a top level function (or functools.partial of one)\n
+        processes (int) -- (optional) This is the number of worker processes\n
+        batchSize (int) -- (optional) This is the number of jobs each worker leases at a time\n
+        concurrency (int) -- (optional) This is the number of jobs each worker runs at once\n
+        cardDetails (callable) -- (optional) This returns the card details of a charge payload, as for QueueWorker. Like raveFactory it must be a top level function\n
+        Any other JobQueue parameters (leaseSeconds, maxAttempts, retryDelay, timeout) are passed through
+    """
+    # Creates the database once so that the workers do not race to create it
+    JobQueue(path, **queueOptions).close()
+    workerOptions = {"batchSize": batchSize, "concurrency": concurrency, "cardDetails": cardDetails}
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = [pool.apply_async(_workerMain, (path, raveFactory, queueOptions, workerOptions)) for _ in range(processes)]
+        counts = {}
+        for result in results:
+            for status, count in result.get().items():
+                counts[status] = counts.get(status, 0) + count
+        return counts
+    finally:
+        pool.close()
+        pool.join()
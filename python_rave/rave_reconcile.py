@@ -0,0 +1,223 @@
+""" Offline reconciliation of your own ledger against Rave transfers and verify calls """
+import json, os, heapq, tempfile, itertools
+from decimal import Decimal, InvalidOperation
+from python_rave.rave_batch import imapBounded
+from python_rave.rave_misc import readRecords
+from python_rave.rave_exceptions import RaveError, TransactionVerificationError
+
+# Record statuses emitted by the reconciler
+MATCHED = "matched"
+MISSING_FROM_RAVE = "missingFromRave"
+MISSING_FROM_LEDGER = "missingFromLedger"
+AMOUNT_MISMATCH = "amountMismatch"
+DUPLICATE_IN_LEDGER = "duplicateInLedger"
+# Rave knows the charge but it failed (e.g. it was declined), so it never settled whatever its amount
+FAILED_IN_RAVE = "failedInRave"
+# The verify call failed (e.g. a ServerError or a timeout), so nothing is known about the charge
+ERROR = "error"
+
+
+# Ledgers are read with the generic record reader
+readLedger = readRecords
+
+
+def _toAmount(value):
+    """ This normalizes amounts so that "500", 500 and 500.0 compare equal """
+    if value is None or value == "":
+        return None
+    try:
+        return Decimal(str(value))
+    except InvalidOperation:
+        return None
+
+
+class Reconciler(object):
+    """ This reconciles your ledger with Rave. It contains the following public functions:\n
+        .iterTransfers -- This streams transfer records from paginated Transfer.fetch calls\n
+        .reconcileTransfers -- This diffs a ledger against Rave transfers\n
+        .reconcileCharges -- This diffs a ledger of charges against batched verify calls\n
+        \n
+        Records are yielded as they are found and the running totals are kept in .counts
+    """
+    def __init__(self, transfer=None, ledgerKey="reference", ledgerAmount="amount", raveKey="reference", raveAmount="amount", tolerance=0):
+        """ Parameters include:\n
+            transfer (Transfer) -- (optional) This is the rave.Transfer object used to fetch transfers\n
+            ledgerKey (string) -- (optional) This is the ledger column holding the reference/txRef\n
+            ledgerAmount (string) -- (optional) This is the ledger column holding the amount\n
+            raveKey (string) -- (optional) This is the transfer field holding the reference\n
+            raveAmount (string) -- (optional) This is the transfer field holding the amount\n
+            tolerance (Number) -- (optional) This is the largest absolute difference still treated as a match
+        """
+        self._transfer = transfer
+        self._ledgerKey = ledgerKey
+        self._ledgerAmount = ledgerAmount
+        self._raveKey = raveKey
+        self._raveAmount = raveAmount
+        self._tolerance = _toAmount(tolerance)
+        self.counts = {}
+
+    def _record(self, status, reference, ledgerAmount=None, raveAmount=None, raveStatus=None, errMsg=None):
+        self.counts[status] = self.counts.get(status, 0) + 1
+        record = {"status": status, "reference": reference, "ledgerAmount": ledgerAmount, "raveAmount": raveAmount, "raveStatus": raveStatus}
+        if errMsg is not None:
+            record["errMsg"] = errMsg
+        return record
+
+    def _compare(self, reference, ledgerAmount, raveAmount, raveStatus=None):
+        if ledgerAmount is None or raveAmount is None or abs(ledgerAmount - raveAmount) > self._tolerance:
+            return self._record(AMOUNT_MISMATCH, reference, ledgerAmount, raveAmount, raveStatus)
+        return self._record(MATCHED, reference, ledgerAmount, raveAmount, raveStatus)
+
+    def iterTransfers(self, status=None, batchId=None, startPage=1):
+        """ This yields transfer records page by page, decoding each record as its page downloads.\n
+             Parameters include:\n
+            status (string) -- (optional) This filters transfers by status\n
+            batchId (string) -- (optional) This filters transfers by bulk batch id\n
+            startPage (int) -- (optional) This is the first page to fetch
+        """
+        if not self._transfer:
+            raise ValueError("Please pass a Transfer object to the Reconciler to fetch transfers")
+
+        page = startPage
+        while True:
+            # Pages are streamed so that records are compared while the page is still downloading
+            envelope = {}
+            for transfer in self._transfer.fetch(page=page, status=status, batch_id=batchId, stream=True, envelope=envelope):
+                yield transfer
+
+            pageInfo = (envelope.get("data", None) or {}).get("page_info", None) or {}
+            if page >= int(pageInfo.get("total_pages", page) or page):
+                break
+            page += 1
+
+    def reconcileTransfers(self, ledger, transfers=None, spillToDisk=False, chunkSize=100000, tempDir=None, **fetchArgs):
+        """ This diffs ledger rows against Rave transfers and yields a record for every reference.\n
+             Parameters include:\n
+            ledger (iterable) -- These are your ledger rows as dicts. You can use readLedger to stream a file\n
+            transfers (iterable) -- (optional) These are the Rave transfer records. Defaults to .iterTransfers(**fetchArgs)\n
+            spillToDisk (bool) -- (optional) If True, both sides are sorted on disk and merged so memory does not grow with the ledger\n
+            chunkSize (int) -- (optional) This is the number of rows sorted in memory per run file when spilling\n
+            tempDir (string) -- (optional) This is the directory run files are written to when spilling
+        """
+        if transfers is None:
+            transfers = self.iterTransfers(**fetchArgs)
+
+        ledgerPairs = ((str(row[self._ledgerKey]), _toAmount(row.get(self._ledgerAmount, None)), None) for row in ledger)
+        ravePairs = ((str(t[self._raveKey]), _toAmount(t.get(self._raveAmount, None)), t.get("status", None)) for t in transfers if t.get(self._raveKey, None) is not None)
+
+        if spillToDisk:
+            return self._mergeJoin(ledgerPairs, ravePairs, chunkSize, tempDir)
+        return self._hashJoin(ledgerPairs, ravePairs)
+
+    def _hashJoin(self, ledgerPairs, ravePairs):
+        # The ledger side is indexed compactly (reference -> amount) and entries are dropped as soon as they match
+        index = {}
+        for reference, amount, _ in ledgerPairs:
+            if reference in index:
+                yield self._record(DUPLICATE_IN_LEDGER, reference, ledgerAmount=amount)
+                continue
+            index[reference] = amount
+
+        for reference, amount, raveStatus in ravePairs:
+            if reference in index:
+                yield self._compare(reference, index.pop(reference), amount, raveStatus)
+            else:
+                yield self._record(MISSING_FROM_LEDGER, reference, raveAmount=amount, raveStatus=raveStatus)
+
+        for reference, amount in index.items():
+            yield self._record(MISSING_FROM_RAVE, reference, ledgerAmount=amount)
+
+    def _mergeJoin(self, ledgerPairs, ravePairs, chunkSize, tempDir):
+        runFiles = []
+        try:
+            ledgerSorted = _externalSort(ledgerPairs, chunkSize, tempDir, runFiles)
+            raveSorted = _externalSort(ravePairs, chunkSize, tempDir, runFiles)
+
+            sentinel = (None, None, None)
+            ledgerItem = next(ledgerSorted, sentinel)
+            raveItem = next(raveSorted, sentinel)
+            previousLedgerKey = None
+
+            while ledgerItem is not sentinel or raveItem is not sentinel:
+                if raveItem is sentinel or (ledgerItem is not sentinel and ledgerItem[0] < raveItem[0]):
+                    if ledgerItem[0] == previousLedgerKey:
+                        yield self._record(DUPLICATE_IN_LEDGER, ledgerItem[0], ledgerAmount=ledgerItem[1])
+                    else:
+                        yield self._record(MISSING_FROM_RAVE, ledgerItem[0], ledgerAmount=ledgerItem[1])
+                    previousLedgerKey = ledgerItem[0]
+                    ledgerItem = next(ledgerSorted, sentinel)
+                elif ledgerItem is sentinel or raveItem[0] < ledgerItem[0]:
+                    yield self._record(MISSING_FROM_LEDGER, raveItem[0], raveAmount=raveItem[1], raveStatus=raveItem[2])
+                    raveItem = next(raveSorted, sentinel)
+                else:
+                    yield self._compare(ledgerItem[0], ledgerItem[1], raveItem[1], raveItem[2])
+                    previousLedgerKey = ledgerItem[0]
+                    ledgerItem = next(ledgerSorted, sentinel)
+                    raveItem = next(raveSorted, sentinel)
+        finally:
+            for path in runFiles:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def reconcileCharges(self, ledger, payment, concurrency=8, ledgerKey="txRef"):
+        """ This verifies every charge in the ledger and yields a record per txRef as results arrive. A verify call that fails for any reason other than an unknown txRef yields an "error" record with its errMsg.\n
+            A charge Rave reports as failed yields a "failedInRave" record, never a match\n
+             Parameters include:\n
+            ledger (iterable) -- These are your ledger rows as dicts\n
+            payment (Payment) -- This is the component used to verify e.g. rave.Card\n
+            concurrency (int or AdaptiveLimiter) -- (optional) This is the number of verify calls in flight\n
+            ledgerKey (string) -- (optional) This is the ledger column holding the txRef
+        """
+        rows = ((str(row[ledgerKey]), _toAmount(row.get(self._ledgerAmount, None))) for row in ledger)
+
+        for (txRef, ledgerAmount), res, err in imapBounded(lambda pair: payment.verify(pair[0]), rows, concurrency):
+            if err is not None:
+                if not isinstance(err, RaveError):
+                    raise err
+                # Rave reports unknown txRefs as verification errors. Anything else (a ServerError, an expired deadline)
+                # says nothing about the charge, so it is reported as an error to retry rather than as missing
+                if isinstance(err, TransactionVerificationError):
+                    yield self._record(MISSING_FROM_RAVE, txRef, ledgerAmount=ledgerAmount)
+                else:
+                    errMsg = err.err.get("errMsg", None) if isinstance(getattr(err, "err", None), dict) else str(err)
+                    yield self._record(ERROR, txRef, ledgerAmount=ledgerAmount, errMsg=errMsg)
+                continue
+
+            raveAmount = _toAmount(res.get("amount", None))
+            if res["transactionComplete"]:
+                yield self._compare(txRef, ledgerAmount, raveAmount, "successful")
+                continue
+            # An incomplete charge is either still in progress or failed for good. Without a status it is assumed to be in progress
+            raveStatus = str(res.get("status", None) or "pending").lower()
+            if "pending" in raveStatus:
+                yield self._compare(txRef, ledgerAmount, raveAmount, raveStatus)
+            else:
+                yield self._record(FAILED_IN_RAVE, txRef, ledgerAmount, raveAmount, raveStatus)
+
+
+def _externalSort(pairs, chunkSize, tempDir, runFiles):
+    """ This sorts (reference, amount, status) tuples using sorted run files and a k-way merge """
+    runs = []
+    while True:
+        chunk = list(itertools.islice(pairs, chunkSize))
+        if not chunk:
+            break
+        chunk.sort(key=lambda pair: pair[0])
+        fd, path = tempfile.mkstemp(prefix="rave-reconcile-", suffix=".jsonl", dir=tempDir)
+        runFiles.append(path)
+        with os.fdopen(fd, "w") as fh:
+            for reference, amount, status in chunk:
+                fh.write(json.dumps([reference, None if amount is None else str(amount), status]))
+                fh.write("\n")
+        runs.append(path)
+
+    return heapq.merge(*[_readRun(path) for path in runs], key=lambda pair: pair[0])
+
+
+def _readRun(path):
+    with open(path, "r") as fh:
+        for line in fh:
+            reference, amount, status = json.loads(line)
+            yield reference, _toAmount(amount), status
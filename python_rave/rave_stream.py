@@ -0,0 +1,143 @@
+""" Incremental JSON parsing so that large responses can be processed record by record """
+import codecs, json, re
+
+_decoder = json.JSONDecoder()
+# The rest of a json string after its opening quote
+_stringRest = re.compile(r'(?:[^"\\]|\\.)*"', re.DOTALL)
+# The end of a number/true/false/null
+_scalarEnd = re.compile(r'[\s,\]}]')
+_whitespace = " \t\r\n"
+
+
+class JsonArrayStream(object):
+    """ This decodes the elements of one array in a json document while the document is still arriving.\n
+        Iterating yields each element of the array found at path as soon as it has been fully received. Only the current element is ever held in memory.\n
+        Once iteration finishes, .envelope holds the rest of the document with the streamed array left empty, e.g. {"status": "success", "data": {"page_info": {...}, "transfers": []}}
+    """
+    def __init__(self, chunks, path):
+        """ Parameters include:\n
+            chunks (iterable) -- These are the raw bytes (or text) of the document, e.g. response.iter_content(65536)\n
+            path (list) -- These are the object keys leading to the array e.g. ["data", "transfers"]
+        """
+        self._chunks = iter(chunks)
+        self._path = list(path)
+        self._decoder = codecs.getincrementaldecoder("utf-8")("replace")
+        self.envelope = None
+
+    def _read(self):
+        """ This returns the next decoded piece of text, or None at the end of the document """
+        for chunk in self._chunks:
+            if isinstance(chunk, bytes):
+                chunk = self._decoder.decode(chunk)
+            if chunk:
+                return chunk
+        return None
+
+    def __iter__(self):
+        buf = ""
+        pos = 0
+        envelope = []
+        # Each frame is [container, current key]. Keys are only tracked for objects
+        stack = []
+        expectKey = False
+        inTarget = False
+        finished = False
+
+        while True:
+            # Drop what has been consumed so the buffer never grows with the document
+            if pos > 65536:
+                buf = buf[pos:]
+                pos = 0
+
+            while pos < len(buf) and buf[pos] in _whitespace:
+                pos += 1
+            if pos >= len(buf):
+                if finished:
+                    break
+                chunk = self._read()
+                if chunk is None:
+                    finished = True
+                else:
+                    buf += chunk
+                continue
+
+            char = buf[pos]
+
+            if inTarget and char not in ",]":
+                # Elements are decoded straight from the buffer. One cut off by the end of the buffer is decoded again once more data arrives
+                try:
+                    element, end = _decoder.raw_decode(buf, pos)
+                except ValueError:
+                    if finished:
+                        raise
+                    end = None
+                # A number cut off by the end of the buffer (e.g. "1.5e" of "1.5e3") can decode early, so scalars must be followed by a delimiter
+                if end is None or (not finished and (end == len(buf) or (char not in "{[\"" and buf[end] not in " \t\r\n,]"))):
+                    chunk = self._read()
+                    if chunk is None:
+                        finished = True
+                    else:
+                        buf += chunk
+                    continue
+                pos = end
+                yield element
+                continue
+
+            if char == '"':
+                end = _stringRest.match(buf, pos + 1)
+                if not end:
+                    chunk = self._read()
+                    if chunk is None:
+                        raise ValueError("Unexpected end of json document")
+                    buf += chunk
+                    continue
+                text = buf[pos:end.end()]
+                if stack and stack[-1][0] == "{" and expectKey:
+                    stack[-1][1] = json.loads(text)
+                envelope.append(text)
+                pos = end.end()
+            elif char == "{":
+                stack.append(["{", None])
+                expectKey = True
+                envelope.append(char)
+                pos += 1
+            elif char == "[":
+                path = [frame[1] for frame in stack]
+                if not inTarget and path == self._path and all(frame[0] == "{" for frame in stack):
+                    inTarget = True
+                stack.append(["[", None])
+                envelope.append(char)
+                pos += 1
+            elif char in "}]":
+                if char == "]" and inTarget and len(stack) == len(self._path) + 1:
+                    inTarget = False
+                stack.pop()
+                envelope.append(char)
+                pos += 1
+            elif char == ",":
+                # Commas between streamed elements are dropped along with the elements
+                if not inTarget:
+                    envelope.append(char)
+                expectKey = bool(stack) and stack[-1][0] == "{"
+                pos += 1
+            elif char == ":":
+                expectKey = False
+                envelope.append(char)
+                pos += 1
+            else:
+                start = pos
+                pos, buf = self._scanScalar(buf, pos)
+                envelope.append(buf[start:pos])
+
+        self.envelope = json.loads("".join(envelope)) if envelope else None
+
+    def _scanScalar(self, buf, pos):
+        """ This returns the end of the number or literal at pos, reading more data if it runs to the end of the buffer """
+        while True:
+            match = _scalarEnd.search(buf, pos)
+            if match:
+                return match.start(), buf
+            chunk = self._read()
+            if chunk is None:
+                return len(buf), buf
+            buf += chunk
@@ -1,10 +1,15 @@
-import requests, json, copy
+import requests, json, copy, threading
+from collections import OrderedDict
+from concurrent.futures import Future
 from python_rave.rave_base import RaveBase
 from python_rave.rave_misc import checkIfParametersAreComplete, generateTransactionReference
-from python_rave.rave_exceptions import InitiateTransferError, ServerError, TransferFetchError
+from python_rave.rave_exceptions import RaveError, InitiateTransferError, ServerError, TransferFetchError, AccountResolveError
+from python_rave.rave_batch import imapBounded
+from python_rave.rave_stream import JsonArrayStream
+from python_rave.rave_deadline import acceptsDeadline
 class Transfer(RaveBase):
-    def __init__(self, publicKey, secretKey, production, usingEnv):
-        super(Transfer, self).__init__(publicKey, secretKey, production, usingEnv)
+    def __init__(self, publicKey, secretKey, production, usingEnv, transport=None):
+        super(Transfer, self).__init__(publicKey, secretKey, production, usingEnv, transport)
     
     
     def _preliminaryResponseChecks(self, response, TypeOfErrorToRaise, reference):
@@ -12,7 +17,7 @@ class Transfer(RaveBase):
         try:
             responseJson = response.json()
         except:
-            raise ServerError({"error": True, "reference": txRef, "errMsg": response})
+            raise ServerError({"error": True, "reference": reference, "errMsg": response.text})
 
         # Check if the response contains data parameter
         if not responseJson.get("data", None):
@@ -21,7 +26,7 @@ class Transfer(RaveBase):
         # Check if it is returning a 200
         if not response.ok:
             errMsg = responseJson["data"].get("message", None)
-            raise TypeOfErrorToRaise({"error": True, "txRef": txRef, "flwRef": flwRef, "errMsg": errMsg})
+            raise TypeOfErrorToRaise({"error": True, "reference": reference, "errMsg": errMsg})
 
         return responseJson
 
@@ -33,7 +38,7 @@ class Transfer(RaveBase):
             return {"error": False, "id": responseJson["data"].get("id", None), "data": responseJson["data"]}
         
         else:
-            raise InitiateTransferError({"error": True, data: responseJson["data"]})
+            raise InitiateTransferError({"error": True, "reference": transferDetails["reference"], "errMsg": responseJson.get("message", None), "data": responseJson["data"]})
 
     def _handleBulkResponse(self, response, bulkDetails):
         responseJson = self._preliminaryResponseChecks(response, InitiateTransferError, None)
@@ -41,9 +46,10 @@ class Transfer(RaveBase):
         if responseJson["status"] == "success":
             return {"error": False, "id": responseJson["data"].get("id", None), "data": responseJson["data"]}
         else:
-            raise InitiateTransferError({"error": True, data: responseJson["data"]})
+            raise InitiateTransferError({"error": True, "errMsg": responseJson.get("message", None), "data": responseJson["data"]})
 
             
+    @acceptsDeadline
     def initiate(self, transferDetails):
         # Performing shallow copy of transferDetails to avoid public exposing payload with secret key
         transferDetails = copy.copy(transferDetails)
@@ -63,11 +69,12 @@ class Transfer(RaveBase):
         }
         
         endpoint = self._baseUrl + self._endpointMap["transfer"]["initiate"]
-        response = requests.post(endpoint, headers=headers, data=json.dumps(transferDetails))
+        response = self._transport.post(endpoint, headers=headers, data=json.dumps(transferDetails))
         return self._handleInitiateResponse(response, transferDetails)
 
 
 
+    @acceptsDeadline
     def bulk(self, bulkDetails):
         
         bulkDetails = copy.copy(bulkDetails)
@@ -87,12 +94,12 @@ class Transfer(RaveBase):
         headers = {
             'content-type': 'application/json',
         }
-        response = requests.post(endpoint, headers=headers, data=json.dumps(bulkDetails))
+        response = self._transport.post(endpoint, headers=headers, data=json.dumps(bulkDetails))
         return self._handleBulkResponse(response, bulkDetails)
 
     
     # This makes and handles all requests pertaining to the status of your transfer or account
-    def _handleTransferStatusRequests(self, endpoint, isPostRequest=False, data=None):
+    def _handleTransferStatusRequests(self, endpoint, isPostRequest=False, data=None, streamPath=None, envelope=None):
         # Request headers
         headers = {
             'content-type': 'application/json',
@@ -100,9 +107,13 @@ class Transfer(RaveBase):
 
         # Checks if it is a post request
         if isPostRequest:
-            response = requests.post(endpoint, headers=headers, data=json.dumps(data))
+            response = self._transport.post(endpoint, headers=headers, data=json.dumps(data), stream=bool(streamPath))
         else:
-            response = requests.get(endpoint, headers=headers)
+            response = self._transport.get(endpoint, headers=headers, stream=bool(streamPath))
+
+        # Successful responses can be decoded record by record instead of all at once
+        if streamPath and response.ok:
+            return self._streamResponse(response, streamPath, envelope)
 
         # Checks if it can be parsed to json
         try:
@@ -116,15 +127,39 @@ class Transfer(RaveBase):
         else:
             raise TransferFetchError({"error": True, "returnedData": responseJson })
 
+    def _streamResponse(self, response, streamPath, envelope):
+        """ This yields the records at streamPath while the body downloads. Once they have all been read, envelope is updated with the rest of the response """
+        stream = JsonArrayStream(response.iter_content(65536), streamPath)
+        try:
+            for record in stream:
+                yield record
+        except ValueError:
+            raise ServerError({"error": True, "errMsg": "The streamed response could not be decoded"})
+        finally:
+            response.close()
+        if envelope is not None:
+            envelope.update(stream.envelope or {})
+
     # Not elegant but supports python 2 and 3
-    def fetch(self, id=None, q=None, reference=None, page=None, status=None, batch_id=None):
+    @acceptsDeadline
+    def fetch(self, id=None, q=None, reference=None, page=None, status=None, batch_id=None, stream=False, envelope=None):
+        """ This fetches transfers.\n
+             Parameters include:\n
+            id, q, reference, page, status, batch_id -- (optional) These filter the transfers returned\n
+            stream (bool) -- (optional) If True, a generator of transfer records is returned instead. Records are decoded while the response downloads, so a large page is never held in memory at once\n
+            envelope (dict) -- (optional) When streaming, this is filled with the rest of the response (e.g. data.page_info) once every record has been read
+        """
         endpoint = self._baseUrl + self._endpointMap["transfer"]["fetch"] + "?seckey="+self._getSecretKey()+"&id="+str(id)+"&q="+str(q)+"&reference="+str(reference)+"&page="+str(page)+"&status="+str(status)+"&batch_id="+str(batch_id)
+        if stream:
+            return self._handleTransferStatusRequests(endpoint, streamPath=["data", "transfers"], envelope=envelope)
         return self._handleTransferStatusRequests(endpoint)
 
+    @acceptsDeadline
     def getFee(self, currency=None):
         endpoint = self._baseUrl + self._endpointMap["transfer"]["fee"] + "?seckey="+self._getSecretKey() + "&currency="+str(currency)
         return self._handleTransferStatusRequests(endpoint)
         
+    @acceptsDeadline
     def getBalance(self, currency=None):
         endpoint = self._baseUrl + self._endpointMap["transfer"]["balance"] 
         data = {
@@ -133,5 +168,108 @@ class Transfer(RaveBase):
         }
         return self._handleTransferStatusRequests(endpoint, data=data, isPostRequest=True)
 
-    
+    def _handleResolveResponse(self, response, accountNumber, bankCode):
+        # Checks if it can be parsed to json
+        try:
+            responseJson = response.json()
+        except:
+            raise ServerError({"error": True, "errMsg": response.text })
+
+        # The account details are nested in data.data
+        data = (responseJson.get("data", None) or {}).get("data", None) or {}
+        if not response.ok or data.get("responsecode", None) != "00":
+            errMsg = data.get("responsemessage", None) or responseJson.get("message", "Server is down")
+            raise AccountResolveError({"error": True, "accountNumber": accountNumber, "bankCode": bankCode, "errMsg": errMsg})
+
+        return {"error": False, "accountNumber": accountNumber, "bankCode": bankCode, "accountName": data.get("accountname", None), "cached": False}
+
+    @acceptsDeadline
+    def resolveAccount(self, accountNumber, bankCode, cache=None):
+        """ This resolves an account number to the name on the account.\n
+             Parameters include:\n
+            accountNumber (string) -- This is the beneficiary account number\n
+            bankCode (string) -- This is the beneficiary bank code e.g. "044"\n
+            cache (AccountCache) -- (optional) If passed, cached resolutions are returned without a network call and new ones are stored
+        """
+        if cache:
+            cached = cache.get(bankCode, accountNumber)
+            if cached:
+                cached.update({"cached": True})
+                return cached
+
+        # Collating request headers
+        headers = {
+            'content-type': 'application/json',
+        }
+        payload = {
+            "recipientaccount": accountNumber,
+            "destbankcode": bankCode,
+            "PBFPubKey": self._getPublicKey()
+        }
+
+        endpoint = self._baseUrl + self._endpointMap["transfer"]["accountVerification"]
+        response = self._transport.post(endpoint, headers=headers, data=json.dumps(payload))
+        res = self._handleResolveResponse(response, accountNumber, bankCode)
+
+        if cache:
+            cache.set(bankCode, accountNumber, res)
+        return res
+
+    @acceptsDeadline
+    def resolveAccounts(self, accounts, concurrency=8, cache=None, recentSize=1024):
+        """ This resolves many accounts, yielding one result per account in the order they were passed.\n
+             Parameters include:\n
+            accounts (iterable) -- These are (accountNumber, bankCode) tuples or transfer payloads containing "account_number" and "account_bank"\n
+            concurrency (int or AdaptiveLimiter) -- (optional) This is the maximum number of resolve calls in flight\n
+            cache (AccountCache) -- (optional) This is used to skip accounts resolved in previous runs\n
+            recentSize (int) -- (optional) This is how many recent accounts are remembered so that repeats in the same run are resolved once\n
+            \n
+            Failed resolutions are yielded as {"error": True, ...} instead of being raised so one bad account does not stop the batch
+        """
+        # Repeated recipients in the same run are only resolved once. A repeat that arrives while the first is still in
+        # flight waits for its future instead of sending a second call
+        lock = threading.Lock()
+        recent = OrderedDict()
+
+        def resolve(account):
+            key = _accountKey(account)
+            with lock:
+                future = recent.get(key, None)
+                owner = future is None
+                if owner:
+                    future = recent[key] = Future()
+                    if len(recent) > recentSize:
+                        recent.popitem(last=False)
+                else:
+                    recent.move_to_end(key)
+            if owner:
+                try:
+                    future.set_result(self.resolveAccount(key[0], key[1], cache=cache))
+                except Exception as e:
+                    future.set_exception(e)
+                    # Failures are not remembered, so a later repeat tries again
+                    with lock:
+                        if recent.get(key, None) is future:
+                            del recent[key]
+            # Every repeat gets a copy so that changing one result does not change the others
+            return dict(future.result())
+
+        for account, res, err in imapBounded(resolve, accounts, concurrency):
+            if err is None:
+                yield res
+            elif isinstance(err, AccountResolveError):
+                yield dict(err.err)
+            elif isinstance(err, (RaveError, requests.exceptions.RequestException)):
+                # As in Preauth.settle, a server or network error fails this account only
+                accountNumber, bankCode = _accountKey(account)
+                errMsg = err.err.get("errMsg", None) if hasattr(err, "err") else str(err)
+                yield {"error": True, "accountNumber": accountNumber, "bankCode": bankCode, "errMsg": errMsg}
+            else:
+                raise err
+
 
+def _accountKey(account):
+    """ This returns (accountNumber, bankCode) for an account tuple or transfer payload """
+    if isinstance(account, dict):
+        return str(account["account_number"]), str(account["account_bank"])
+    return str(account[0]), str(account[1])
@@ -0,0 +1,395 @@
+""" The HTTP transport shared by all rave components """
+import functools, gzip, socket, threading, time
+import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+from urllib3.util.connection import allowed_gai_family
+from python_rave.rave_deadline import currentDeadline
+from python_rave.rave_exceptions import DeadlineExceededError
+
+try:
+    from urllib.parse import urlsplit
+except ImportError:
+    from urlparse import urlsplit
+
+# Keys of the baseUrls dict, indexed by the production flag
+_environments = ["sandbox", "production"]
+# Words in a 4xx response that show the server could not read a compressed body, rather than refusing what it said
+_decodeErrorHints = ["decod", "compress", "gzip", "content-encoding", "malformed", "pars", "invalid json", "unexpected token", "unexpected end"]
+
+
+class DnsCache(object):
+    """ This caches getaddrinfo results for a set of hosts. Each transport has its own, used only by its own connections. It contains the following public functions:\n
+        .add -- This adds a host whose lookups are cached\n
+        .resolve -- This resolves a host now and returns its addresses\n
+        .clear -- This drops every cached result\n
+        \n
+        Lookups for hosts that were not added are passed straight through
+    """
+    def __init__(self, ttl=300):
+        """ Parameters include:\n
+            ttl (Number) -- (optional) This is how long in seconds a lookup is reused
+        """
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._hosts = set()
+        self._results = {}
+
+    def add(self, host):
+        with self._lock:
+            self._hosts.add(host)
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+
+    def getaddrinfo(self, host, port, *args, **kwargs):
+        if host not in self._hosts:
+            return socket.getaddrinfo(host, port, *args, **kwargs)
+        key = (host, port, args, tuple(sorted(kwargs.items())))
+        with self._lock:
+            cached = self._results.get(key, None)
+        if cached and cached[0] > time.time():
+            return cached[1]
+        # Resolving happens outside the lock so a slow lookup does not block other hosts
+        result = socket.getaddrinfo(host, port, *args, **kwargs)
+        with self._lock:
+            self._results[key] = (time.time() + self.ttl, result)
+        return result
+
+    def resolve(self, host, port):
+        """ This returns the addresses of host, filling the cache used by new connections """
+        self.add(host)
+        return sorted(set(info[4][0] for info in self.getaddrinfo(host, port, 0, socket.SOCK_STREAM)))
+
+
+class _CachedDnsConnection(object):
+    """ This is mixed into the urllib3 connection classes so that new connections look their host up in .dnsCache, set by their pool """
+    dnsCache = None
+
+    def _new_conn(self):
+        try:
+            sock = _createConnection(self.dnsCache, (self._dns_host, self.port), self.timeout, self.source_address, self.socket_options)
+        except socket.timeout:
+            raise ConnectTimeoutError(self, "Connection to {} timed out. (connect timeout={})".format(self.host, self.timeout))
+        except OSError as e:
+            # DNS failures included, as urllib3 does
+            raise NewConnectionError(self, "Failed to establish a new connection: {}".format(e))
+        return sock
+
+
+class _CachedDnsPool(object):
+    """ This is mixed into the urllib3 pool classes. It takes the dnsCache of its adapter as a keyword and hands it to every connection it opens """
+    def __init__(self, *args, **kwargs):
+        self.dnsCache = kwargs.pop("dnsCache")
+        super(_CachedDnsPool, self).__init__(*args, **kwargs)
+
+    def _new_conn(self):
+        connection = super(_CachedDnsPool, self)._new_conn()
+        connection.dnsCache = self.dnsCache
+        return connection
+
+
+def _createConnection(dnsCache, address, timeout, sourceAddress, socketOptions):
+    """ This is urllib3's create_connection with lookups going through dnsCache instead of socket.getaddrinfo """
+    host, port = address
+    err = None
+    for family, socktype, proto, _, socketAddress in dnsCache.getaddrinfo(host, port, allowed_gai_family(), socket.SOCK_STREAM):
+        sock = None
+        try:
+            sock = socket.socket(family, socktype, proto)
+            for option in socketOptions or ():
+                sock.setsockopt(*option)
+            # urllib3 passes a sentinel when no timeout was given
+            if timeout is None or isinstance(timeout, (int, float)):
+                sock.settimeout(timeout)
+            if sourceAddress:
+                sock.bind(sourceAddress)
+            sock.connect(socketAddress)
+            return sock
+        except OSError as e:
+            err = e
+            if sock is not None:
+                sock.close()
+    if err is not None:
+        raise err
+    raise OSError("getaddrinfo returned an empty list for {}".format(host))
+
+
+class _CachedDnsHTTPConnectionPool(_CachedDnsPool, HTTPConnectionPool):
+    ConnectionCls = type("HTTPConnection", (_CachedDnsConnection, HTTPConnectionPool.ConnectionCls), {})
+
+
+class _CachedDnsHTTPSConnectionPool(_CachedDnsPool, HTTPSConnectionPool):
+    ConnectionCls = type("HTTPSConnection", (_CachedDnsConnection, HTTPSConnectionPool.ConnectionCls), {})
+
+
+class _CachedDnsAdapter(HTTPAdapter):
+    """ This is an HTTPAdapter whose connections resolve hosts through a DnsCache. Nothing outside the sessions it is mounted on is affected """
+    def __init__(self, dnsCache, **kwargs):
+        # HTTPAdapter.__init__ calls init_poolmanager, which needs the cache
+        self._dnsCache = dnsCache
+        super(_CachedDnsAdapter, self).__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super(_CachedDnsAdapter, self).init_poolmanager(*args, **kwargs)
+        # The pool classes are shared by every adapter, so the cache is bound as a keyword of their constructor
+        self.poolmanager.pool_classes_by_scheme = {"http": functools.partial(_CachedDnsHTTPConnectionPool, dnsCache=self._dnsCache), "https": functools.partial(_CachedDnsHTTPSConnectionPool, dnsCache=self._dnsCache)}
+
+
+class RaveTransport(object):
+    """ This sends every HTTP request made by the rave components. It contains the following public functions:\n
+        .post -- This sends a POST request\n
+        .get -- This sends a GET request\n
+        .warmup -- This resolves every base url and opens pooled connections to it ahead of the first call\n
+        .health -- This returns the health score of every base url\n
+        .close -- This closes all pooled connections\n
+        \n
+        A transport is safe to share between threads. It holds no per-request state and reuses connections from a pool, so a single Rave object (and its transport) can serve a whole thread pool\n
+        \n
+        With more than one base url for an environment, requests that cannot connect are retried on the next healthiest base url. Only connection failures are retried for POST requests, since a POST that reached the server may already have charged\n
+        \n
+        While a Deadline is active, each request's timeout is cut to the time left and a DeadlineExceededError is raised once it runs out
+    """
+    def __init__(self, poolSize=10, timeout=None, session=None, baseUrls=None, dnsTtl=300, failurePenaltyHalfLife=30, compressAbove=None):
+        """ Parameters include:\n
+            poolSize (int) -- (optional) This is the number of connections kept open per host. Set it close to the number of threads sharing the transport\n
+            timeout (Number) -- (optional) This is the default timeout in seconds for every request\n
+            session (requests.Session) -- (optional) This is a preconfigured session to use instead of creating one\n
+            baseUrls (dict) -- (optional) These are the base urls to use per environment in order of preference e.g. {"production": ["https://api.ravepay.co/", "https://backup.example.com/"]}. Environments not listed use the default base url\n
+            dnsTtl (Number) -- (optional) This is how long in seconds this transport's connections reuse DNS lookups of the base url hosts. Set it to None to resolve on every new connection. It is not used with a session of your own\n
+            failurePenaltyHalfLife (Number) -- (optional) This is how fast in seconds a failed base url recovers its health score\n
+            compressAbove (int) -- (optional) Request bodies larger than this many bytes are sent gzip compressed. Off by default. A host that answers 415, or any other 4xx saying it could not decode the body, gets uncompressed bodies from then on
+        """
+        self._timeout = timeout
+        self._poolSize = poolSize
+        self._compressAbove = compressAbove
+        # Hosts that refused a compressed body
+        self._uncompressedHosts = set()
+        # The cache is used by this transport's own connections only, so each transport keeps its own ttl
+        self._dnsCache = DnsCache(dnsTtl) if dnsTtl and session is None else None
+        self._session = session if session is not None else self._newSession(poolSize)
+
+        self._lock = threading.Lock()
+        self._baseUrls = dict((environment, [_withSlash(url) for url in urls]) for environment, urls in (baseUrls or {}).items())
+        for environment in self._baseUrls:
+            if environment not in _environments:
+                raise ValueError("baseUrls keys must be \"sandbox\" or \"production\"")
+        self._halfLife = failurePenaltyHalfLife
+        # Per base url: [decayed failure count, time of last update, average latency]
+        self._health = {}
+        for urls in self._baseUrls.values():
+            self._register(urls)
+
+    def _newSession(self, poolSize):
+        """ This returns the session requests are sent on. Transports that send them some other way return None """
+        session = requests.Session()
+        if self._dnsCache:
+            adapter = _CachedDnsAdapter(self._dnsCache, pool_connections=poolSize, pool_maxsize=poolSize)
+        else:
+            adapter = HTTPAdapter(pool_connections=poolSize, pool_maxsize=poolSize)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def _register(self, urls):
+        with self._lock:
+            for url in urls:
+                self._health.setdefault(url, [0.0, time.time(), None])
+        if self._dnsCache:
+            for url in urls:
+                self._dnsCache.add(urlsplit(url).hostname)
+
+    def baseUrl(self, production, default):
+        """ This returns the preferred base url of an environment. It is called by the rave components when they are created """
+        urls = self._baseUrls.get(_environments[production], None)
+        if not urls:
+            urls = self._baseUrls.setdefault(_environments[production], [default])
+            self._register(urls)
+        return urls[0]
+
+    def _penalty(self, url, now):
+        failures, updatedAt, latency = self._health[url]
+        return failures * 0.5 ** ((now - updatedAt) / self._halfLife)
+
+    def _candidates(self, url):
+        """ This returns (path, base urls ordered by health) for a url under a known base url, or (None, None) """
+        for urls in self._baseUrls.values():
+            for base in urls:
+                if url.startswith(base):
+                    now = time.time()
+                    with self._lock:
+                        # Configured order breaks ties, so the primary is used again once its failures have decayed
+                        ranked = sorted(urls, key=lambda candidate: (round(self._penalty(candidate, now), 1), urls.index(candidate)))
+                    return url[len(base):], ranked
+        return None, None
+
+    def _recordFailure(self, url):
+        now = time.time()
+        with self._lock:
+            health = self._health[url]
+            health[0] = self._penalty(url, now) + 1
+            health[1] = now
+
+    def _recordSuccess(self, url, seconds):
+        now = time.time()
+        with self._lock:
+            health = self._health[url]
+            health[0] = self._penalty(url, now)
+            health[1] = now
+            health[2] = seconds if health[2] is None else 0.8 * health[2] + 0.2 * seconds
+
+    def health(self):
+        """ This returns {baseUrl: {"penalty": decayed recent failures, "latency": average seconds}} for every known base url """
+        now = time.time()
+        with self._lock:
+            return dict((url, {"penalty": self._penalty(url, now), "latency": self._health[url][2]}) for url in self._health)
+
+    def _exchange(self, method, url, headers, data, timeout, stream):
+        """ This sends one request on the session. Transports built on another HTTP client override it """
+        return self._session.request(method, url, headers=headers, data=data, timeout=timeout, stream=stream)
+
+    def _send(self, method, url, headers, data, timeout, stream):
+        """ This sends one request, limiting its timeout to what is left of the current Deadline """
+        deadline = currentDeadline()
+        if deadline is None:
+            return self._exchange(method, url, headers, data, timeout, stream)
+        budget = deadline.timeout(timeout)
+        try:
+            return self._exchange(method, url, headers, data, budget, stream)
+        except requests.exceptions.Timeout:
+            # Only a timeout cut short by the deadline is a deadline error
+            if timeout is None or budget < timeout:
+                raise DeadlineExceededError({"error": True, "budget": deadline.seconds, "errMsg": "Deadline of {}s ran out waiting for {}".format(deadline.seconds, url.split("?")[0])})
+            raise
+
+    def _compress(self, url, headers, data):
+        """ This returns (headers, gzipped data) if the body should be compressed, otherwise None """
+        if self._compressAbove is None or not data or len(data) <= self._compressAbove:
+            return None
+        if urlsplit(url).netloc in self._uncompressedHosts:
+            return None
+        body = gzip.compress(data.encode("utf-8") if isinstance(data, str) else data, 6)
+        if len(body) >= len(data):
+            return None
+        headers = dict(headers or {})
+        headers["Content-Encoding"] = "gzip"
+        return headers, body
+
+    def request(self, method, url, headers=None, data=None, timeout=None, stream=False):
+        if timeout is None:
+            timeout = self._timeout
+        compressed = self._compress(url, headers, data)
+        if compressed is None:
+            return self._failover(method, url, headers, data, timeout, stream)
+        response = self._failover(method, url, compressed[0], compressed[1], timeout, stream)
+        if not _refusedCompression(response):
+            return response
+        # The server does not take compressed bodies and turned the request away without acting on it, so it is sent again as it was
+        with self._lock:
+            self._uncompressedHosts.add(urlsplit(url).netloc)
+        response.close()
+        return self._failover(method, url, headers, data, timeout, stream)
+
+    def _failover(self, method, url, headers, data, timeout, stream):
+        """ This sends a request to the healthiest base url, moving on to the next one when it is safe to """
+        path, candidates = self._candidates(url)
+        if not candidates:
+            return self._send(method, url, headers, data, timeout, stream)
+
+        for attempt, base in enumerate(candidates, 1):
+            startedAt = time.time()
+            try:
+                # Once the deadline has run out this raises instead of trying the next base url
+                response = self._send(method, base + path, headers, data, timeout, stream)
+            except requests.exceptions.ConnectionError as e:
+                self._recordFailure(base)
+                if attempt == len(candidates) or not _canRetry(method, e):
+                    raise
+                continue
+            # Server errors on reads are safe to retry elsewhere. Writes are returned as they are
+            if response.status_code >= 500 and method == "GET" and attempt < len(candidates):
+                self._recordFailure(base)
+                response.close()
+                continue
+            self._recordSuccess(base, time.time() - startedAt)
+            return response
+
+    def post(self, url, headers=None, data=None, timeout=None, stream=False):
+        return self.request("POST", url, headers=headers, data=data, timeout=timeout, stream=stream)
+
+    def get(self, url, headers=None, timeout=None, stream=False):
+        return self.request("GET", url, headers=headers, timeout=timeout, stream=stream)
+
+    def warmup(self, connections=None, timeout=5):
+        """ This resolves every known base url and opens connections to it so that the first calls do not pay for DNS and TLS handshakes.\n
+             Parameters include:\n
+            connections (int) -- (optional) This is the number of connections to open per base url. It defaults to the pool size\n
+            timeout (Number) -- (optional) This is the timeout in seconds for each warmup request\n
+            \n
+            Returns {baseUrl: {"addresses": [...], "connections": int, "seconds": Number, "error": string or None}}
+        """
+        connections = min(connections or self._poolSize, self._poolSize)
+        with self._lock:
+            urls = list(self._health)
+
+        report = {}
+        with ThreadPoolExecutor(max_workers=connections) as executor:
+            for url in urls:
+                parts = urlsplit(url)
+                startedAt = time.time()
+                result = {"addresses": [], "connections": 0, "error": None}
+                try:
+                    port = parts.port or (443 if parts.scheme == "https" else 80)
+                    if self._dnsCache:
+                        result["addresses"] = self._dnsCache.resolve(parts.hostname, port)
+                    else:
+                        result["addresses"] = sorted(set(info[4][0] for info in socket.getaddrinfo(parts.hostname, port, 0, socket.SOCK_STREAM)))
+                    # Probes run at the same time so that each needs a connection of its own
+                    for future in [executor.submit(self._probe, url, timeout) for _ in range(connections)]:
+                        future.result()
+                        result["connections"] += 1
+                except (socket.error, requests.exceptions.RequestException) as e:
+                    self._recordFailure(url)
+                    result["error"] = str(e)
+                else:
+                    self._recordSuccess(url, (time.time() - startedAt) / max(connections, 1))
+                result["seconds"] = time.time() - startedAt
+                report[url] = result
+        return report
+
+    def _probe(self, url, timeout):
+        # Any response means a connection was opened. HEAD keeps the body out of it
+        self._exchange("HEAD", url, None, None, timeout, False).close()
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+
+
+def _withSlash(url):
+    return url if url.endswith("/") else url + "/"
+
+
+def _refusedCompression(response):
+    """ This returns True if a response to a compressed request says the server could not read the body. Servers answer 415 or, more often, a plain 400 or 422 """
+    if response.status_code == 415:
+        return True
+    if not 400 <= response.status_code < 500:
+        return False
+    # Error bodies are short. Reading one keeps it on the response, so a streamed response can still be iterated
+    text = response.content[:2048].decode("utf-8", "replace").lower()
+    return any(hint in text for hint in _decodeErrorHints)
+
+
+def _canRetry(method, err):
+    """ This tells whether a failed request can be sent again. POST requests are only retried if they never reached the server """
+    if method in ("GET", "HEAD"):
+        return True
+    if isinstance(err, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(err.args[0], "reason", None) if err.args else None
+    # NewConnectionError (refused, unreachable, DNS failure) is a ConnectTimeoutError
+    return isinstance(reason, ConnectTimeoutError)
@@ -2,15 +2,17 @@ from python_rave.rave_exceptions import UssdChargeError, ServerError
 
 from python_rave.rave_payment import Payment
 from python_rave.rave_misc import generateTransactionReference
-import json
+from python_rave.rave_validation import validateAccountDetails, USSD_BANK_CODES
+from python_rave.rave_deadline import acceptsDeadline
+import json, copy
 
 class Ussd(Payment):
-    def __init__(self, publicKey, secretKey, production, usingEnv):
+    def __init__(self, publicKey, secretKey, production, usingEnv, transport=None):
         """ This is the rave object for ussd transactions. It contains the following public functions:\n
         .charge -- This is for making a ussd charge\n
         .verify -- This checks the status of your transaction\n
         """
-        super(Ussd, self).__init__(publicKey, secretKey, production, usingEnv)
+        super(Ussd, self).__init__(publicKey, secretKey, production, usingEnv, transport)
         
 
     def _handleChargeResponse(self, response, txRef, request):
@@ -38,15 +40,19 @@ class Ussd(Payment):
 
 
     # Charge ussd function
-    def charge(self, ussdDetails, hasFailed=False):
+    @acceptsDeadline
+    def charge(self, ussdDetails, hasFailed=False, preflight=True):
         """ This is used to charge through ussd.\n
              Parameters are:\n
             ussdDetails (dict) -- This is a dictionary comprising payload parameters.\n
-            hasFailed (bool) -- This indicates whether the request had previously failed for timeout handling
+            hasFailed (bool) -- This indicates whether the request had previously failed for timeout handling\n
+            preflight (bool) -- (optional) If True, the bank code and account number are checked locally before the request is sent
         """
 
         endpoint = self._baseUrl + self._endpointMap["account"]["charge"]
 
+        # Working on a copy so the caller's dict is never modified
+        ussdDetails = copy.copy(ussdDetails)
         # Add boilerplate ussd code
         ussdDetails.update({"is_ussd": "1", "payment_type": "ussd"})
         # if transaction reference is not present, generate
@@ -56,6 +62,9 @@ class Ussd(Payment):
             ussdDetails.update({"orderRef": generateTransactionReference()})
         # Checking for required ussd components (not checking for payment_type, is_ussd, txRef or orderRef again to increase efficiency)
         requiredParameters = ["accountbank", "accountnumber", "amount", "email", "phonenumber", "IP"]
+        # Only some banks support ussd so we check against that list
+        if preflight:
+            validateAccountDetails(ussdDetails, bankCodes=USSD_BANK_CODES)
 
         # Should return request is a less efficient call but it is required here because we need bank code in _handleResponses
         return super(Ussd, self).charge(ussdDetails, requiredParameters, endpoint, shouldReturnRequest=True)
@@ -0,0 +1,150 @@
+""" Local pre-flight validation of payment details. These checks run before encryption so bad requests never leave the process """
+import re, datetime
+from python_rave.rave_exceptions import InvalidPaymentDetailsError
+
+# Compact BIN range table: (length of prefix, first prefix, last prefix, network, valid card lengths)
+# More specific ranges come first because some networks sit inside broader ones (e.g. Verve inside 65)
+_binTable = sorted([
+    (6, 506099, 506198, "verve", (16, 18, 19)),
+    (6, 650002, 650027, "verve", (16, 18, 19)),
+    (4, 2221, 2720, "mastercard", (16,)),
+    (4, 3528, 3589, "jcb", (16, 17, 18, 19)),
+    (4, 6011, 6011, "discover", (16, 17, 18, 19)),
+    (3, 300, 305, "diners", (14, 15, 16, 17, 18, 19)),
+    (3, 644, 649, "discover", (16, 17, 18, 19)),
+    (2, 34, 34, "amex", (15,)),
+    (2, 37, 37, "amex", (15,)),
+    (2, 36, 36, "diners", (14, 15, 16, 17, 18, 19)),
+    (2, 38, 39, "diners", (14, 15, 16, 17, 18, 19)),
+    (2, 51, 55, "mastercard", (16,)),
+    (2, 62, 62, "unionpay", (16, 17, 18, 19)),
+    (2, 65, 65, "discover", (16, 17, 18, 19)),
+    (1, 4, 4, "visa", (13, 16, 19)),
+], key=lambda entry: -entry[0])
+
+# Nigerian bank codes that can be charged through the account endpoint
+ACCOUNT_BANK_CODES = {
+    "044": "Access Bank",
+    "023": "Citibank",
+    "063": "Diamond Bank",
+    "050": "Ecobank",
+    "070": "Fidelity Bank",
+    "011": "First Bank",
+    "214": "First City Monument Bank",
+    "058": "Guaranty Trust Bank",
+    "030": "Heritage Bank",
+    "301": "Jaiz Bank",
+    "082": "Keystone Bank",
+    "526": "Parallex Bank",
+    "076": "Polaris Bank",
+    "101": "Providus Bank",
+    "221": "Stanbic IBTC Bank",
+    "068": "Standard Chartered Bank",
+    "232": "Sterling Bank",
+    "100": "Suntrust Bank",
+    "032": "Union Bank",
+    "033": "United Bank for Africa",
+    "215": "Unity Bank",
+    "035": "Wema Bank",
+    "057": "Zenith Bank",
+}
+
+# Banks that support ussd charges
+USSD_BANK_CODES = {
+    "058": "Guaranty Trust Bank",
+    "057": "Zenith Bank",
+}
+
+_digits = re.compile(r"^[0-9]+$")
+# Doubled luhn digits, precomputed so the checksum is a single pass of lookups
+_luhnDoubled = (0, 2, 4, 6, 8, 1, 3, 5, 7, 9)
+
+
+def _fail(details, field, errMsg):
+    raise InvalidPaymentDetailsError({"error": True, "txRef": details.get("txRef", None), "field": field, "errMsg": errMsg})
+
+
+def luhnCheck(number):
+    """ This returns True if number (string of digits) passes the luhn checksum """
+    total = 0
+    double = False
+    for char in reversed(number):
+        digit = ord(char) - 48
+        total += _luhnDoubled[digit] if double else digit
+        double = not double
+    return total % 10 == 0
+
+
+def _lookupBin(cardno):
+    for entry in _binTable:
+        prefixLength, first, last = entry[0], entry[1], entry[2]
+        if len(cardno) >= prefixLength and first <= int(cardno[:prefixLength]) <= last:
+            return entry
+    return None
+
+
+def getCardNetwork(cardno):
+    """ This returns the card network (e.g. "visa", "mastercard", "verve") for a card number, or None if it is not in the BIN table """
+    cardno = str(cardno).replace(" ", "")
+    if not _digits.match(cardno):
+        return None
+    entry = _lookupBin(cardno)
+    return entry[3] if entry else None
+
+
+def validateCardDetails(cardDetails, now=None):
+    """ This checks card details locally and raises an InvalidPaymentDetailsError describing the first bad field.\n
+         Parameters include:\n
+        cardDetails (dict) -- This is the card charge payload\n
+        now (datetime) -- (optional) This is the date expiry is checked against. Defaults to today\n
+        \n
+        Missing fields are skipped here because the charge call reports them with IncompletePaymentDetailsError
+    """
+    if "cardno" in cardDetails:
+        cardno = str(cardDetails["cardno"]).replace(" ", "")
+        if not _digits.match(cardno) or not 12 <= len(cardno) <= 19:
+            _fail(cardDetails, "cardno", "Card number must be 12 to 19 digits")
+        if not luhnCheck(cardno):
+            _fail(cardDetails, "cardno", "Card number failed the checksum, please check it and try again")
+        entry = _lookupBin(cardno)
+        if entry and len(cardno) not in entry[4]:
+            _fail(cardDetails, "cardno", "{} card numbers cannot be {} digits long".format(entry[3].capitalize(), len(cardno)))
+
+    if "cvv" in cardDetails:
+        cvv = str(cardDetails["cvv"])
+        if not _digits.match(cvv) or len(cvv) not in (3, 4):
+            _fail(cardDetails, "cvv", "cvv must be 3 or 4 digits")
+
+    if "expirymonth" in cardDetails and "expiryyear" in cardDetails:
+        month = str(cardDetails["expirymonth"])
+        year = str(cardDetails["expiryyear"])
+        if not _digits.match(month) or not 1 <= int(month) <= 12:
+            _fail(cardDetails, "expirymonth", "expirymonth must be between 01 and 12")
+        if not _digits.match(year) or len(year) not in (2, 4):
+            _fail(cardDetails, "expiryyear", "expiryyear must be 2 or 4 digits")
+
+        now = now or datetime.date.today()
+        year = int(year) + (2000 if len(year) == 2 else 0)
+        # Cards are valid until the end of their expiry month
+        if (year, int(month)) < (now.year, now.month):
+            _fail(cardDetails, "expiryyear", "This card expired in {:02d}/{}".format(int(month), year))
+
+    return True
+
+
+def validateAccountDetails(accountDetails, bankCodes=ACCOUNT_BANK_CODES):
+    """ This checks bank account details locally and raises an InvalidPaymentDetailsError describing the first bad field.\n
+         Parameters include:\n
+        accountDetails (dict) -- This is the account (or ussd) charge payload\n
+        bankCodes (dict) -- (optional) These are the bank codes accepted for this charge
+    """
+    if "accountbank" in accountDetails:
+        if str(accountDetails["accountbank"]) not in bankCodes:
+            _fail(accountDetails, "accountbank", "\"{}\" is not a supported bank code. Supported codes are: {}".format(accountDetails["accountbank"], ", ".join(sorted(bankCodes))))
+
+    if "accountnumber" in accountDetails:
+        accountNumber = str(accountDetails["accountnumber"])
+        if not _digits.match(accountNumber) or len(accountNumber) != 10:
+            _fail(accountDetails, "accountnumber", "accountnumber must be a 10 digit NUBAN account number")
+
+    return True
@@ -0,0 +1,240 @@
+""" Watching bulk transfer batches until every transfer in them has settled.
+
+A BatchWatcher keeps an index of the status of every transfer in the batches it watches. The first poll of a batch
+reads all of its pages. Later polls only read the pages that still hold unsettled transfers (and any new pages
+while Rave is still creating the batch), so a batch of thousands that is nearly done costs a page or two per poll.
+Batches with nothing changing are polled less and less often.
+
+    watcher = BatchWatcher(rave.Transfer, onComplete=lambda summary: print(summary))
+    watcher.watch(batchId)
+    watcher.run()
+"""
+import time
+from python_rave.rave_batch import imapBounded
+
+# Statuses a transfer does not leave
+FINAL_STATUSES = ("SUCCESSFUL", "FAILED")
+
+
+class _Batch(object):
+    def __init__(self, batchId, interval, expected):
+        self.batchId = batchId
+        self.expected = expected
+        self.total = None
+        self.totalPages = None
+        # reference -> status, and page -> references found on it
+        self.statuses = {}
+        self.pages = {}
+        self.pendingPages = set([1])
+        self.deferredPages = set()
+        self.counts = {}
+        self.failed = []
+        self.complete = False
+        self.reported = False
+        self.polls = 0
+        self.pagesFetched = 0
+        self.lastError = None
+        self.interval = interval
+        self.nextPollAt = 0
+
+
+class BatchWatcher(object):
+    """ This follows bulk transfer batches to completion. It contains the following public functions:\n
+        .watch -- This starts watching a batch id\n
+        .unwatch -- This stops watching a batch id\n
+        .poll -- This polls every batch that is due once and returns the transfer status changes seen\n
+        .run -- This polls until every watched batch is complete\n
+        .summary -- This returns the status index of a batch\n
+        \n
+        Callbacks run in the thread calling poll/run: onChange(change) for every transfer whose status changed, onComplete(summary) once per batch when every transfer in it has a final status
+    """
+    def __init__(self, transfer, minInterval=2, maxInterval=60, backoff=1.5, concurrency=4, finalStatuses=FINAL_STATUSES, failedStatus="FAILED", onChange=None, onComplete=None):
+        """ Parameters include:\n
+            transfer (Transfer) -- This is the rave.Transfer object used to fetch batches\n
+            minInterval (Number) -- (optional) This is the seconds between polls of a batch whose transfers are changing\n
+            maxInterval (Number) -- (optional) This is the most seconds between polls of a batch that is not changing\n
+            backoff (Number) -- (optional) The interval of a batch is multiplied by this after each poll that changed nothing\n
+            concurrency (int or AdaptiveLimiter) -- (optional) This is the number of pages fetched at once\n
+            finalStatuses (tuple) -- (optional) These are the statuses a transfer has settled in\n
+            failedStatus (string) -- (optional) The references of transfers with this status are listed in the summary\n
+            onChange (callable) -- (optional) This is called with {"batchId", "reference", "from", "to", "transfer"} for each status change\n
+            onComplete (callable) -- (optional) This is called with the summary of a batch when it completes
+        """
+        self._transfer = transfer
+        self._minInterval = minInterval
+        self._maxInterval = maxInterval
+        self._backoff = backoff
+        self._concurrency = concurrency
+        self._finalStatuses = tuple(finalStatuses)
+        self._failedStatus = failedStatus
+        self._onChange = onChange
+        self._onComplete = onComplete
+        self._batches = {}
+
+    def watch(self, batchId, expected=None):
+        """ This starts watching a batch.\n
+             Parameters include:\n
+            batchId (string) -- This is the id returned by Transfer.bulk\n
+            expected (int) -- (optional) This is the number of transfers sent in the batch, e.g. len(bulk_data). The batch is not complete until that many have been seen
+        """
+        batchId = str(batchId)
+        if batchId not in self._batches:
+            self._batches[batchId] = _Batch(batchId, self._minInterval, expected)
+        return self
+
+    def unwatch(self, batchId):
+        self._batches.pop(str(batchId), None)
+
+    def summary(self, batchId):
+        """ This returns {"batchId", "total", "expected", "seen", "counts", "failed", "complete", "polls", "pagesFetched", "lastError"} for a watched batch """
+        batch = self._batches[str(batchId)]
+        return {
+            "batchId": batch.batchId,
+            "total": batch.total,
+            "expected": batch.expected,
+            "seen": len(batch.statuses),
+            "counts": dict(batch.counts),
+            "failed": list(batch.failed),
+            "complete": batch.complete,
+            "polls": batch.polls,
+            "pagesFetched": batch.pagesFetched,
+            "lastError": batch.lastError,
+        }
+
+    def summaries(self):
+        return [self.summary(batchId) for batchId in self._batches]
+
+    @property
+    def complete(self):
+        return all(batch.complete for batch in self._batches.values())
+
+    def _fetchPage(self, request):
+        batchId, page = request
+        envelope = {}
+        transfers = list(self._transfer.fetch(page=page, batch_id=batchId, stream=True, envelope=envelope))
+        pageInfo = (envelope.get("data", None) or {}).get("page_info", None) or {}
+        return transfers, pageInfo
+
+    def _settled(self, status):
+        return status in self._finalStatuses
+
+    def _apply(self, batch, page, transfers, pageInfo, changes):
+        """ This updates the index of a batch with one fetched page """
+        batch.pagesFetched += 1
+        references = []
+        for transfer in transfers:
+            reference = str(transfer.get("reference", None) or transfer.get("id", None))
+            status = transfer.get("status", None)
+            references.append(reference)
+            previous = batch.statuses.get(reference, None)
+            if previous == status:
+                continue
+            batch.statuses[reference] = status
+            if previous is not None:
+                batch.counts[previous] -= 1
+                if not batch.counts[previous]:
+                    del batch.counts[previous]
+            batch.counts[status] = batch.counts.get(status, 0) + 1
+            if status == self._failedStatus:
+                batch.failed.append(reference)
+            elif previous == self._failedStatus:
+                batch.failed.remove(reference)
+            changes.append({"batchId": batch.batchId, "reference": reference, "from": previous, "to": status, "transfer": transfer})
+
+        known = batch.pages.get(page, None)
+        if known is not None and not set(known) <= set(references) and len(references) >= len(known):
+            # The pages have been reordered, so every page is read again to find where the transfers went
+            batch.pendingPages.update(batch.pages)
+        batch.pages[page] = references
+        if any(not self._settled(batch.statuses[reference]) for reference in references):
+            batch.pendingPages.add(page)
+
+        if pageInfo:
+            batch.total = int(pageInfo.get("total", 0) or 0)
+            totalPages = int(pageInfo.get("total_pages", 0) or 0)
+            # Pages past the ones already known, e.g. new ones while Rave is still adding transfers to the batch
+            batch.pendingPages.update(range((batch.totalPages or 1) + 1, totalPages + 1))
+            batch.totalPages = totalPages
+
+    def _finishPoll(self, batch, changed):
+        expected = max(batch.total or 0, batch.expected or 0)
+        if batch.totalPages is not None and (not expected or len(batch.statuses) < expected):
+            # The batch is still growing, or Rave has not listed any of it yet (an empty first page), so its last page is read again
+            batch.pendingPages.add(batch.totalPages or 1)
+        batch.complete = batch.totalPages is not None and expected > 0 and not batch.pendingPages and len(batch.statuses) >= expected
+        batch.interval = self._minInterval if changed else min(self._maxInterval, batch.interval * self._backoff)
+        batch.nextPollAt = time.monotonic() + batch.interval
+
+    def poll(self):
+        """ This polls every incomplete batch that is due and returns the list of status changes. Fetch errors are kept in each summary's lastError """
+        now = time.monotonic()
+        due = [batch for batch in self._batches.values() if not batch.complete and batch.nextPollAt <= now]
+        changes = []
+        while due:
+            requests = []
+            for batch in due:
+                batch.polls += 1
+                # Pages are taken off the pending set here and put back by _apply if they still hold unsettled transfers
+                pages, batch.pendingPages = sorted(batch.pendingPages), set()
+                requests.extend((batch.batchId, page) for page in pages)
+
+            batchChanges = dict((batch.batchId, len(changes)) for batch in due)
+            failed = set()
+            for (batchId, page), result, err in imapBounded(self._fetchPage, requests, self._concurrency):
+                batch = self._batches[batchId]
+                if err is not None:
+                    batch.lastError = "{}: {}".format(type(err).__name__, err)
+                    batch.pendingPages.add(page)
+                    failed.add(batchId)
+                    continue
+                self._apply(batch, page, result[0], result[1], changes)
+
+            # A batch whose first poll only found out how many pages it has reads the rest straight away
+            again = []
+            for batch in due:
+                if batch.batchId not in failed:
+                    batch.lastError = None
+                if batch.batchId not in failed and batch.polls == 1 and any(page not in batch.pages for page in batch.pendingPages):
+                    # Pages already read in this poll wait for the next one
+                    batch.pendingPages, batch.deferredPages = set(page for page in batch.pendingPages if page not in batch.pages), set(page for page in batch.pendingPages if page in batch.pages)
+                    batch.polls = 0
+                    again.append(batch)
+                    continue
+                batch.pendingPages.update(batch.deferredPages)
+                batch.deferredPages = set()
+                self._finishPoll(batch, any(change["batchId"] == batch.batchId for change in changes[batchChanges[batch.batchId]:]))
+            due = again
+
+        for change in changes:
+            if self._onChange:
+                self._onChange(change)
+        for batch in self._batches.values():
+            if batch.complete and not batch.reported:
+                batch.reported = True
+                if self._onComplete:
+                    self._onComplete(self.summary(batch.batchId))
+        return changes
+
+    def run(self, timeout=None, stop=None):
+        """ This polls until every watched batch is complete and returns their summaries.\n
+             Parameters include:\n
+            timeout (Number) -- (optional) This is the most seconds to wait. The summaries so far are returned when it runs out\n
+            stop (threading.Event) -- (optional) If set, it returns after the current poll
+        """
+        startedAt = time.monotonic()
+        while not self.complete and not (stop and stop.is_set()):
+            self.poll()
+            if self.complete:
+                break
+            wakeAt = min(batch.nextPollAt for batch in self._batches.values() if not batch.complete)
+            if timeout is not None:
+                if time.monotonic() - startedAt >= timeout:
+                    break
+                wakeAt = min(wakeAt, startedAt + timeout)
+            delay = wakeAt - time.monotonic()
+            if delay > 0:
+                if stop:
+                    stop.wait(delay)
+                else:
+                    time.sleep(delay)
+        return self.summaries()
@@ -21,5 +21,13 @@ setuptools.setup(
     install_requires = [
         'PyCrypto',
         'requests'
-    ]
+    ],
+    extras_require = {
+        'http2': ['httpx[http2]']
+    },
+    entry_points = {
+        'console_scripts': [
+            'rave-payout=python_rave.rave_payout:main'
+        ]
+    }
 )
\ No newline at end of file